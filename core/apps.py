@@ -1,6 +1,27 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.utils.module_loading import autodiscover_modules
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from .db import configure_sqlite, install_query_counter
+        from .perf import instrument_serializers
+        from .sharding import (
+            assign_shard_id,
+            mirror_reference_delete,
+            mirror_reference_save,
+        )
+
+        connection_created.connect(configure_sqlite)
+        connection_created.connect(install_query_counter)
+        pre_save.connect(assign_shard_id)
+        post_save.connect(mirror_reference_save)
+        post_delete.connect(mirror_reference_delete)
+        instrument_serializers()
+        # register the @task handlers in every app's tasks.py
+        autodiscover_modules("tasks")
@@ -0,0 +1,192 @@
+import asyncio
+import json
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpResponse
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from core import sharding
+
+_renderer = JSONRenderer()
+
+
+class ParseError(Exception):
+    pass
+
+
+def json_response(data, status=200, headers=None):
+    """Render ``data`` exactly like DRF's JSONRenderer would"""
+    return HttpResponse(
+        _renderer.render(data),
+        status=status,
+        content_type="application/json",
+        headers=headers,
+    )
+
+
+def request_data(request):
+    """Parse a JSON or form encoded body"""
+    if request.content_type == "application/json":
+        if not request.body:
+            return {}
+        try:
+            return json.loads(request.body)
+        except ValueError as e:
+            raise ParseError(f"JSON parse error - {e}")
+    return request.POST
+
+
+def async_api_view(methods, authenticated=True):
+    """
+    Async counterpart of DRF's ``api_view`` for plain Django async views.
+
+    Rejects other methods with 405, authenticates the token when
+    ``authenticated`` is set and exempts the view from CSRF checks, the
+    same as DRF does for token authenticated views.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        async def view(request, *args, **kwargs):
+            if request.method not in methods:
+                return json_response(
+                    {"detail": f'Method "{request.method}" not allowed.'},
+                    status=405,
+                    headers={"Allow": ", ".join(methods)},
+                )
+            try:
+                if authenticated:
+                    from users.authentication import aauthenticate
+
+                    await aauthenticate(request)
+                return await func(request, *args, **kwargs)
+            except ParseError as e:
+                return json_response({"detail": str(e)}, status=400)
+            except exceptions.APIException as e:
+                headers = None
+                if isinstance(e, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+                    headers = {"WWW-Authenticate": "Token"}
+                return json_response(
+                    {"detail": e.detail}, status=e.status_code, headers=headers
+                )
+
+        view.csrf_exempt = True
+        return view
+
+    return decorator
+
+
+def _read_in_worker(func):
+    @wraps(func)
+    def inner(*args):
+        close_old_connections()
+        try:
+            return func(*args)
+        finally:
+            close_old_connections()
+
+    return inner
+
+
+async def db_read(func, *args):
+    """
+    Run a read-only ORM callable from async code.
+
+    With ``ASYNC_CONCURRENT_READS`` on, each read runs on a pool thread with
+    its own connection so independent queries really overlap. Off (the
+    default, and required inside test transactions) reads share the
+    thread-sensitive executor, like Django's own async ORM methods.
+    """
+    if getattr(settings, "ASYNC_CONCURRENT_READS", False):
+        return await sync_to_async(_read_in_worker(func), thread_sensitive=False)(
+            *args
+        )
+    return await sync_to_async(func)(*args)
+
+
+async def get_or_404(queryset, **lookup):
+    obj = await db_read(lambda: sharding.find(queryset, **lookup))
+    if obj is None:
+        raise exceptions.NotFound()
+    return obj
+
+
+class AsyncPage:
+    """Page of results that renders like DRF's PageNumberPagination"""
+
+    def __init__(self, request, items, count, number, page_size):
+        self.request = request
+        self.items = items
+        self.count = count
+        self.number = number
+        self.page_size = page_size
+
+    @property
+    def num_pages(self):
+        if self.count == 0:
+            return 1
+        return -(-self.count // self.page_size)
+
+    def get_next_link(self):
+        if self.number >= self.num_pages:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, "page", self.number + 1)
+
+    def get_previous_link(self):
+        if self.number <= 1:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.number == 2:
+            return remove_query_param(url, "page")
+        return replace_query_param(url, "page", self.number - 1)
+
+    def response_data(self, results):
+        return {
+            "count": self.count,
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+            "results": results,
+        }
+
+
+async def paginate(request, queryset, *extra_reads):
+    """
+    Fetch one page of ``queryset`` together with its total count.
+
+    The count, the page and any ``extra_reads`` (zero-argument ORM
+    callables) are issued concurrently; returns the page and the extra
+    results in order.
+    """
+    page_size = api_settings.PAGE_SIZE
+    page_param = request.GET.get("page", 1)
+    try:
+        number = 1 if page_param == "last" else int(page_param)
+        if number < 1:
+            raise ValueError
+    except (TypeError, ValueError):
+        raise exceptions.NotFound("Invalid page.")
+
+    if page_param == "last":
+        count = await db_read(queryset.count)
+        number = max(1, -(-count // page_size))
+        reads = [lambda: count]
+    else:
+        reads = [queryset.count]
+
+    offset = (number - 1) * page_size
+    reads.append(lambda: list(queryset[offset : offset + page_size]))
+    reads.extend(extra_reads)
+
+    count, items, *extra = await asyncio.gather(*(db_read(read) for read in reads))
+
+    page = AsyncPage(request, items, count, number, page_size)
+    if number > page.num_pages:
+        raise exceptions.NotFound("Invalid page.")
+    return page, extra
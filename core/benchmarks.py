@@ -0,0 +1,241 @@
+"""
+Helpers shared by the benchmark management commands.
+"""
+import asyncio
+import contextlib
+import math
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.db import connections
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(values)))
+    return values[rank - 1]
+
+
+def summarize(latencies, elapsed, errors=0):
+    """Latency percentiles (ms) and throughput for one benchmark run"""
+    ordered = sorted(latencies)
+    count = len(ordered)
+    return {
+        "requests": count,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 4),
+        "rps": round(count / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(sum(ordered) / count * 1000, 3) if count else 0.0,
+        "p50_ms": round(percentile(ordered, 50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 3),
+    }
+
+
+async def asgi_request(app, method, url, headers=None, body=b""):
+    """
+    Send one HTTP request straight into an ASGI application.
+
+    Returns ``(status, headers, body)``; no network or server involved, so
+    only the application's own cost is measured.
+    """
+    parts = urlsplit(url)
+    raw_headers = [(b"host", b"localhost")]
+    for name, value in (headers or {}).items():
+        raw_headers.append((name.lower().encode(), value.encode()))
+    if body:
+        raw_headers.append((b"content-length", str(len(body)).encode()))
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": parts.path,
+        "raw_path": parts.path.encode(),
+        "query_string": parts.query.encode(),
+        "root_path": "",
+        "headers": raw_headers,
+        "client": ("127.0.0.1", 50000),
+        "server": ("localhost", 80),
+    }
+
+    request_sent = False
+    disconnected = asyncio.Event()
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    response = {"status": None, "headers": [], "body": []}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = message.get("headers", [])
+        elif message["type"] == "http.response.body":
+            response["body"].append(message.get("body", b""))
+
+    try:
+        await app(scope, receive, send)
+    finally:
+        disconnected.set()
+
+    return response["status"], response["headers"], b"".join(response["body"])
+
+
+async def run_asgi_load(app, urls, total, concurrency, headers=None):
+    """
+    Issue ``total`` GET requests, cycling through ``urls``, with at most
+    ``concurrency`` in flight. Returns a ``summarize`` dict.
+    """
+    latencies = []
+    errors = 0
+    queue = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(urls[i % len(urls)])
+
+    async def worker():
+        nonlocal errors
+        while True:
+            try:
+                url = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            start = time.perf_counter()
+            status, _, _ = await asgi_request(app, "GET", url, headers=headers)
+            latencies.append(time.perf_counter() - start)
+            if status >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+
+QUERY_COUNT_HEADER = "X-Query-Count"
+QUERY_TIME_HEADER = "X-Query-Time-Ms"
+
+
+class QueryCounter:
+    """Execute wrapper counting the queries run while it is installed and their time"""
+
+    def __init__(self):
+        self.queries = 0
+        self.elapsed = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.elapsed += time.perf_counter() - start
+            self.queries += 1
+
+    @contextlib.contextmanager
+    def installed(self):
+        with contextlib.ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(self))
+            yield self
+
+
+class QueryCountingApp:
+    """
+    WSGI wrapper reporting how many SQL queries each request ran, and how
+    long they took, in ``X-Query-Count`` and ``X-Query-Time-Ms`` response
+    headers. Only meant for local benchmarks.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        counter = QueryCounter()
+
+        def start_with_count(status, headers, exc_info=None):
+            # Django calls start_response once the view has returned
+            headers.append((QUERY_COUNT_HEADER, str(counter.queries)))
+            headers.append((QUERY_TIME_HEADER, f"{counter.elapsed * 1000:.3f}"))
+            return start_response(status, headers, exc_info)
+
+        with counter.installed():
+            return self.app(environ, start_with_count)
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@contextlib.contextmanager
+def serve_wsgi(app, host="127.0.0.1", port=0):
+    """
+    Serve ``app`` from a threaded dev server in a background thread and
+    yield its base URL. Port 0 picks a free port.
+    """
+    server = ThreadedWSGIServer((host, port), _QuietRequestHandler)
+    server.daemon_threads = True
+    server.set_app(app)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://{host}:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+# metric -> True when a higher value is better
+COMPARED_METRICS = {
+    "p50_ms": False,
+    "p95_ms": False,
+    "p99_ms": False,
+    "rps": True,
+    "queries_per_request": False,
+}
+
+
+def compare_to_baseline(
+    current, baseline, max_regression, metrics=COMPARED_METRICS, thresholds=None
+):
+    """
+    Compare two runs, each a mapping of benchmark name to its metrics.
+
+    Returns ``(rows, regressions)``: a row ``(name, metric, before, after,
+    change_pct)`` for every metric of every name in both runs, and the rows
+    that got worse by more than ``thresholds[name]`` (or ``max_regression``)
+    percent.
+    """
+    thresholds = thresholds or {}
+    rows = []
+    regressions = []
+    for name, after in sorted(current.items()):
+        before = baseline.get(name)
+        if before is None:
+            continue
+        limit = thresholds.get(name, max_regression)
+        for metric, higher_is_better in metrics.items():
+            old, new = before.get(metric), after.get(metric)
+            if old is None or new is None:
+                continue
+            if old:
+                change = (new - old) / old * 100
+            else:
+                change = 0.0 if new == old else 100.0
+            row = (name, metric, old, new, round(change, 1))
+            rows.append(row)
+            worse = -change if higher_is_better else change
+            if worse > limit:
+                regressions.append(row)
+    return rows, regressions
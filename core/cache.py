@@ -0,0 +1,143 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+
+_MISSING = object()
+
+# every cache created in-process, so stats can be reported in one place
+_registry = []
+
+
+class TTLLRUCache:
+    """
+    Bounded per-process LRU cache whose entries expire after ``ttl`` seconds.
+
+    When ``backend`` names a Django cache alias, values are also written
+    through to that shared cache so other workers can reuse them and
+    deletions are visible everywhere. Local copies then only live for
+    ``local_ttl`` seconds, which bounds how stale another worker can be.
+    """
+
+    def __init__(self, name, maxsize=1024, ttl=60, backend=None, local_ttl=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.local_ttl = ttl if local_ttl is None else local_ttl
+        self.backend_alias = backend
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    @property
+    def backend(self):
+        if self.backend_alias is None:
+            return None
+        return caches[self.backend_alias]
+
+    def _backend_key(self, key):
+        return f"{self.name}:{key}"
+
+    def _store_local(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.local_ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return _MISSING
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._data[key]
+                return _MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def get(self, key, default=None):
+        value = self._get_local(key)
+        if value is _MISSING and self.backend is not None:
+            value = self.backend.get(self._backend_key(key), _MISSING)
+            if value is not _MISSING:
+                self._store_local(key, value)
+
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def get_many(self, keys):
+        """Return a dict of the keys that were found"""
+        found = {}
+        remote = []
+        for key in keys:
+            value = self._get_local(key)
+            if value is _MISSING:
+                remote.append(key)
+            else:
+                found[key] = value
+
+        if remote and self.backend is not None:
+            values = self.backend.get_many([self._backend_key(k) for k in remote])
+            for key in remote:
+                backend_key = self._backend_key(key)
+                if backend_key in values:
+                    found[key] = values[backend_key]
+                    self._store_local(key, values[backend_key])
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def set(self, key, value):
+        self._store_local(key, value)
+        if self.backend is not None:
+            self.backend.set(self._backend_key(key), value, self.ttl)
+
+    def set_many(self, mapping):
+        for key, value in mapping.items():
+            self._store_local(key, value)
+        if self.backend is not None:
+            self.backend.set_many(
+                {self._backend_key(k): v for k, v in mapping.items()}, self.ttl
+            )
+
+    def delete(self, key):
+        self.delete_many([key])
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+        if self.backend is not None:
+            self.backend.delete_many([self._backend_key(k) for k in keys])
+
+    def clear(self):
+        """Drop the local entries (the shared backend is left alone)"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "name": self.name,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def registered_caches():
+    return list(_registry)
@@ -0,0 +1,245 @@
+"""
+Change log behind delta sync.
+
+Post, like and follow writes append a ``ChangeLogEntry`` in their own
+transaction, on their own database. ``GET /users/me/changes/?token=``
+returns what changed for the user since the token: posts in their
+timeline, their likes and likes of their posts, their follows and
+followers. Several changes to one object collapse into its current state,
+or a tombstone (kind, id) if it is gone. Logging a write also retires the
+conditional GET versions (see core.conditional) and cached posts (see
+core.objects) it makes stale.
+
+A token holds the last sequence number seen on every database plus the
+time it was issued. SQLite takes one writer at a time, so sequence numbers
+become visible in order and a token never skips an entry. Entries older
+than ``RETENTION_SECONDS`` are removed by ``manage.py compact_changelog``;
+a token older than that gets a 410 and the client starts over. The issue
+time only moves forward once a page reaches the end of the log: a page
+with more to come keeps the time of the token it was read with, since the
+entries it stopped short of may be that old.
+"""
+import base64
+import binascii
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from . import conditional, objects
+from .models import ChangeLogEntry
+from .tasks import databases
+
+DEFAULTS = {
+    "RETENTION_SECONDS": 30 * 24 * 3600,
+    "PAGE_SIZE": 500,
+}
+
+
+def config():
+    return {**DEFAULTS, **getattr(settings, "CHANGELOG", {})}
+
+
+class InvalidToken(Exception):
+    pass
+
+
+class TokenExpired(Exception):
+    pass
+
+
+def record(kind, op, object_id, actor_id, target_id=None, using=None):
+    """Log one write; call it inside the write's transaction"""
+    ChangeLogEntry.objects.using(using).create(
+        kind=kind, op=op, object_id=object_id, actor_id=actor_id, target_id=target_id
+    )
+    conditional.bump_on_commit(stale_versions(kind, actor_id, target_id), using=using)
+    if kind == ChangeLogEntry.POST:
+        objects.invalidate_on_commit(objects.POST, [object_id], using=using)
+
+
+def record_many(kind, op, rows, using=None):
+    """
+    Log a batch of writes of one ``kind``, ``rows`` being
+    ``(object_id, actor_id, target_id)``; call it inside their transaction
+    """
+    rows = list(rows)
+    ChangeLogEntry.objects.using(using).bulk_create(
+        ChangeLogEntry(
+            kind=kind, op=op, object_id=object_id, actor_id=actor_id, target_id=target_id
+        )
+        for object_id, actor_id, target_id in rows
+    )
+    stale = set()
+    for _, actor_id, target_id in rows:
+        stale.update(stale_versions(kind, actor_id, target_id))
+    conditional.bump_on_commit(stale, using=using)
+
+
+def stale_versions(kind, actor_id, target_id=None):
+    """Conditional GET versions a write of ``kind`` invalidates"""
+    if kind == ChangeLogEntry.POST:
+        return [conditional.author_key(actor_id)]
+    if kind == ChangeLogEntry.LIKE:
+        # the liker's is_liked flags and the post's like count
+        return [conditional.viewer_key(actor_id), conditional.author_key(target_id)]
+    # the follower's feed; the followed user's count changes with its task
+    return [conditional.viewer_key(actor_id)]
+
+
+def record_post(post, op=ChangeLogEntry.UPSERT):
+    record(ChangeLogEntry.POST, op, post.pk, post.user_id, using=post._state.db)
+
+
+def record_like(like, post, op=ChangeLogEntry.UPSERT):
+    record(
+        ChangeLogEntry.LIKE, op, like.pk, like.user_id, post.user_id, using=like._state.db
+    )
+    # the cached post carries its like count
+    objects.invalidate_on_commit(objects.POST, [post.pk], using=like._state.db)
+
+
+def record_follow(follow, op=ChangeLogEntry.UPSERT):
+    record(
+        ChangeLogEntry.FOLLOW,
+        op,
+        follow.pk,
+        follow.follower_id,
+        follow.following_id,
+        using=follow._state.db,
+    )
+
+
+def encode_token(positions, issued=None):
+    issued = int(time.time()) if issued is None else issued
+    payload = json.dumps({"t": issued, "p": positions}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_token(token):
+    """``(positions, issued)`` of ``token``; raises InvalidToken or TokenExpired"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode()))
+        issued, positions = int(payload["t"]), payload["p"]
+        positions = {str(alias): int(seq) for alias, seq in positions.items()}
+    except (binascii.Error, ValueError, TypeError, KeyError, AttributeError):
+        raise InvalidToken()
+    if time.time() - issued > config()["RETENTION_SECONDS"]:
+        raise TokenExpired()
+    return positions, issued
+
+
+def head():
+    """The latest sequence number on every database"""
+    positions = {}
+    for alias in databases():
+        last = ChangeLogEntry.objects.using(alias).order_by("-id").values_list("id", flat=True)
+        positions[alias] = last.first() or 0
+    return positions
+
+
+def _relevant(user):
+    from social.models import Follow
+
+    authors = list(
+        Follow.objects.filter(follower=user).order_by().values_list("following_id", flat=True)
+    )
+    authors.append(user.pk)
+    social = [ChangeLogEntry.LIKE, ChangeLogEntry.FOLLOW]
+    return (
+        Q(kind=ChangeLogEntry.POST, actor_id__in=authors)
+        | Q(kind__in=social, actor_id=user.pk)
+        | Q(kind__in=social, target_id=user.pk)
+    )
+
+
+def changes_for(user, positions, issued, limit=None):
+    """
+    ``(changes, token, has_more)``: the user's collapsed changes after
+    ``positions``, by database, and the token to resume from. ``issued``
+    is the time of the token ``positions`` came from.
+    """
+    limit = limit or config()["PAGE_SIZE"]
+    # taken before reading, so nothing logged after it is skipped
+    started = int(time.time())
+    relevant = _relevant(user)
+    positions = dict(positions)
+    latest = {}
+    has_more = False
+    for alias in databases():
+        rows = list(
+            ChangeLogEntry.objects.using(alias)
+            .filter(relevant, id__gt=positions.get(alias, 0))
+            .order_by("id")
+            .values("id", "kind", "op", "object_id")[:limit]
+        )
+        if rows:
+            positions[alias] = rows[-1]["id"]
+        has_more = has_more or len(rows) == limit
+        for row in rows:
+            # the last change of each object wins
+            latest[(alias, row["kind"], row["object_id"])] = row["op"]
+    token = encode_token(positions, issued if has_more else started)
+    return hydrate(user, latest), token, has_more
+
+
+def hydrate(user, latest):
+    """Current state of every upserted object, a tombstone for the rest"""
+    from posts.models import Post
+    from posts.serializers import PostListSerializer
+    from social.models import Follow, Like
+
+    wanted = {}
+    for (alias, kind, object_id), op in latest.items():
+        if op == ChangeLogEntry.UPSERT:
+            wanted.setdefault((alias, kind), []).append(object_id)
+
+    # read from the database the log was read from, never a lagging replica
+    found = {}
+    for (alias, kind), ids in wanted.items():
+        if kind == ChangeLogEntry.POST:
+            posts = (
+                Post.objects.using(alias)
+                .for_viewer(user)
+                .with_list_columns()
+                .filter(pk__in=ids)
+            )
+            rows = PostListSerializer(posts, many=True).data
+        elif kind == ChangeLogEntry.LIKE:
+            rows = Like.objects.using(alias).filter(pk__in=ids).values(
+                "id", "user_id", "post_id", "created_at"
+            )
+        else:
+            rows = Follow.objects.using(alias).filter(pk__in=ids).values(
+                "id", "follower_id", "following_id", "created_at"
+            )
+        found.update(((kind, row["id"]), row) for row in rows)
+
+    changes = []
+    for (alias, kind, object_id), op in latest.items():
+        data = found.get((kind, object_id))
+        change = {"type": kind, "op": ChangeLogEntry.DELETE, "id": object_id}
+        if data is not None:
+            change.update(op=ChangeLogEntry.UPSERT, data=data)
+        changes.append(change)
+    return changes
+
+
+def compact(older_than=None, batch_size=1000):
+    """Delete entries past the retention window, in batches"""
+    from .purge import delete_batch
+
+    seconds = config()["RETENTION_SECONDS"] if older_than is None else older_than
+    cutoff = timezone.now() - timedelta(seconds=seconds)
+    removed = 0
+    for alias in databases():
+        old = ChangeLogEntry.objects.using(alias).filter(created_at__lt=cutoff)
+        while True:
+            selected, _ = delete_batch(old, batch_size)
+            if not selected:
+                break
+            removed += selected
+    return removed
@@ -0,0 +1,173 @@
+"""
+Conditional GET for the read endpoints clients poll.
+
+A view computes a cheap validator before doing any real work; when the
+client's ``If-None-Match`` (or ``If-Modified-Since``) still matches it gets
+a 304 without the main query running or the serializer being touched.
+
+Detail views validate against their row's ``updated_at``. Lists can't, so
+they use version tokens: every user has an *author* version, replaced
+whenever something shown about them or their posts changes (a post, a like
+of one of their posts, their profile), and a *viewer* version, replaced
+when their own likes or follows change. A list's ETag hashes the versions
+of the authors in it and of the viewer. Versions are random tokens rather
+than counters, so one evicted from the cache comes back as a new value and
+only costs a full response.
+
+Versions are replaced once the write commits (``bump_on_commit``); a
+request that read a version before then may have read the old rows too,
+and its ETag stops matching on the next request.
+"""
+import hashlib
+import uuid
+from functools import partial, wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils.http import http_date, quote_etag
+
+from .cache import TTLLRUCache
+
+DEFAULTS = {
+    "MAX_ENTRIES": 100000,
+    "TTL": 60,
+    "BACKEND": None,
+    "LOCAL_TTL": None,
+}
+
+
+def config():
+    return {**DEFAULTS, **getattr(settings, "CONDITIONAL_GET", {})}
+
+
+_options = config()
+version_cache = TTLLRUCache(
+    "validators",
+    maxsize=_options["MAX_ENTRIES"],
+    ttl=_options["TTL"],
+    backend=_options["BACKEND"],
+    local_ttl=_options["LOCAL_TTL"],
+)
+
+
+def author_key(user_id):
+    return f"author:{user_id}"
+
+
+def viewer_key(user_id):
+    return f"viewer:{user_id}"
+
+
+def _token():
+    return uuid.uuid4().hex
+
+
+def versions(keys):
+    """The current version of every key, in order; unknown keys get one"""
+    keys = list(keys)
+    found = version_cache.get_many(keys)
+    missing = {key: _token() for key in keys if key not in found}
+    if missing:
+        version_cache.set_many(missing)
+        found.update(missing)
+    return [found[key] for key in keys]
+
+
+def bump(keys):
+    version_cache.set_many({key: _token() for key in keys})
+
+
+def bump_on_commit(keys, using=DEFAULT_DB_ALIAS):
+    """Replace the versions once the current transaction on ``using`` commits"""
+    keys = list(keys)
+    transaction.on_commit(lambda: bump(keys), using=using)
+
+
+def make_etag(*parts):
+    digest = hashlib.md5(repr(parts).encode(), usedforsecurity=False).hexdigest()
+    return quote_etag(digest)
+
+
+def _set_validators(response, etag, last_modified):
+    if etag is not None:
+        response["ETag"] = etag
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified.timestamp())
+    # the validators depend on who is asking: caches must revalidate and
+    # never share a response between accounts
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ["Authorization"])
+
+
+def _precondition_response(request, etag, last_modified):
+    """A 304 (or 412) if the request's preconditions rule out a body"""
+    timestamp = int(last_modified.timestamp()) if last_modified is not None else None
+    return get_conditional_response(request, etag=etag, last_modified=timestamp)
+
+
+def evaluate(request, etag=None, last_modified=None, respond=None):
+    """
+    A 304 (or 412) if the request's preconditions rule out a body,
+    otherwise ``respond()`` with the validators attached to it
+    """
+    response = _precondition_response(request, etag, last_modified)
+    if response is None:
+        response = respond()
+        if response.status_code != 200:
+            return response
+    _set_validators(response, etag, last_modified)
+    return response
+
+
+async def aevaluate(request, etag=None, last_modified=None, respond=None):
+    """``evaluate`` for the native async views; ``respond`` is a coroutine function"""
+    response = _precondition_response(request, etag, last_modified)
+    if response is None:
+        response = await respond()
+        if response.status_code != 200:
+            return response
+    _set_validators(response, etag, last_modified)
+    return response
+
+
+class ConditionalGetMixin:
+    """
+    Answers GET with a 304 when ``get_validators`` still matches. Views
+    return ``(etag, last_modified)`` from it, either may be None, and both
+    None skips the check.
+    """
+
+    def get_validators(self, request):
+        return None, None
+
+    def get(self, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(request)
+        respond = partial(super().get, request, *args, **kwargs)
+        if etag is None and last_modified is None:
+            return respond()
+        return evaluate(request, etag, last_modified, respond)
+
+
+def conditional(get_validators):
+    """
+    The same for function views: ``get_validators(request, *args, **kwargs)``
+    returns ``(etag, last_modified)``. Apply it under ``@api_view``.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view(request, *args, **kwargs)
+            etag, last_modified = get_validators(request, *args, **kwargs)
+            respond = partial(view, request, *args, **kwargs)
+            return evaluate(request, etag, last_modified, respond)
+
+        return wrapper
+
+    return decorator
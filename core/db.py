@@ -0,0 +1,137 @@
+import logging
+import random
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+
+from . import perf
+from .slow_queries import slow_query_log
+
+logger = logging.getLogger(__name__)
+
+LOCK_ERRORS = ("database is locked", "database table is locked")
+
+
+def apply_pragmas(cursor, pragmas):
+    for name, value in pragmas.items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """``connection_created`` hook applying ``SQLITE_PRAGMAS`` to new connections"""
+    if connection.vendor != "sqlite":
+        return
+    pragmas = getattr(settings, "SQLITE_PRAGMAS", None)
+    if pragmas:
+        with connection.cursor() as cursor:
+            apply_pragmas(cursor, pragmas)
+
+
+_query_stats = defaultdict(lambda: {"queries": 0, "time_ms": 0.0})
+_query_stats_lock = threading.Lock()
+
+
+def count_queries(execute, sql, params, many, context):
+    """
+    Execute wrapper tallying queries and time per database alias and per
+    request, and handing slow statements to the slow-query log
+    """
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        perf.record_query(elapsed)
+        slow_query_log.observe(sql, params, many, context["connection"].alias, elapsed)
+        with _query_stats_lock:
+            stats = _query_stats[context["connection"].alias]
+            stats["queries"] += 1
+            stats["time_ms"] += elapsed
+
+
+def install_query_counter(sender, connection, **kwargs):
+    """``connection_created`` hook adding ``count_queries`` to the connection"""
+    if count_queries not in connection.execute_wrappers:
+        # first in line, so execute_wrapper() blocks still pop their own wrapper
+        connection.execute_wrappers.insert(0, count_queries)
+
+
+def query_counts():
+    """Queries run and time spent per alias since the process started"""
+    with _query_stats_lock:
+        return {
+            alias: {"queries": stats["queries"], "time_ms": round(stats["time_ms"], 3)}
+            for alias, stats in _query_stats.items()
+        }
+
+
+def is_lock_error(exc):
+    message = str(exc)
+    return any(error in message for error in LOCK_ERRORS)
+
+
+def retry_on_lock(func=None, *, using=DEFAULT_DB_ALIAS):
+    """
+    Retry a write when SQLite reports lock contention, sleeping a random
+    (full jitter) exponential backoff between attempts.
+
+    Only a whole transaction can be retried, so the wrapped function should
+    own its ``atomic`` block; when called inside an outer transaction the
+    error is re-raised for the outermost caller to handle.
+    """
+    if func is None:
+        return lambda f: retry_on_lock(f, using=using)
+
+    @wraps(func)
+    def inner(*args, **kwargs):
+        options = getattr(settings, "SQLITE_WRITE_RETRY", {})
+        attempts = options.get("ATTEMPTS", 5)
+        base_delay = options.get("BASE_DELAY", 0.01)
+        max_delay = options.get("MAX_DELAY", 0.5)
+
+        for attempt in range(1, attempts + 1):
+            try:
+                return func(*args, **kwargs)
+            except (OperationalError, sqlite3.OperationalError) as e:
+                if (
+                    not is_lock_error(e)
+                    or attempt == attempts
+                    or connections[using].in_atomic_block
+                ):
+                    raise
+                delay = random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+                logger.info(
+                    "%s hit a locked database, retry %d/%d in %.3fs",
+                    getattr(func, "__qualname__", func),
+                    attempt,
+                    attempts - 1,
+                    delay,
+                )
+                time.sleep(delay)
+
+    return inner
+
+
+@contextmanager
+def keep_timestamps(*models):
+    """
+    Let ``bulk_create`` write the rows' own ``auto_now``/``auto_now_add``
+    values instead of stamping the current time (for copying rows around).
+    """
+    saved = []
+    for model in models:
+        for field in model._meta.concrete_fields:
+            if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False):
+                saved.append((field, field.auto_now, field.auto_now_add))
+                field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
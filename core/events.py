@@ -0,0 +1,218 @@
+"""
+In-process pub/sub hub behind the server-sent events endpoint.
+
+Writes publish small "something new" hints (``feed``, ``like``,
+``follow``) to the users they concern once their transaction commits;
+clients listening on ``/api/v1/social/events/`` refetch instead of polling.
+Events carry ids, never payloads, so a dropped event costs a refetch and
+nothing else: each connection buffers ``QUEUE_SIZE`` events and drops the
+rest.
+
+The hub only reaches connections served by the same process, so run the
+ASGI app as one process (threads and the event loop are fine) or treat
+events as a hint on top of occasional polling.
+
+Django 4.2 keeps iterating a streaming response after the client has gone,
+so ``stream`` watches the ASGI ``receive`` channel (see core.handlers) and
+gives the slot back on ``http.disconnect``. A stream whose response is
+never iterated loses its slot after ``START_SECONDS``.
+"""
+import asyncio
+import itertools
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from core import metrics
+
+DEFAULTS = {
+    "HEARTBEAT_SECONDS": 15,
+    "MAX_SECONDS": 300,
+    "RETRY_MS": 3000,
+    "MAX_CONNECTIONS": 1000,
+    "MAX_PER_USER": 3,
+    "QUEUE_SIZE": 32,
+    "START_SECONDS": 10,
+}
+
+
+def config():
+    return {**DEFAULTS, **getattr(settings, "EVENTS", {})}
+
+
+class TooManyConnections(Exception):
+    """Raised when the process or the user already has the most streams allowed"""
+
+
+class Subscription:
+    """One open event stream, fed from any thread"""
+
+    def __init__(self, user_id, loop, queue_size):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.created = time.monotonic()
+        # set once the response is iterated; until then the slot is on loan
+        self.started = False
+
+    def abandoned(self, start_seconds):
+        return not self.started and time.monotonic() - self.created > start_seconds
+
+    def offer(self, message):
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            pass  # the stream's loop is gone
+
+    def _put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            EVENTS_DROPPED.inc()
+
+    async def get(self, timeout):
+        """The next message, or None after ``timeout`` seconds"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class Hub:
+    def __init__(self):
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    @property
+    def connections(self):
+        return sum(len(subs) for subs in self._subscriptions.values())
+
+    def _drop_abandoned(self, start_seconds):
+        for user_id, subs in list(self._subscriptions.items()):
+            subs.difference_update([sub for sub in subs if sub.abandoned(start_seconds)])
+            if not subs:
+                del self._subscriptions[user_id]
+
+    def subscribe(self, user_id):
+        """Open a stream for ``user_id``; call it from the stream's event loop"""
+        options = config()
+        with self._lock:
+            self._drop_abandoned(options["START_SECONDS"])
+            if self.connections >= options["MAX_CONNECTIONS"]:
+                raise TooManyConnections("Too many open event streams, please retry shortly")
+            subs = self._subscriptions.setdefault(user_id, set())
+            if len(subs) >= options["MAX_PER_USER"]:
+                raise TooManyConnections("Too many open event streams for this account")
+            subscription = Subscription(
+                user_id, asyncio.get_running_loop(), options["QUEUE_SIZE"]
+            )
+            subs.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subs = self._subscriptions.get(subscription.user_id, set())
+            subs.discard(subscription)
+            if not subs:
+                self._subscriptions.pop(subscription.user_id, None)
+
+    def online(self):
+        """Ids of users with at least one open stream"""
+        with self._lock:
+            return set(self._subscriptions)
+
+    def publish(self, user_ids, event, data=None):
+        message = (next(self._ids), event, data or {})
+        with self._lock:
+            targets = [
+                sub for user_id in user_ids for sub in self._subscriptions.get(user_id, ())
+            ]
+        for subscription in targets:
+            subscription.offer(message)
+        EVENTS_PUBLISHED.inc(len(targets))
+
+
+hub = Hub()
+
+
+def format_event(message):
+    event_id, event, data = message
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+async def _wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def stream(subscription, receive=None):
+    """
+    The SSE body for ``subscription``; closes after ``MAX_SECONDS``, or as
+    soon as ``receive``, the request's ASGI channel, reports a disconnect
+    """
+    options = config()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + options["MAX_SECONDS"]
+    subscription.started = True
+    disconnected = None
+    if receive is not None:
+        disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+        # release the slot even while the handler is busy sending
+        disconnected.add_done_callback(lambda _: hub.unsubscribe(subscription))
+    try:
+        yield f"retry: {options['RETRY_MS']}\n\n"
+        while disconnected is None or not disconnected.done():
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            waiting = asyncio.ensure_future(
+                subscription.get(min(options["HEARTBEAT_SECONDS"], remaining))
+            )
+            watched = {waiting} if disconnected is None else {waiting, disconnected}
+            await asyncio.wait(watched, return_when=asyncio.FIRST_COMPLETED)
+            if not waiting.done():
+                waiting.cancel()
+                return
+            message = waiting.result()
+            yield format_event(message) if message else ": ping\n\n"
+    finally:
+        if disconnected is not None:
+            disconnected.cancel()
+        hub.unsubscribe(subscription)
+
+
+def publish_on_commit(user_ids, event, data=None, using=DEFAULT_DB_ALIAS):
+    """Publish once the current transaction on ``using`` commits"""
+    user_ids = list(user_ids)
+    transaction.on_commit(lambda: hub.publish(user_ids, event, data), using=using)
+
+
+def publish_new_post(post):
+    """Tell the author's followers that are online about ``post``"""
+    from social.models import Follow
+
+    online = hub.online()
+    if not online:
+        return
+    followers = Follow.objects.filter(
+        following_id=post.user_id, follower_id__in=online
+    ).values_list("follower_id", flat=True)
+    hub.publish(followers, "feed", {"post_id": post.pk})
+
+
+EVENT_STREAMS = metrics.registry.gauge("event_streams_open", "Open server-sent event streams")
+EVENTS_PUBLISHED = metrics.registry.counter(
+    "events_published_total", "Events handed to open streams"
+)
+EVENTS_DROPPED = metrics.registry.counter(
+    "events_dropped_total", "Events dropped because a stream's buffer was full"
+)
+
+
+@metrics.registry.collector
+def collect_event_streams():
+    EVENT_STREAMS.set(hub.connections)
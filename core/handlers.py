@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+
+# scope key the handler keeps the ASGI receive channel under
+RECEIVE_KEY = "image_sharing_api.receive"
+
+
+class AsyncViewsASGIHandler(ASGIHandler):
+    """
+    ASGI handler that resolves requests against ``settings.ASGI_URLCONF``,
+    which mounts the native async views in front of the regular URLconf.
+
+    Requests also get ``asgi_receive``, the channel left once the body has
+    been read, so streaming views can notice the client disconnecting
+    (Django 4.2 doesn't stop a streaming response when that happens).
+    """
+
+    async def handle(self, scope, receive, send):
+        await super().handle({**scope, RECEIVE_KEY: receive}, receive, send)
+
+    def create_request(self, scope, body_file):
+        request, error_response = super().create_request(scope, body_file)
+        if request is not None:
+            request.urlconf = settings.ASGI_URLCONF
+            request.asgi_receive = scope.get(RECEIVE_KEY)
+        return request, error_response
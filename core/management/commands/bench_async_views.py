@@ -0,0 +1,108 @@
+import asyncio
+
+from django.contrib.auth import get_user_model
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+
+from core import sharding
+from core.benchmarks import run_asgi_load
+from core.handlers import AsyncViewsASGIHandler
+from posts.models import Post
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare requests per second of the sync and native async read "
+        "endpoints, both served by the ASGI handler"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--username",
+            help="User to authenticate as (default: the user following the most people)",
+        )
+        parser.add_argument(
+            "--requests", type=int, default=200, help="Requests per endpoint and mode"
+        )
+        parser.add_argument(
+            "--concurrency", type=int, default=20, help="Requests in flight at once"
+        )
+        parser.add_argument(
+            "--concurrent-reads",
+            action="store_true",
+            help="Let the async views run independent queries on separate connections",
+        )
+
+    def handle(self, *args, **options):
+        if options["username"]:
+            user = User.objects.filter(username=options["username"]).first()
+        else:
+            user = (
+                User.objects.annotate(n=Count("following_set")).order_by("-n").first()
+            )
+        if user is None:
+            raise CommandError("No users found. Seed some data first.")
+
+        posts = sharding.gather(
+            Post.objects.with_like_counts().order_by("-total_likes", "-created_at"),
+            key=lambda post: (post.total_likes, post.created_at),
+        )[:1]
+        if not posts:
+            raise CommandError("No posts found. Seed some data first.")
+        post = posts[0]
+
+        token, _ = Token.objects.get_or_create(user=user)
+        headers = {"Authorization": f"Token {token.key}"}
+
+        endpoints = {
+            "feed": "/api/v1/posts/feed/",
+            "timeline": "/api/v1/posts/timeline/",
+            "discover": "/api/v1/posts/discover/",
+            "follow-stats": "/api/v1/social/stats/",
+            "like-stats": "/api/v1/social/like-stats/",
+            "post-likes": f"/api/v1/social/posts/{post.pk}/likes/",
+        }
+        apps = {"sync": ASGIHandler(), "async": AsyncViewsASGIHandler()}
+
+        self.stdout.write(
+            f"Benchmarking as {user.username}: {options['requests']} requests "
+            f"per endpoint, concurrency {options['concurrency']}"
+        )
+        self.stdout.write(
+            f"{'endpoint':<14}{'sync rps':>10}{'async rps':>11}{'speedup':>9}"
+            f"{'sync p95':>10}{'async p95':>11}"
+        )
+
+        with override_settings(ASYNC_CONCURRENT_READS=options["concurrent_reads"]):
+            for name, url in endpoints.items():
+                results = {}
+                for mode, app in apps.items():
+                    # warm up caches and connections before measuring
+                    asyncio.run(run_asgi_load(app, [url], 5, 1, headers))
+                    results[mode] = asyncio.run(
+                        run_asgi_load(
+                            app,
+                            [url],
+                            options["requests"],
+                            options["concurrency"],
+                            headers,
+                        )
+                    )
+
+                sync, async_ = results["sync"], results["async"]
+                speedup = async_["rps"] / sync["rps"] if sync["rps"] else 0
+                self.stdout.write(
+                    f"{name:<14}{sync['rps']:>10.1f}{async_['rps']:>11.1f}"
+                    f"{speedup:>8.2f}x{sync['p95_ms']:>9.1f}ms{async_['p95_ms']:>9.1f}ms"
+                )
+                if sync["errors"] or async_["errors"]:
+                    self.stdout.write(
+                        self.style.WARNING(
+                            f"  errors: sync={sync['errors']} async={async_['errors']}"
+                        )
+                    )
@@ -0,0 +1,347 @@
+import json
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import RequestFactory
+
+from core import sharding
+from core.benchmarks import QueryCounter, compare_to_baseline, percentile
+from core.cache import registered_caches
+from posts.models import Post
+from posts.serializers import PostListSerializer
+from social.models import Follow, Like
+from social.serializers import FollowerListSerializer, UserLikeSerializer
+
+User = get_user_model()
+
+# generate_dataset options for each dataset size
+SIZES = {
+    "small": {"users": 1000, "posts": 5000, "follows": 20000, "likes": 50000},
+    "medium": {"users": 5000, "posts": 25000, "follows": 100000, "likes": 250000},
+    "large": {"users": 20000, "posts": 100000, "follows": 400000, "likes": 1000000},
+}
+
+PAGE = 20
+SERIALIZER_BATCH = 100
+
+# metric -> True when a higher value is better
+METRICS = {"p50_ms": False, "p95_ms": False, "ops_per_s": True, "queries": False}
+
+
+def rolled_back(func):
+    """Run a write benchmark in a transaction that is always rolled back"""
+
+    def run():
+        with transaction.atomic():
+            func()
+            transaction.set_rollback(True)
+
+    return run
+
+
+def measure(func, repeat, warmup=2, items=1):
+    for _ in range(warmup):
+        func()
+    latencies = []
+    counter = QueryCounter()
+    with counter.installed():
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        "calls": repeat,
+        "mean_ms": round(total / repeat * 1000, 3),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "ops_per_s": round(repeat / total, 1) if total else 0.0,
+        "items_per_s": round(repeat * items / total, 1) if total else 0.0,
+        "queries": round(counter.queries / repeat, 2),
+    }
+
+
+class Subjects:
+    """The users and posts the benchmarks run against, picked from the data"""
+
+    def __init__(self):
+        self.viewer = (
+            User.objects.annotate(n=Count("following_set")).order_by("-n", "pk").first()
+        )
+        self.celebrity = (
+            User.objects.annotate(n=Count("followers_set")).order_by("-n", "pk").first()
+        )
+        if self.viewer is None or self.celebrity is None:
+            raise CommandError("No users found. Run generate_dataset first.")
+        self.post = Post.objects.popular().first()
+        self.unliked_post = (
+            Post.objects.exclude(user=self.viewer)
+            .exclude(likes__user=self.viewer)
+            .order_by("-created_at")
+            .first()
+        )
+        self.stranger = (
+            User.objects.exclude(pk=self.viewer.pk)
+            .exclude(followers_set__follower=self.viewer)
+            .order_by("pk")
+            .first()
+        )
+        if self.post is None or self.unliked_post is None or self.stranger is None:
+            raise CommandError("The dataset is too small to benchmark")
+
+        request = RequestFactory().get("/")
+        request.user = self.viewer
+        self.context = {"request": request}
+
+
+def benchmarks(subjects):
+    """Benchmark name -> (callable, items handled per call)"""
+    viewer, celebrity = subjects.viewer, subjects.celebrity
+    post, unliked_post = subjects.post, subjects.unliked_post
+
+    # serializers are measured on rows fetched up front, the way the views fetch them
+    posts = list(Post.objects.feed_for_user(viewer)[:SERIALIZER_BATCH])
+    followers = list(Follow.objects.followers_of(celebrity)[:SERIALIZER_BATCH])
+    likes = list(Like.objects.by_user(viewer).with_liked_posts(viewer)[:SERIALIZER_BATCH])
+
+    def serialize(serializer_class, rows):
+        return lambda: serializer_class(rows, many=True, context=subjects.context).data
+
+    return {
+        "posts.feed_for_user": (
+            lambda: list(Post.objects.feed_for_user(viewer)[:PAGE]),
+            1,
+        ),
+        "posts.timeline_for_user": (
+            lambda: list(Post.objects.timeline_for_user(viewer)[:PAGE]),
+            1,
+        ),
+        "posts.popular": (lambda: list(Post.objects.popular()[:PAGE]), 1),
+        "follows.followers_of": (
+            lambda: list(Follow.objects.followers_of(celebrity)[:PAGE]),
+            1,
+        ),
+        "follows.following_of": (
+            lambda: list(Follow.objects.following_of(viewer)[:PAGE]),
+            1,
+        ),
+        "follows.follow_user": (
+            rolled_back(lambda: Follow.objects.follow_user(viewer, subjects.stranger)),
+            1,
+        ),
+        "likes.like_post": (
+            rolled_back(lambda: Like.objects.like_post(viewer, unliked_post)),
+            1,
+        ),
+        "likes.is_liked_by": (lambda: Like.objects.is_liked_by(viewer, post), 1),
+        "serializers.PostListSerializer": (
+            serialize(PostListSerializer, posts),
+            len(posts),
+        ),
+        "serializers.FollowerListSerializer": (
+            serialize(FollowerListSerializer, followers),
+            len(followers),
+        ),
+        "serializers.UserLikeSerializer": (
+            serialize(UserLikeSerializer, likes),
+            len(likes),
+        ),
+    }
+
+
+def parse_thresholds(values):
+    thresholds = {}
+    for value in values or []:
+        name, _, pct = value.partition("=")
+        try:
+            thresholds[name] = float(pct)
+        except ValueError:
+            raise CommandError(f"Bad --threshold {value!r}; expected NAME=PERCENT")
+    return thresholds
+
+
+class Command(BaseCommand):
+    help = (
+        "Micro-benchmark the post, follow and like managers and the list "
+        "serializers against generated datasets of several sizes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            default="small,medium",
+            help=f"Comma separated dataset sizes out of {', '.join(SIZES)}",
+        )
+        parser.add_argument(
+            "--current-db",
+            action="store_true",
+            help="Benchmark the configured database as it is instead of generating data",
+        )
+        parser.add_argument("--repeat", type=int, default=30, help="Timed calls per benchmark")
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--output", help="Write the results as JSON to this file")
+        parser.add_argument("--baseline", help="JSON results of an earlier run to compare to")
+        parser.add_argument(
+            "--max-regression",
+            type=float,
+            default=15.0,
+            help="Fail when a metric is this many percent worse than the baseline",
+        )
+        parser.add_argument(
+            "--threshold",
+            action="append",
+            metavar="NAME=PERCENT",
+            help="Per-benchmark regression threshold, e.g. posts.feed_for_user=25",
+        )
+
+    def handle(self, *args, **options):
+        if sharding.enabled():
+            raise CommandError("bench_orm measures the unsharded managers")
+        thresholds = parse_thresholds(options["threshold"])
+
+        sizes = options["sizes"].split(",")
+        for size in sizes:
+            if size not in SIZES:
+                raise CommandError(f"Unknown size {size!r}; choose from {', '.join(SIZES)}")
+
+        results = {}
+        # the dev settings log every query, which would dominate the timings
+        logging.disable(logging.INFO)
+        try:
+            if options["current_db"]:
+                results["current"] = self.run_size(options["repeat"])
+            else:
+                for size in sizes:
+                    results[size] = self.run_on_fresh_database(size, options)
+        finally:
+            logging.disable(logging.NOTSET)
+
+        report = {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "options": {"repeat": options["repeat"], "seed": options["seed"]},
+            "results": results,
+        }
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+        if options["baseline"]:
+            self.compare(report, options, thresholds)
+
+    def run_on_fresh_database(self, size, options):
+        """
+        Generate a ``size`` dataset in a throwaway database file and
+        benchmark it. Not SQLite's in-memory test database: closing that
+        connection is a no-op, so the next size would inherit these rows.
+        """
+        test_settings = connection.settings_dict.setdefault("TEST", {})
+        old_test_name = test_settings.get("NAME")
+        with tempfile.TemporaryDirectory() as tmp:
+            test_settings["NAME"] = os.path.join(tmp, f"bench_{size}.sqlite3")
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                if User.objects.exists():
+                    raise CommandError(f"The {size} benchmark database is not empty")
+                self.stdout.write(f"Generating {size} dataset: {SIZES[size]}")
+                call_command(
+                    "generate_dataset", seed=options["seed"], stdout=StringIO(), **SIZES[size]
+                )
+                return self.run_size(options["repeat"], label=size, expected=SIZES[size])
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                test_settings["NAME"] = old_test_name
+
+    def check_dataset(self, label, dataset, expected):
+        """
+        Users and posts are generated exactly; duplicate follows and likes
+        are skipped, so those may fall short but never exceed the target
+        """
+        wrong = [
+            f"{count:,} {name} (expected {expected[name]:,})"
+            for name, count in dataset.items()
+            if count > expected[name]
+            or (name in ("users", "posts") and count != expected[name])
+            or count == 0
+        ]
+        if wrong:
+            raise CommandError(f"The {label} dataset is wrong: {', '.join(wrong)}")
+
+    def run_size(self, repeat, label="current", expected=None):
+        # cached lookups from a previous dataset must not leak into this one
+        cache.clear()
+        for registered in registered_caches():
+            registered.clear()
+
+        subjects = Subjects()
+        dataset = {
+            "users": User.objects.count(),
+            "posts": Post.objects.count(),
+            "follows": Follow.objects.count(),
+            "likes": Like.objects.count(),
+        }
+        if expected is not None:
+            self.check_dataset(label, dataset, expected)
+        self.stdout.write(
+            f"\n{label}: "
+            + ", ".join(f"{count:,} {name}" for name, count in dataset.items())
+        )
+        self.stdout.write(
+            f"{'benchmark':<38}{'p50 ms':>9}{'p95 ms':>9}{'ops/s':>10}"
+            f"{'items/s':>11}{'queries':>9}"
+        )
+
+        timings = {}
+        for name, (func, items) in benchmarks(subjects).items():
+            row = measure(func, repeat, items=items)
+            timings[name] = row
+            self.stdout.write(
+                f"{name:<38}{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}"
+                f"{row['ops_per_s']:>10.1f}{row['items_per_s']:>11.1f}{row['queries']:>9g}"
+            )
+        return {"dataset": dataset, "benchmarks": timings}
+
+    def compare(self, report, options, thresholds):
+        with open(options["baseline"]) as f:
+            baseline = json.load(f)
+
+        def flatten(results):
+            return {
+                f"{size}/{name}": row
+                for size, data in results.items()
+                for name, row in data["benchmarks"].items()
+            }
+
+        current = flatten(report["results"])
+        rows, regressions = compare_to_baseline(
+            current,
+            flatten(baseline.get("results", {})),
+            options["max_regression"],
+            metrics=METRICS,
+            thresholds={
+                key: thresholds[key.split("/", 1)[1]]
+                for key in current
+                if key.split("/", 1)[1] in thresholds
+            },
+        )
+
+        self.stdout.write(f"\nCompared to {options['baseline']}:")
+        for row in rows:
+            name, metric, before, after, change = row
+            marker = "  REGRESSION" if row in regressions else ""
+            self.stdout.write(
+                f"{name:<44}{metric:<11}{before:>10g} -> {after:<10g}{change:+.1f}%{marker}"
+            )
+        if regressions:
+            raise CommandError(f"{len(regressions)} metric(s) regressed past their threshold")
+        self.stdout.write(self.style.SUCCESS("No regressions"))
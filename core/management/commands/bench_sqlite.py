@@ -0,0 +1,172 @@
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.db import apply_pragmas, is_lock_error, retry_on_lock
+
+SCHEMA = [
+    "CREATE TABLE post (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, "
+    "caption TEXT NOT NULL, created_at REAL NOT NULL)",
+    "CREATE INDEX post_user_created ON post (user_id, created_at DESC)",
+    "CREATE TABLE likes (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, "
+    "post_id INTEGER NOT NULL, created_at REAL NOT NULL, UNIQUE (user_id, post_id))",
+    "CREATE INDEX like_post ON likes (post_id)",
+]
+
+FEED_QUERY = (
+    "SELECT p.id, p.caption, (SELECT COUNT(*) FROM likes l WHERE l.post_id = p.id) "
+    "FROM post p WHERE p.user_id IN ({}) ORDER BY p.created_at DESC LIMIT 20"
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Concurrent read/write throughput of SQLite with Django's default "
+        "connection settings versus the production pragma profile"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seconds", type=float, default=5.0)
+        parser.add_argument("--readers", type=int, default=8)
+        parser.add_argument("--writers", type=int, default=4)
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--posts", type=int, default=20000)
+
+    def handle(self, *args, **options):
+        # fall back to the prod profile so the comparison is meaningful in dev
+        tuned = getattr(settings, "SQLITE_PRAGMAS", None) or {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "busy_timeout": 5000,
+            "cache_size": -64000,
+            "mmap_size": 268435456,
+            "temp_store": "MEMORY",
+        }
+        profiles = {"default": ({}, False), "tuned": (tuned, True)}
+
+        self.stdout.write(
+            f"{options['readers']} readers, {options['writers']} writers, "
+            f"{options['seconds']}s per profile"
+        )
+        self.stdout.write(
+            f"{'profile':<10}{'reads/s':>10}{'writes/s':>10}{'lock errors':>13}"
+        )
+
+        with tempfile.TemporaryDirectory() as tmp:
+            for name, (pragmas, retry) in profiles.items():
+                path = Path(tmp) / f"{name}.sqlite3"
+                self._seed(path, pragmas, options)
+                reads, writes, errors = self._run(path, pragmas, retry, options)
+                seconds = options["seconds"]
+                self.stdout.write(
+                    f"{name:<10}{reads / seconds:>10.1f}{writes / seconds:>10.1f}"
+                    f"{errors:>13}"
+                )
+
+    def _connect(self, path, pragmas):
+        # same as Django: autocommit, explicit BEGIN for transactions
+        conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        apply_pragmas(conn.cursor(), pragmas)
+        return conn
+
+    def _seed(self, path, pragmas, options):
+        rng = random.Random(42)
+        conn = self._connect(path, pragmas)
+        for statement in SCHEMA:
+            conn.execute(statement)
+        now = time.time()
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT INTO post (user_id, caption, created_at) VALUES (?, ?, ?)",
+            (
+                (rng.randrange(options["users"]), f"post {i}", now - i)
+                for i in range(options["posts"])
+            ),
+        )
+        conn.execute("COMMIT")
+        conn.close()
+
+    def _run(self, path, pragmas, retry, options):
+        deadline = time.monotonic() + options["seconds"]
+        counts = {"reads": 0, "writes": 0, "errors": 0}
+        lock = threading.Lock()
+
+        def bump(key):
+            with lock:
+                counts[key] += 1
+
+        def reader(seed):
+            rng = random.Random(seed)
+            conn = self._connect(path, pragmas)
+            while time.monotonic() < deadline:
+                following = ",".join(
+                    str(rng.randrange(options["users"])) for _ in range(50)
+                )
+                try:
+                    conn.execute(FEED_QUERY.format(following)).fetchall()
+                    bump("reads")
+                except sqlite3.OperationalError as e:
+                    if not is_lock_error(e):
+                        raise
+                    bump("errors")
+            conn.close()
+
+        def writer(seed):
+            rng = random.Random(seed)
+            conn = self._connect(path, pragmas)
+
+            def toggle_like(user_id, post_id):
+                # read-then-write like LikeManager.like_post/unlike_post
+                conn.execute("BEGIN")
+                try:
+                    row = conn.execute(
+                        "SELECT id FROM likes WHERE user_id = ? AND post_id = ?",
+                        (user_id, post_id),
+                    ).fetchone()
+                    if row:
+                        conn.execute("DELETE FROM likes WHERE id = ?", (row[0],))
+                    else:
+                        conn.execute(
+                            "INSERT INTO likes (user_id, post_id, created_at) "
+                            "VALUES (?, ?, ?)",
+                            (user_id, post_id, time.time()),
+                        )
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+
+            if retry:
+                toggle_like = retry_on_lock(toggle_like)
+
+            while time.monotonic() < deadline:
+                try:
+                    toggle_like(
+                        rng.randrange(options["users"]),
+                        rng.randrange(1, options["posts"] + 1),
+                    )
+                    bump("writes")
+                except sqlite3.OperationalError as e:
+                    if not is_lock_error(e):
+                        raise
+                    bump("errors")
+            conn.close()
+
+        threads = [
+            threading.Thread(target=reader, args=(i,)) for i in range(options["readers"])
+        ] + [
+            threading.Thread(target=writer, args=(1000 + i,))
+            for i in range(options["writers"])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return counts["reads"], counts["writes"], counts["errors"]
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from core import changes
+
+
+class Command(BaseCommand):
+    help = "Delete change log entries older than the delta sync retention window"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than",
+            type=int,
+            help="Seconds to keep instead of CHANGELOG['RETENTION_SECONDS']",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows per transaction")
+
+    def handle(self, *args, **options):
+        removed = changes.compact(options["older_than"], options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"{removed} change log row(s) removed"))
@@ -0,0 +1,253 @@
+import math
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from core import sharding
+from core.db import keep_timestamps
+from posts.models import Post
+from social.models import Follow, Like
+from users.models import UserProfile
+
+User = get_user_model()
+
+CAPTIONS = [
+    "Golden hour",
+    "Weekend vibes",
+    "Street food run",
+    "Into the mountains",
+    "Coffee first",
+    "City lights",
+    "New recipe",
+    "Beach day",
+]
+
+
+def power_law_index(rng, n, skew):
+    """
+    Draw from [0, n) with density proportional to x ** (1/skew - 1): index 0
+    is the most popular and popularity falls off as a power law.
+    """
+    return min(n - 1, int(n * rng.random() ** skew))
+
+
+class Permutation:
+    """Constant-memory bijection on [0, n), so popular ranks aren't all low ids"""
+
+    def __init__(self, n, multiplier=2654435761):
+        self.n = n
+        while math.gcd(multiplier, n) != 1:
+            multiplier += 1
+        self.multiplier = multiplier
+
+    def __call__(self, rank):
+        return (rank * self.multiplier) % self.n
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-generate a large synthetic dataset (users, posts, follows, likes) "
+        "with power-law popularity, for reproducing production-scale performance"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10000)
+        parser.add_argument("--posts", type=int, default=50000)
+        parser.add_argument("--follows", type=int, default=200000)
+        parser.add_argument("--likes", type=int, default=500000)
+        parser.add_argument(
+            "--chunk-size", type=int, default=5000, help="Rows per bulk insert"
+        )
+        parser.add_argument(
+            "--seed", type=int, default=42, help="Same seed, same dataset"
+        )
+        parser.add_argument(
+            "--skew",
+            type=float,
+            default=3.0,
+            help="Power-law skew of who gets followed, posts and likes (1 = uniform)",
+        )
+        parser.add_argument(
+            "--days", type=int, default=365, help="Spread content over this many days"
+        )
+        parser.add_argument(
+            "--password",
+            default="benchpass123",
+            help="Password for every generated user (hashed once)",
+        )
+
+    def handle(self, *args, **options):
+        if sharding.enabled():
+            raise CommandError(
+                "Generate on an unsharded database, then run rebalance_shards"
+            )
+        if options["users"] < 2:
+            raise CommandError("--users must be at least 2")
+
+        self.rng = random.Random(options["seed"])
+        self.chunk_size = options["chunk_size"]
+        self.skew = options["skew"]
+        self.end = timezone.now()
+        self.start = self.end - timedelta(days=options["days"])
+
+        # explicit, contiguous ids: later rows reference earlier ones by
+        # arithmetic instead of keeping every id in memory
+        self.user_base = (User.objects.aggregate(m=Max("pk"))["m"] or 0) + 1
+        self.post_base = (Post.objects.aggregate(m=Max("pk"))["m"] or 0) + 1
+        self.n_users = options["users"]
+        self.n_posts = options["posts"]
+        self.user_rank = Permutation(self.n_users)
+        self.post_rank = Permutation(max(self.n_posts, 1))
+
+        started = time.perf_counter()
+        self.step("users", self.create_users, make_password(options["password"]))
+        self.step("posts", self.create_posts)
+        self.step("follows", self.create_follows, options["follows"])
+        if self.n_posts:
+            self.step("likes", self.create_likes, options["likes"])
+        self.step("profile counters", self.update_counters)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Generated dataset in {time.perf_counter() - started:.1f}s "
+                f"(users {self.user_base}..{self.user_base + self.n_users - 1})"
+            )
+        )
+
+    def step(self, label, func, *args):
+        started = time.perf_counter()
+        rows = func(*args)
+        elapsed = time.perf_counter() - started
+        rate = f", {rows / elapsed:,.0f} rows/s" if rows and elapsed else ""
+        self.stdout.write(f"{label}: {rows or 0:,} rows in {elapsed:.1f}s{rate}")
+
+    def chunks(self, total):
+        for offset in range(0, total, self.chunk_size):
+            yield range(offset, min(total, offset + self.chunk_size))
+
+    def random_time(self, after=None):
+        start = after or self.start
+        return start + (self.end - start) * self.rng.random()
+
+    def popular_user(self):
+        rank = power_law_index(self.rng, self.n_users, self.skew)
+        return self.user_base + self.user_rank(rank)
+
+    def create_users(self, password_hash):
+        for chunk in self.chunks(self.n_users):
+            users = []
+            profiles = []
+            for i in chunk:
+                pk = self.user_base + i
+                joined = self.random_time()
+                users.append(
+                    User(
+                        pk=pk,
+                        username=f"gen_user_{pk}",
+                        email=f"gen_user_{pk}@example.com",
+                        password=password_hash,
+                        first_name=f"User{pk}",
+                        date_joined=joined,
+                        created_at=joined,
+                        updated_at=joined,
+                    )
+                )
+                profiles.append(
+                    UserProfile(user_id=pk, created_at=joined, updated_at=joined)
+                )
+            with keep_timestamps(User, UserProfile), transaction.atomic():
+                User.objects.bulk_create(users)
+                UserProfile.objects.bulk_create(profiles)
+        return self.n_users
+
+    def create_posts(self):
+        span = self.end - self.start
+        for chunk in self.chunks(self.n_posts):
+            posts = []
+            for i in chunk:
+                # ids increase with time, like real posts
+                created = self.start + span * ((i + self.rng.random()) / self.n_posts)
+                posts.append(
+                    Post(
+                        pk=self.post_base + i,
+                        user_id=self.popular_user(),
+                        caption=self.rng.choice(CAPTIONS),
+                        image_url=f"https://picsum.photos/seed/{self.post_base + i}/600/600",
+                        created_at=created,
+                        updated_at=created,
+                    )
+                )
+            with keep_timestamps(Post), transaction.atomic():
+                Post.objects.bulk_create(posts)
+        return self.n_posts
+
+    def create_follows(self, total):
+        before = Follow.objects.count()
+        for chunk in self.chunks(total):
+            pairs = set()
+            for _ in chunk:
+                follower = self.user_base + self.rng.randrange(self.n_users)
+                following = self.popular_user()
+                if follower != following:
+                    pairs.add((follower, following))
+            follows = [
+                Follow(follower_id=a, following_id=b, created_at=self.random_time())
+                for a, b in sorted(pairs)
+            ]
+            # duplicates across chunks are dropped by the unique constraint
+            with keep_timestamps(Follow), transaction.atomic():
+                Follow.objects.bulk_create(follows, ignore_conflicts=True)
+        return Follow.objects.count() - before
+
+    def create_likes(self, total):
+        before = Like.objects.count()
+        for chunk in self.chunks(total):
+            picks = []
+            for _ in chunk:
+                user = self.user_base + self.rng.randrange(self.n_users)
+                rank = power_law_index(self.rng, self.n_posts, self.skew)
+                picks.append((user, self.post_base + self.post_rank(rank)))
+
+            # one query per chunk for the authors and dates of the posts hit
+            posts = {
+                pk: (author, created)
+                for pk, author, created in Post.objects.filter(
+                    pk__in={post for _, post in picks}
+                ).values_list("pk", "user_id", "created_at")
+            }
+            likes = {}
+            for user, post in picks:
+                author, created = posts[post]
+                if user != author and (user, post) not in likes:
+                    likes[(user, post)] = Like(
+                        user_id=user, post_id=post, created_at=self.random_time(created)
+                    )
+            with keep_timestamps(Like), transaction.atomic():
+                Like.objects.bulk_create(likes.values(), ignore_conflicts=True)
+        return Like.objects.count() - before
+
+    def update_counters(self):
+        def count_of(queryset, field):
+            return Coalesce(
+                Subquery(
+                    queryset.filter(**{field: OuterRef("user_id")})
+                    .order_by()
+                    .values(field)
+                    .annotate(n=Count("pk"))
+                    .values("n")
+                ),
+                0,
+            )
+
+        return UserProfile.objects.filter(user_id__gte=self.user_base).update(
+            followers_count=count_of(Follow.objects.all(), "following"),
+            following_count=count_of(Follow.objects.all(), "follower"),
+            posts_count=count_of(Post.objects.all(), "user"),
+        )
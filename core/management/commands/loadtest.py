@@ -0,0 +1,386 @@
+import http.client
+import json
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+from django.contrib.auth import get_user_model
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import Resolver404, resolve
+from rest_framework.authtoken.models import Token
+
+from core.benchmarks import (
+    QUERY_COUNT_HEADER,
+    QUERY_TIME_HEADER,
+    QueryCountingApp,
+    compare_to_baseline,
+    percentile,
+    serve_wsgi,
+    summarize,
+)
+from core.query_budgets import QUERY_BUDGETS
+
+User = get_user_model()
+
+API = "/api/v1"
+
+# scenario -> relative weight
+DEFAULT_WEIGHTS = {
+    "login": 5,
+    "scroll_feed": 40,
+    "like": 15,
+    "follow": 10,
+    "popular": 20,
+    "trending": 10,
+}
+
+
+class Client:
+    """One virtual user's keep-alive connection, recording every request"""
+
+    def __init__(self, base_url, samples):
+        parts = urlsplit(base_url)
+        self.host = parts.netloc
+        self.conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+        self.samples = samples
+        self.token = None
+
+    def request(self, method, path, data=None):
+        headers = {"Host": self.host, "Accept": "application/json"}
+        if self.token:
+            headers["Authorization"] = f"Token {self.token}"
+        body = None
+        if data is not None:
+            body = json.dumps(data).encode()
+            headers["Content-Type"] = "application/json"
+
+        start = time.perf_counter()
+        try:
+            self.conn.request(method, path, body, headers)
+            response = self.conn.getresponse()
+            payload = response.read()
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            status, payload, queries, db_ms = 0, b"", None, None
+        else:
+            status = response.status
+            queries = response.getheader(QUERY_COUNT_HEADER)
+            db_ms = response.getheader(QUERY_TIME_HEADER)
+        elapsed = time.perf_counter() - start
+
+        self.samples.append(
+            (
+                endpoint_name(path),
+                elapsed,
+                status,
+                int(queries) if queries else None,
+                float(db_ms) if db_ms else None,
+            )
+        )
+        if status >= 400 or not payload:
+            return status, None
+        return status, json.loads(payload)
+
+    def close(self):
+        self.conn.close()
+
+
+def endpoint_name(path):
+    """URL name a path resolves to, e.g. ``posts:feed``"""
+    try:
+        view_name = resolve(urlsplit(path).path).view_name
+    except Resolver404:
+        return path
+    return view_name.removeprefix("core:")
+
+
+# Scenarios: what one virtual user does in one session. Writes undo
+# themselves so repeated runs start from the same data.
+
+
+def login(client, rng, user):
+    client.request(
+        "POST", f"{API}/users/login/", {"username": user.username, "password": user.password}
+    )
+
+
+def scroll_feed(client, rng, user):
+    for page in range(1, rng.randint(1, 3) + 1):
+        _, body = client.request("GET", f"{API}/posts/feed/?page={page}")
+        if not body or not body.get("next"):
+            break
+
+
+def like(client, rng, user):
+    _, body = client.request("GET", f"{API}/posts/feed/")
+    candidates = [
+        post
+        for post in (body or {}).get("results", [])
+        if not post["is_liked"] and post["user"]["id"] != user.pk
+    ]
+    if candidates:
+        post_id = rng.choice(candidates)["id"]
+        client.request("POST", f"{API}/social/like/{post_id}/")
+        client.request("DELETE", f"{API}/social/unlike/{post_id}/")
+
+
+def follow(client, rng, user):
+    _, suggested = client.request("GET", f"{API}/social/suggested/")
+    if suggested:
+        user_id = rng.choice(suggested)["id"]
+        client.request("POST", f"{API}/social/follow/{user_id}/")
+        client.request("DELETE", f"{API}/social/unfollow/{user_id}/")
+
+
+def popular(client, rng, user):
+    client.request("GET", f"{API}/posts/popular/")
+
+
+def trending(client, rng, user):
+    client.request("GET", f"{API}/social/trending/")
+
+
+SCENARIOS = {
+    "login": login,
+    "scroll_feed": scroll_feed,
+    "like": like,
+    "follow": follow,
+    "popular": popular,
+    "trending": trending,
+}
+
+
+class VirtualUser:
+    """Account details a worker needs; ``password`` is the plain text one"""
+
+    def __init__(self, pk, username, password, token):
+        self.pk = pk
+        self.username = username
+        self.password = password
+        self.token = token
+
+
+def parse_weights(values):
+    weights = dict(DEFAULT_WEIGHTS)
+    for value in values or []:
+        name, _, weight = value.partition("=")
+        if name not in SCENARIOS or not weight.isdigit():
+            raise CommandError(
+                f"Bad --scenario {value!r}; expected NAME=WEIGHT with NAME one of "
+                f"{', '.join(SCENARIOS)}"
+            )
+        weights[name] = int(weight)
+    weights = {name: weight for name, weight in weights.items() if weight}
+    if not weights:
+        raise CommandError("Every scenario has weight 0")
+    return weights
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay weighted user scenarios (login, feed scrolling, likes, follows, "
+        "popular, trending) against a local server and report latency "
+        "percentiles, throughput and queries per request for each endpoint"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--duration", type=float, default=30.0, help="Seconds to run for"
+        )
+        parser.add_argument(
+            "--concurrency", type=int, default=8, help="Virtual users running at once"
+        )
+        parser.add_argument(
+            "--users", type=int, default=100, help="Accounts the virtual users log in as"
+        )
+        parser.add_argument(
+            "--password",
+            default="benchpass123",
+            help="Password of those accounts (generate_dataset's default)",
+        )
+        parser.add_argument(
+            "--scenario",
+            action="append",
+            metavar="NAME=WEIGHT",
+            help=f"Override a scenario weight (defaults: {DEFAULT_WEIGHTS})",
+        )
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument(
+            "--url",
+            help="Target an already running server instead of starting one "
+            "(queries per request are then not reported)",
+        )
+        parser.add_argument("--output", help="Write the results as JSON to this file")
+        parser.add_argument("--baseline", help="JSON results of an earlier run to compare to")
+        parser.add_argument(
+            "--max-regression",
+            type=float,
+            default=10.0,
+            help="Fail when a metric is this many percent worse than the baseline",
+        )
+        parser.add_argument(
+            "--enforce-budgets",
+            action="store_true",
+            help="Fail when an endpoint's p95 SQL time per request exceeds its "
+            "max_ms in core/query_budgets.py (not with --url)",
+        )
+
+    def handle(self, *args, **options):
+        weights = parse_weights(options["scenario"])
+        rng = random.Random(options["seed"])
+        users = self.virtual_users(rng, options["users"], options["password"])
+
+        self.stdout.write(
+            f"Running {', '.join(f'{n}={w}' for n, w in weights.items())} for "
+            f"{options['duration']:g}s with {options['concurrency']} virtual users"
+        )
+        # the dev settings log every query, which would swamp the output
+        logging.disable(logging.INFO)
+        try:
+            if options["url"]:
+                samples, elapsed = self.run(options["url"], users, weights, options)
+            else:
+                with serve_wsgi(QueryCountingApp(WSGIHandler())) as base_url:
+                    samples, elapsed = self.run(base_url, users, weights, options)
+        finally:
+            logging.disable(logging.NOTSET)
+
+        results = self.report(samples, elapsed, weights, options)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+        if options["enforce_budgets"]:
+            self.check_budgets(results)
+        if options["baseline"]:
+            self.compare(results, options["baseline"], options["max_regression"])
+
+    def virtual_users(self, rng, count, password):
+        pks = list(User.objects.filter(is_active=True).values_list("pk", flat=True))
+        if not pks:
+            raise CommandError("No users found. Run generate_dataset first.")
+        chosen = rng.sample(pks, min(count, len(pks)))
+        users = []
+        # tokens are issued up front so only the login scenario pays for hashing
+        for user in User.objects.filter(pk__in=chosen).order_by("pk"):
+            token, _ = Token.objects.get_or_create(user=user)
+            users.append(VirtualUser(user.pk, user.username, password, token.key))
+        return users
+
+    def run(self, base_url, users, weights, options):
+        samples = []
+        deadline = time.perf_counter() + options["duration"]
+        names = list(weights)
+        scenario_weights = list(weights.values())
+
+        def worker(index):
+            rng = random.Random(f"{options['seed']}-{index}")
+            client = Client(base_url, samples)
+            try:
+                while time.perf_counter() < deadline:
+                    user = rng.choice(users)
+                    client.token = user.token
+                    scenario = rng.choices(names, weights=scenario_weights)[0]
+                    SCENARIOS[scenario](client, rng, user)
+            finally:
+                client.close()
+
+        threads = [
+            threading.Thread(target=worker, args=(i,))
+            for i in range(options["concurrency"])
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return samples, time.perf_counter() - started
+
+    def report(self, samples, elapsed, weights, options):
+        by_endpoint = defaultdict(list)
+        for sample in samples:
+            by_endpoint[sample[0]].append(sample)
+
+        def stats(group):
+            result = summarize(
+                [latency for _, latency, _, _, _ in group],
+                elapsed,
+                errors=sum(1 for _, _, status, _, _ in group if not 0 < status < 400),
+            )
+            queries = [q for _, _, _, q, _ in group if q is not None]
+            result["queries_per_request"] = (
+                round(sum(queries) / len(queries), 2) if queries else None
+            )
+            db_times = sorted(ms for _, _, _, _, ms in group if ms is not None)
+            result["db_p95_ms"] = round(percentile(db_times, 95), 3) if db_times else None
+            return result
+
+        results = {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "options": {
+                "duration": options["duration"],
+                "concurrency": options["concurrency"],
+                "users": options["users"],
+                "seed": options["seed"],
+                "scenarios": weights,
+            },
+            "overall": stats(samples),
+            "endpoints": {name: stats(group) for name, group in sorted(by_endpoint.items())},
+        }
+
+        self.stdout.write(
+            f"{'endpoint':<26}{'reqs':>7}{'err':>5}{'rps':>9}{'p50 ms':>9}"
+            f"{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}{'db p95':>9}"
+        )
+        rows = list(results["endpoints"].items()) + [("overall", results["overall"])]
+        for name, row in rows:
+            queries, db_ms = row["queries_per_request"], row["db_p95_ms"]
+            self.stdout.write(
+                f"{name:<26}{row['requests']:>7}{row['errors']:>5}{row['rps']:>9.1f}"
+                f"{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}"
+                f"{'-' if queries is None else f'{queries:g}':>9}"
+                f"{'-' if db_ms is None else f'{db_ms:.1f}':>9}"
+            )
+        return results
+
+    def check_budgets(self, results):
+        timed = {
+            name: row["db_p95_ms"]
+            for name, row in results["endpoints"].items()
+            if row["db_p95_ms"] is not None
+        }
+        if not timed:
+            raise CommandError("No SQL timings to check; --enforce-budgets can't be used with --url")
+        over = [
+            f"{name} ({ms:g}ms > {QUERY_BUDGETS[name].max_ms:g}ms)"
+            for name, ms in sorted(timed.items())
+            if name in QUERY_BUDGETS and ms > QUERY_BUDGETS[name].max_ms
+        ]
+        if over:
+            raise CommandError(f"p95 SQL time over budget: {', '.join(over)}")
+        self.stdout.write(self.style.SUCCESS("SQL time within budget"))
+
+    def compare(self, results, baseline_path, max_regression):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        rows, regressions = compare_to_baseline(
+            results["endpoints"], baseline.get("endpoints", {}), max_regression
+        )
+
+        self.stdout.write(f"\nCompared to {baseline_path}:")
+        for row in rows:
+            endpoint, metric, before, after, change = row
+            marker = "  REGRESSION" if row in regressions else ""
+            self.stdout.write(
+                f"{endpoint:<26}{metric:<21}{before:>10g} -> {after:<10g}{change:+.1f}%{marker}"
+            )
+        if regressions:
+            raise CommandError(
+                f"{len(regressions)} metric(s) regressed by more than {max_regression:g}%"
+            )
+        self.stdout.write(self.style.SUCCESS("No regressions"))
@@ -0,0 +1,69 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import purge
+from core.models import PurgeJob
+
+
+class Command(BaseCommand):
+    help = (
+        "Remove soft-deleted accounts and posts in small batches; interrupted "
+        "jobs resume where they stopped"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, help="Rows per transaction")
+        parser.add_argument("--pause", type=float, help="Seconds to sleep between batches")
+        parser.add_argument(
+            "--max-seconds",
+            type=float,
+            help="Stop after this long; unfinished jobs continue on the next run",
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep polling for new jobs instead of exiting when the queue is empty",
+        )
+        parser.add_argument("--poll", type=float, default=5.0, help="Seconds between polls")
+        parser.add_argument(
+            "--retry-failed", action="store_true", help="Queue failed jobs again first"
+        )
+        parser.add_argument(
+            "--list", action="store_true", help="Show unfinished jobs and their progress"
+        )
+
+    def handle(self, *args, **options):
+        if options["list"]:
+            self.list_jobs()
+            return
+        if options["retry_failed"]:
+            retried = PurgeJob.objects.filter(status=PurgeJob.FAILED).update(
+                status=PurgeJob.PENDING, attempts=0
+            )
+            self.stdout.write(f"{retried} failed job(s) queued again")
+
+        deadline = None
+        if options["max_seconds"]:
+            deadline = time.monotonic() + options["max_seconds"]
+        total = 0
+        while True:
+            total += purge.run_pending(deadline, options["batch_size"], options["pause"])
+            if not options["loop"] or (deadline and time.monotonic() >= deadline):
+                break
+            time.sleep(options["poll"])
+        self.stdout.write(self.style.SUCCESS(f"{total} purge job(s) finished"))
+
+    def list_jobs(self):
+        jobs = PurgeJob.objects.exclude(status=PurgeJob.DONE).order_by("created_at")
+        if not jobs:
+            self.stdout.write("No unfinished purge jobs")
+            return
+        for job in jobs:
+            progress = ", ".join(f"{stage} {count}" for stage, count in job.progress.items())
+            self.stdout.write(
+                f"#{job.pk} {job.kind} {job.object_id} {job.status}"
+                f" stage={job.stage or '-'} deleted={job.deleted_rows}"
+                + (f" ({progress})" if progress else "")
+                + (f" attempts={job.attempts}" if job.attempts > 1 else "")
+            )
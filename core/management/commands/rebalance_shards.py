@@ -0,0 +1,125 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from core import sharding
+from core.db import keep_timestamps
+from posts.models import Post
+from social.models import Like
+from users.models import UserProfile
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Move posts (and their likes) onto the shard their author maps to, "
+        "after mirroring users and profiles onto every shard"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=500, help="Rows copied per transaction"
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report what would move without writing anything",
+        )
+
+    def handle(self, *args, **options):
+        shards = sharding.shard_aliases()
+        if not shards:
+            raise CommandError(
+                "No POST_SHARDS configured (try --settings=image_sharing_api.settings.sharded)"
+            )
+        batch_size = options["batch_size"]
+        dry_run = options["dry_run"]
+
+        for alias in shards:
+            copied = self.sync_reference_data(alias, batch_size, dry_run)
+            self.stdout.write(f"{alias}: {copied} users/profiles copied")
+
+        # the primary is a source too, for data created before sharding
+        for source in [DEFAULT_DB_ALIAS] + shards:
+            moved_posts = moved_likes = 0
+            authors = (
+                Post.all_objects.using(source)
+                .order_by()
+                .values_list("user_id", flat=True)
+                .distinct()
+            )
+            for user_id in list(authors):
+                target = sharding.shard_for_user(user_id)
+                if target == source:
+                    continue
+                posts, likes = self.move_author(
+                    user_id, source, target, batch_size, dry_run
+                )
+                moved_posts += posts
+                moved_likes += likes
+
+            verb = "would move" if dry_run else "moved"
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"{source}: {verb} {moved_posts} posts and {moved_likes} likes"
+                )
+            )
+
+    def sync_reference_data(self, alias, batch_size, dry_run):
+        """Copy users and profiles missing from ``alias``"""
+        copied = 0
+        for model in (User, UserProfile):
+            last_pk = 0
+            while True:
+                chunk = list(
+                    model.objects.using(DEFAULT_DB_ALIAS)
+                    .filter(pk__gt=last_pk)
+                    .order_by("pk")[:batch_size]
+                )
+                if not chunk:
+                    break
+                last_pk = chunk[-1].pk
+                existing = set(
+                    model.objects.using(alias)
+                    .filter(pk__in=[obj.pk for obj in chunk])
+                    .values_list("pk", flat=True)
+                )
+                missing = [obj for obj in chunk if obj.pk not in existing]
+                if missing and not dry_run:
+                    with keep_timestamps(model):
+                        model.objects.using(alias).bulk_create(missing)
+                copied += len(missing)
+        return copied
+
+    def move_author(self, user_id, source, target, batch_size, dry_run):
+        """
+        Copy one author's posts and likes to ``target`` then delete them
+        from ``source``, a batch at a time. Rows exist on both shards between
+        the two steps, so an interrupted run is safe to repeat.
+        """
+        moved_posts = moved_likes = 0
+        last_pk = 0
+        while True:
+            posts = list(
+                Post.all_objects.using(source)
+                .filter(user_id=user_id, pk__gt=last_pk)
+                .order_by("pk")[:batch_size]
+            )
+            if not posts:
+                break
+            last_pk = posts[-1].pk
+            post_ids = [post.pk for post in posts]
+            likes = list(Like.objects.using(source).filter(post_id__in=post_ids))
+
+            if not dry_run:
+                with keep_timestamps(Post, Like), transaction.atomic(using=target):
+                    Post.objects.using(target).bulk_create(posts, ignore_conflicts=True)
+                    Like.objects.using(target).bulk_create(likes, ignore_conflicts=True)
+                with transaction.atomic(using=source):
+                    Like.objects.using(source).filter(post_id__in=post_ids).delete()
+                    Post.all_objects.using(source).filter(pk__in=post_ids).delete()
+
+            moved_posts += len(posts)
+            moved_likes += len(likes)
+        return moved_posts, moved_likes
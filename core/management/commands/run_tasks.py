@@ -0,0 +1,53 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import tasks
+from core.models import Task
+
+
+class Command(BaseCommand):
+    help = "Run queued background tasks on a thread pool, retrying failures with backoff"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, help="Worker threads; 0 runs tasks inline")
+        parser.add_argument("--batch-size", type=int, help="Tasks claimed at a time")
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep polling for new tasks instead of exiting when the queue is empty",
+        )
+        parser.add_argument("--poll", type=float, default=1.0, help="Seconds between polls")
+        parser.add_argument("--max-seconds", type=float, help="Stop looping after this long")
+        parser.add_argument(
+            "--prune", action="store_true", help="Delete finished tasks past the retention window"
+        )
+        parser.add_argument(
+            "--retry-failed", action="store_true", help="Queue failed tasks again first"
+        )
+
+    def handle(self, *args, **options):
+        if options["retry_failed"]:
+            retried = 0
+            for using in tasks.databases():
+                retried += Task.objects.using(using).filter(status=Task.FAILED).update(
+                    status=Task.PENDING, attempts=0, finished_at=None
+                )
+            self.stdout.write(f"{retried} failed task(s) queued again")
+
+        deadline = None
+        if options["max_seconds"]:
+            deadline = time.monotonic() + options["max_seconds"]
+        succeeded = failed = 0
+        while True:
+            done, errors = tasks.run_pending(options["threads"], options["batch_size"])
+            succeeded += done
+            failed += errors
+            if not options["loop"] or (deadline and time.monotonic() >= deadline):
+                break
+            time.sleep(options["poll"])
+
+        if options["prune"]:
+            self.stdout.write(f"{tasks.prune()} finished task(s) pruned")
+        message = f"{succeeded} task(s) done, {failed} failed"
+        self.stdout.write(self.style.SUCCESS(message) if not failed else self.style.WARNING(message))
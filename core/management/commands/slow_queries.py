@@ -0,0 +1,108 @@
+import glob
+import json
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.slow_queries import config
+
+# a bare "SCAN <table>" plan step reads the whole table
+FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+
+SORT_KEYS = {
+    "total": lambda entry: entry["total_ms"],
+    "max": lambda entry: entry["max_ms"],
+    "count": lambda entry: entry["count"],
+    "mean": lambda entry: entry["total_ms"] / entry["count"],
+}
+
+
+def read_entries(path):
+    """Entries of the log and its rotated files, oldest first"""
+    rotated = []
+    for name in glob.glob(f"{glob.escape(path)}.*"):
+        suffix = name[len(path) + 1 :]
+        if suffix.isdigit():
+            rotated.append((int(suffix), name))
+    # RotatingFileHandler: .1 is the newest backup
+    paths = [name for _, name in sorted(rotated, reverse=True)] + [path]
+    for name in paths:
+        try:
+            with open(name, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+        except FileNotFoundError:
+            continue
+
+
+def summarize(entries):
+    """Merge the per-interval lines of each fingerprint"""
+    merged = {}
+    for entry in entries:
+        key = entry["fingerprint"]
+        if key not in merged:
+            merged[key] = {**entry, "routes": set()}
+            merged[key].setdefault("plan", None)
+        else:
+            current = merged[key]
+            current["count"] += entry["count"]
+            current["total_ms"] += entry["total_ms"]
+            current["max_ms"] = max(current["max_ms"], entry["max_ms"])
+            current["last_seen"] = entry["last_seen"]
+            if current["plan"] is None and entry.get("plan"):
+                current["plan"] = entry["plan"]
+                current["params"] = entry.get("params")
+        merged[key]["routes"].add(entry["route"] or "-")
+    return list(merged.values())
+
+
+class Command(BaseCommand):
+    help = "Summarize the slow-query log: the worst statements with their call site and plan"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--path", help="Log file (default: SLOW_QUERY_LOG['PATH'])")
+        parser.add_argument("--sort", choices=sorted(SORT_KEYS), default="total")
+        parser.add_argument("--limit", type=int, default=10)
+        parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+
+    def handle(self, *args, **options):
+        path = options["path"] or config()["PATH"]
+        if not path:
+            raise CommandError("No log file; set SLOW_QUERY_LOG['PATH'] or pass --path")
+
+        entries = summarize(read_entries(str(path)))
+        entries.sort(key=SORT_KEYS[options["sort"]], reverse=True)
+        entries = entries[: options["limit"]]
+        for entry in entries:
+            entry["routes"] = sorted(entry["routes"])
+            entry["full_scans"] = [
+                match.group(1)
+                for step in entry["plan"] or []
+                if (match := FULL_SCAN.match(step))
+            ]
+
+        if options["json"]:
+            self.stdout.write(json.dumps(entries, indent=2))
+            return
+        if not entries:
+            self.stdout.write("No slow queries logged")
+            return
+
+        for rank, entry in enumerate(entries, 1):
+            mean = entry["total_ms"] / entry["count"]
+            self.stdout.write(
+                f"#{rank} {entry['count']}x total {entry['total_ms']:.0f}ms, "
+                f"mean {mean:.1f}ms, max {entry['max_ms']:.1f}ms "
+                f"[{', '.join(entry['routes'])}] {entry['fingerprint']}"
+            )
+            self.stdout.write(f"   {entry['sql']}")
+            for frame in entry["stack"]:
+                self.stdout.write(f"   at {frame}")
+            for step in entry["plan"] or []:
+                self.stdout.write(f"   plan: {step}")
+            if entry["full_scans"]:
+                self.stdout.write(
+                    self.style.WARNING(f"   full table scan of {', '.join(entry['full_scans'])}")
+                )
+            self.stdout.write("")
@@ -0,0 +1,33 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = "Copy the primary SQLite database onto the local replica files"
+
+    def handle(self, *args, **options):
+        replicas = getattr(settings, "DATABASE_REPLICAS", [])
+        if not replicas:
+            raise CommandError(
+                "No DATABASE_REPLICAS configured (try --settings=image_sharing_api.settings.replicas)"
+            )
+
+        primary = connections["default"].settings_dict
+        if primary["ENGINE"] != "django.db.backends.sqlite3":
+            raise CommandError("sync_replicas only supports SQLite databases")
+
+        source = sqlite3.connect(primary["NAME"])
+        try:
+            for alias in replicas:
+                target = sqlite3.connect(connections[alias].settings_dict["NAME"])
+                try:
+                    # online backup: consistent snapshot even while the primary takes writes
+                    source.backup(target)
+                finally:
+                    target.close()
+                self.stdout.write(self.style.SUCCESS(f"Synced {alias}"))
+        finally:
+            source.close()
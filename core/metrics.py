@@ -0,0 +1,518 @@
+"""
+In-process metrics registry with Prometheus text exposition.
+
+Counters, gauges and fixed-bucket histograms, keyed by label values. With
+``METRICS_DIR`` set, each worker process keeps its values in its own
+mmap'd file in that directory and a scrape adds up every file, so the
+numbers cover all workers no matter which one serves ``/core/metrics/``.
+Files of processes that are gone (found by a scrape, or left under a pid
+the OS handed out again) have their counters and histograms folded into
+``metrics_archive.db`` and are removed, so totals keep growing while dead
+workers' gauges disappear. Without ``METRICS_DIR`` values live in memory
+and only cover the current process.
+
+Values that already exist elsewhere (cache hit counts, pool sizes) are
+copied in by collectors, which run before a scrape and at most every
+``COLLECT_INTERVAL`` seconds while requests come in.
+"""
+import bisect
+import glob
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: one process, nothing to coordinate with
+    fcntl = None
+
+from django.conf import settings
+
+COLLECT_INTERVAL = 5.0
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+_HEADER = struct.Struct("Q")  # bytes in use
+_KEY_LENGTH = struct.Struct("I")
+_VALUE = struct.Struct("d")
+_FILE_PATTERN = re.compile(r"metrics_(\d+)\.db$")
+ARCHIVE_FILE = "metrics_archive.db"
+LOCK_FILE = "metrics.lock"
+
+
+def _align(pos):
+    return (pos + 7) & ~7
+
+
+def _read_entries(buf):
+    """``(key, value, value_offset)`` for every entry of a values file"""
+    (used,) = _HEADER.unpack_from(buf, 0)
+    pos = _HEADER.size
+    while pos < used:
+        (length,) = _KEY_LENGTH.unpack_from(buf, pos)
+        pos += _KEY_LENGTH.size
+        key = bytes(buf[pos : pos + length]).decode()
+        pos = _align(pos + length)
+        (value,) = _VALUE.unpack_from(buf, pos)
+        yield key, value, pos
+        pos += _VALUE.size
+
+
+class MmapValues:
+    """
+    key -> float store in a file owned by one process.
+
+    Entries are appended and the used size in the header is written last,
+    so other processes can read the file at any time without locking.
+    """
+
+    def __init__(self, path, initial_size=1 << 16):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        size = os.fstat(self._fd).st_size
+        if size == 0:
+            size = initial_size
+            os.ftruncate(self._fd, size)
+        self._mmap = mmap.mmap(self._fd, size)
+        if _HEADER.unpack_from(self._mmap, 0)[0] == 0:
+            _HEADER.pack_into(self._mmap, 0, _HEADER.size)
+        self._positions = {key: pos for key, _, pos in _read_entries(self._mmap)}
+
+    def _position(self, key):
+        pos = self._positions.get(key)
+        if pos is None:
+            encoded = key.encode()
+            (used,) = _HEADER.unpack_from(self._mmap, 0)
+            pos = _align(used + _KEY_LENGTH.size + len(encoded))
+            end = pos + _VALUE.size
+            if end > len(self._mmap):
+                self._grow(end)
+            _KEY_LENGTH.pack_into(self._mmap, used, len(encoded))
+            self._mmap[used + _KEY_LENGTH.size : used + _KEY_LENGTH.size + len(encoded)] = encoded
+            _VALUE.pack_into(self._mmap, pos, 0.0)
+            _HEADER.pack_into(self._mmap, 0, end)
+            self._positions[key] = pos
+        return pos
+
+    def _grow(self, needed):
+        size = len(self._mmap)
+        while size < needed:
+            size *= 2
+        self._mmap.close()
+        os.ftruncate(self._fd, size)
+        self._mmap = mmap.mmap(self._fd, size)
+
+    def inc(self, key, amount):
+        with self._lock:
+            pos = self._position(key)
+            _VALUE.pack_into(self._mmap, pos, _VALUE.unpack_from(self._mmap, pos)[0] + amount)
+
+    def set(self, key, value):
+        with self._lock:
+            _VALUE.pack_into(self._mmap, self._position(key), value)
+
+    def items(self):
+        with self._lock:
+            return [(key, value) for key, value, _ in _read_entries(self._mmap)]
+
+    def close(self):
+        self._mmap.close()
+        os.close(self._fd)
+
+
+class MemoryValues:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = defaultdict(float)
+
+    def inc(self, key, amount):
+        with self._lock:
+            self._values[key] += amount
+
+    def set(self, key, value):
+        with self._lock:
+            self._values[key] = value
+
+    def items(self):
+        with self._lock:
+            return list(self._values.items())
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read_file(path):
+    """A values file's items, or None if it is gone or not written yet"""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    if len(data) < _HEADER.size:
+        return None
+    return [(key, value) for key, value, _ in _read_entries(data)]
+
+
+def _key(sample, labels):
+    return json.dumps([sample, labels], separators=(",", ":"))
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Metric:
+    kind = None
+    # "sum": add up every worker's file, "livesum": only running workers
+    mode = "sum"
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _labels(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return [[name, str(labels[name])] for name in self.labelnames]
+
+    def samples(self):
+        """The sample names stored for this metric"""
+        return [self.name]
+
+    def expose(self, aggregated):
+        """Exposition lines from ``Registry.aggregate()`` output"""
+        lines = []
+        for (sample, labels), value in sorted(aggregated.get(self.name, {}).items()):
+            lines.append(f"{sample}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        self.registry.values.inc(_key(self.name, self._labels(labels)), amount)
+
+    def set_total(self, value, **labels):
+        """For collectors copying a running total kept elsewhere"""
+        self.registry.values.set(_key(self.name, self._labels(labels)), value)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+    mode = "livesum"
+
+    def set(self, value, **labels):
+        self.registry.values.set(_key(self.name, self._labels(labels)), value)
+
+    def inc(self, amount=1, **labels):
+        self.registry.values.inc(_key(self.name, self._labels(labels)), amount)
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def samples(self):
+        return [f"{self.name}_bucket", f"{self.name}_sum", f"{self.name}_count"]
+
+    def observe(self, value, **labels):
+        labels = self._labels(labels)
+        values = self.registry.values
+        # one bucket per observation; buckets are made cumulative on scrape
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            le = _format_value(self.buckets[index])
+            values.inc(_key(f"{self.name}_bucket", labels + [["le", le]]), 1)
+        values.inc(_key(f"{self.name}_sum", labels), value)
+        values.inc(_key(f"{self.name}_count", labels), 1)
+
+    def expose(self, aggregated):
+        series = defaultdict(dict)
+        for (sample, labels), value in aggregated.get(self.name, {}).items():
+            if sample.endswith("_bucket"):
+                series[labels[:-1]][labels[-1][1]] = value
+            else:
+                series[labels][sample] = value
+
+        lines = []
+        for labels in sorted(series):
+            data = series[labels]
+            cumulative = 0
+            for bound in self.buckets:
+                cumulative += data.get(_format_value(bound), 0)
+                le = labels + (("le", _format_value(bound)),)
+                lines.append(f"{self.name}_bucket{_format_labels(le)} {_format_value(cumulative)}")
+            count = data.get(f"{self.name}_count", 0)
+            le = labels + (("le", "+Inf"),)
+            lines.append(f"{self.name}_bucket{_format_labels(le)} {_format_value(count)}")
+            lines.append(
+                f"{self.name}_sum{_format_labels(labels)} "
+                f"{_format_value(data.get(f'{self.name}_sum', 0))}"
+            )
+            lines.append(f"{self.name}_count{_format_labels(labels)} {_format_value(count)}")
+        return lines
+
+
+class Ratio(Metric):
+    """Gauge computed on scrape as ``numerator / (numerator + other)``"""
+
+    kind = "gauge"
+
+    def __init__(self, registry, name, documentation, numerator, other):
+        super().__init__(registry, name, documentation, numerator.labelnames)
+        self.numerator = numerator
+        self.other = other
+
+    def samples(self):
+        return []
+
+    def expose(self, aggregated):
+        hits = aggregated.get(self.numerator.name, {})
+        misses = aggregated.get(self.other.name, {})
+        lines = []
+        for (_, labels), value in sorted(hits.items()):
+            total = value + misses.get((self.other.name, labels), 0)
+            ratio = value / total if total else 0.0
+            lines.append(f"{self.name}{_format_labels(labels)} {_format_value(round(ratio, 4))}")
+        return lines
+
+
+class Registry:
+    def __init__(self, directory=None):
+        self._directory = directory
+        self._metrics = {}
+        self._families = {}
+        self._collectors = []
+        self._values = None
+        self._pid = None
+        self._last_collect = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def directory(self):
+        if self._directory is not None:
+            return self._directory
+        return getattr(settings, "METRICS_DIR", None)
+
+    @property
+    def values(self):
+        pid = os.getpid()
+        # a forked worker must not write into its parent's file
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    if self.directory:
+                        os.makedirs(self.directory, exist_ok=True)
+                        path = os.path.join(self.directory, f"metrics_{pid}.db")
+                        with self._directory_lock():
+                            # left by an earlier process with the same pid
+                            if os.path.exists(path):
+                                self._retire(path)
+                            self._values = MmapValues(path)
+                    else:
+                        self._values = MemoryValues()
+                    self._pid = pid
+        return self._values
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        for sample in metric.samples():
+            self._families[sample] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(self, name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(self, name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(self, name, documentation, labelnames, buckets))
+
+    def ratio(self, name, documentation, numerator, other):
+        return self._register(Ratio(self, name, documentation, numerator, other))
+
+    def collector(self, func):
+        """Register ``func()`` to copy outside values into metrics"""
+        self._collectors.append(func)
+        return func
+
+    def collect(self):
+        self._last_collect = time.monotonic()
+        for func in self._collectors:
+            func()
+
+    def maybe_collect(self):
+        if time.monotonic() - self._last_collect >= COLLECT_INTERVAL:
+            self.collect()
+
+    @contextmanager
+    def _directory_lock(self):
+        with open(os.path.join(self.directory, LOCK_FILE), "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _retire(self, path):
+        """
+        Add a dead process's counters and histograms to the archive and
+        remove its file; its gauges are dropped. Call with the lock held.
+        """
+        archive = None
+        try:
+            for key, value in _read_file(path) or ():
+                metric = self._families.get(json.loads(key)[0])
+                if metric is None or metric.mode != "sum" or not value:
+                    continue
+                if archive is None:
+                    archive = MmapValues(os.path.join(self.directory, ARCHIVE_FILE))
+                archive.inc(key, value)
+        finally:
+            if archive is not None:
+                archive.close()
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _sources(self):
+        """``(pid, items)`` for this process, or every worker's file and the archive"""
+        if not self.directory:
+            return [(os.getpid(), self.values.items())]
+        self.values  # make sure this process has a file
+        sources = []
+        with self._directory_lock():
+            for path in glob.glob(os.path.join(self.directory, "metrics_*.db")):
+                match = _FILE_PATTERN.search(path)
+                if match is None:
+                    continue
+                pid = int(match.group(1))
+                if pid != os.getpid() and not _pid_alive(pid):
+                    self._retire(path)
+                    continue
+                items = _read_file(path)
+                if items is not None:
+                    sources.append((pid, items))
+            archived = _read_file(os.path.join(self.directory, ARCHIVE_FILE))
+            if archived is not None:
+                # only counters and histograms, so no pid to check
+                sources.append((None, archived))
+        return sources
+
+    def aggregate(self):
+        """``{metric name: {(sample, labels): value}}`` over all workers"""
+        aggregated = defaultdict(lambda: defaultdict(float))
+        for pid, items in self._sources():
+            alive = None
+            for key, value in items:
+                sample, labels = json.loads(key)
+                metric = self._families.get(sample)
+                if metric is None:
+                    continue
+                if metric.mode == "livesum":
+                    if alive is None:
+                        alive = pid is not None and (pid == os.getpid() or _pid_alive(pid))
+                    if not alive:
+                        continue
+                labels = tuple(tuple(pair) for pair in labels)
+                aggregated[metric.name][(sample, labels)] += value
+        return aggregated
+
+    def exposition(self):
+        self.collect()
+        aggregated = self.aggregate()
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.expose(aggregated))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUESTS = registry.counter(
+    "http_requests_total", "Requests served", ["route", "method", "status"]
+)
+REQUEST_LATENCY = registry.histogram(
+    "http_request_duration_seconds", "Time to serve a request", ["route", "method"]
+)
+REQUEST_QUERIES = registry.histogram(
+    "http_request_db_queries",
+    "Database queries run per request",
+    ["route"],
+    buckets=QUERY_BUCKETS,
+)
+REQUEST_DB_TIME = registry.histogram(
+    "http_request_db_duration_seconds", "Database time per request", ["route"]
+)
+REQUESTS_IN_FLIGHT = registry.gauge(
+    "http_requests_in_flight", "Requests being served by running workers"
+)
+CACHE_HITS = registry.counter("cache_hits_total", "Cache lookups answered", ["cache"])
+CACHE_MISSES = registry.counter("cache_misses_total", "Cache lookups missed", ["cache"])
+CACHE_HIT_RATIO = registry.ratio(
+    "cache_hit_ratio", "Share of cache lookups answered", CACHE_HITS, CACHE_MISSES
+)
+CACHE_SIZE = registry.gauge("cache_entries", "Entries held in local caches", ["cache"])
+
+
+def observe_request(route, method, status, seconds, queries, db_seconds):
+    REQUESTS.inc(route=route, method=method, status=status)
+    REQUEST_LATENCY.observe(seconds, route=route, method=method)
+    REQUEST_QUERIES.observe(queries, route=route)
+    REQUEST_DB_TIME.observe(db_seconds, route=route)
+
+
+@registry.collector
+def collect_caches():
+    from .cache import registered_caches
+
+    for cache in registered_caches():
+        stats = cache.stats()
+        # a process's total, so set rather than add
+        CACHE_HITS.set_total(stats["hits"], cache=stats["name"])
+        CACHE_MISSES.set_total(stats["misses"], cache=stats["name"])
+        CACHE_SIZE.set(stats["size"], cache=stats["name"])
@@ -0,0 +1,284 @@
+import hmac
+import json
+import logging
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import metrics, perf, profiling
+from .routers import activate_pin, deactivate_pin, mark_recent_write
+
+performance_logger = logging.getLogger("core.performance")
+
+
+class ReplicaPinningMiddleware:
+    """
+    Tracks which requests must read from the primary database.
+
+    After a successful write the user is pinned to the primary for
+    ``REPLICA_PIN_SECONDS`` so replica lag never hides their own changes.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        token = activate_pin(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            deactivate_pin(token)
+        self._record_write(request, response)
+        return response
+
+    async def __acall__(self, request):
+        token = activate_pin(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            deactivate_pin(token)
+        self._record_write(request, response)
+        return response
+
+    def _record_write(self, request, response):
+        if request.method in ("GET", "HEAD", "OPTIONS") or response.status_code >= 400:
+            return
+        user = getattr(request, "user", None)
+        if user is not None and user.is_authenticated:
+            mark_recent_write(user.pk)
+
+
+class PerformanceMiddleware:
+    """
+    Times a sample of requests: DB queries and time, view, serialization and
+    rendering, plus the response size.
+
+    Results are sent back in a ``Server-Timing`` header and logged as one
+    JSON line per request on the ``core.performance`` logger, tagged with
+    the URL name. ``PERFORMANCE_SAMPLE_RATE`` sets the share of requests
+    measured; the rest only pay for one random number.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        if not self._sampled():
+            return self.get_response(request)
+        timings, token = perf.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            perf.stop(token)
+        self._report(request, response, timings)
+        return response
+
+    async def __acall__(self, request):
+        if not self._sampled():
+            return await self.get_response(request)
+        timings, token = perf.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            perf.stop(token)
+        self._report(request, response, timings)
+        return response
+
+    def _sampled(self):
+        rate = getattr(settings, "PERFORMANCE_SAMPLE_RATE", 0.0)
+        return rate >= 1 or (rate > 0 and random.random() < rate)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timings = perf.set_route(request)
+        if timings is not None:
+            timings.view_started = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after this hook, so the view is done
+        timings = perf.current()
+        if timings is not None and timings.view_started is not None:
+            now = time.perf_counter()
+            timings.add("view", (now - timings.view_started) * 1000)
+
+            def rendered(response):
+                timings.add("render", (time.perf_counter() - now) * 1000)
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def _report(self, request, response, timings):
+        total_ms = timings.elapsed_ms()
+        sections = timings.sections
+        if "view" not in sections and timings.view_started is not None:
+            # plain HttpResponse: the view ran until the response came back
+            sections["view"] = (time.perf_counter() - timings.view_started) * 1000
+
+        if getattr(settings, "PERFORMANCE_SERVER_TIMING", False):
+            entries = [f'db;dur={timings.db_ms:.1f};desc="{timings.db_queries} queries"']
+            entries += [
+                f"{name};dur={sections[name]:.1f}"
+                for name in ("view", "serialize", "render")
+                if name in sections
+            ]
+            entries.append(f"total;dur={total_ms:.1f}")
+            response["Server-Timing"] = ", ".join(entries)
+
+        record = {
+            "route": timings.route,
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "total_ms": round(total_ms, 2),
+            "db_queries": timings.db_queries,
+            "db_ms": round(timings.db_ms, 2),
+            **{f"{name}_ms": round(ms, 2) for name, ms in sections.items()},
+            "bytes": None if response.streaming else len(response.content),
+        }
+        performance_logger.info(
+            json.dumps(record, separators=(",", ":")), extra={"performance": record}
+        )
+
+
+class MetricsMiddleware:
+    """
+    Feeds every request into ``core.metrics``: requests by URL name and
+    status, latency, query count and DB time histograms, and requests in
+    flight. Keep it first so the latency covers the other middleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        timings, token = perf.start()
+        metrics.REQUESTS_IN_FLIGHT.inc()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.REQUESTS_IN_FLIGHT.dec()
+            perf.stop(token)
+        self._record(request, response, timings)
+        return response
+
+    async def __acall__(self, request):
+        timings, token = perf.start()
+        metrics.REQUESTS_IN_FLIGHT.inc()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.REQUESTS_IN_FLIGHT.dec()
+            perf.stop(token)
+        self._record(request, response, timings)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        perf.set_route(request)
+
+    def _record(self, request, response, timings):
+        metrics.observe_request(
+            route=timings.route or "unmatched",
+            method=request.method,
+            status=response.status_code,
+            seconds=timings.elapsed_ms() / 1000,
+            queries=timings.db_queries,
+            db_seconds=timings.db_ms / 1000,
+        )
+        metrics.registry.maybe_collect()
+
+
+class ProfilingMiddleware:
+    """
+    Runs selected requests under ``cProfile`` and ``tracemalloc`` and saves
+    the results with ``core.profiling``; the response names the profile in
+    ``X-Profile-Id``.
+
+    A request is profiled when it carries ``PROFILING["HEADER"]`` set to
+    the shared ``PROFILING["TOKEN"]``, or falls in the ``SAMPLE_RATE``
+    share. Unless ``PROFILING["ENABLED"]`` is on, Django drops the
+    middleware from the chain at startup. Under ASGI only the event loop
+    thread is profiled, not the threads running sync code.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not profiling.config()["ENABLED"]:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        trigger = self._trigger(request)
+        if trigger is None:
+            return self.get_response(request)
+        with profiling.profiled() as profile:
+            response = self.get_response(request)
+        if profile is not None:
+            self._save(request, response, profile, trigger)
+        return response
+
+    async def __acall__(self, request):
+        trigger = self._trigger(request)
+        if trigger is None:
+            return await self.get_response(request)
+        with profiling.profiled() as profile:
+            response = await self.get_response(request)
+        if profile is not None:
+            await sync_to_async(self._save)(request, response, profile, trigger)
+        return response
+
+    def _trigger(self, request):
+        options = profiling.config()
+        header = request.headers.get(options["HEADER"])
+        if header and options["TOKEN"] and hmac.compare_digest(header, options["TOKEN"]):
+            return "header"
+        rate = options["SAMPLE_RATE"]
+        if rate > 0 and random.random() < rate:
+            return "sample"
+        return None
+
+    def _save(self, request, response, profile, trigger):
+        timings = perf.current()
+        profiling.save(
+            profile,
+            {
+                "trigger": trigger,
+                "method": request.method,
+                "path": request.get_full_path(),
+                "route": timings.route if timings is not None else None,
+                "status": response.status_code,
+            },
+        )
+        response["X-Profile-Id"] = profile.id
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-19 01:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_task'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLogEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('post', 'Post'), ('like', 'Like'), ('follow', 'Follow')], max_length=10)),
+                ('op', models.CharField(choices=[('upsert', 'Created or updated'), ('delete', 'Deleted')], max_length=10)),
+                ('object_id', models.BigIntegerField()),
+                ('actor_id', models.BigIntegerField()),
+                ('target_id', models.BigIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['actor_id', 'id'], name='core_change_actor_i_65cd1c_idx'), models.Index(fields=['target_id', 'id'], name='core_change_target__e85a4a_idx'), models.Index(fields=['created_at'], name='core_change_created_c32e93_idx')],
+            },
+        ),
+    ]
@@ -1,3 +1,151 @@
 from django.db import models
+from django.utils import timezone
 
-# Create your models here.
+
+class PurgeJobManager(models.Manager):
+    def enqueue(self, kind, object_id, database=""):
+        """The unfinished job for the object, created if there is none"""
+        job = (
+            self.filter(kind=kind, object_id=object_id)
+            .exclude(status=PurgeJob.DONE)
+            .first()
+        )
+        if job is None:
+            job = self.create(kind=kind, object_id=object_id, database=database)
+        return job
+
+
+class PurgeJob(models.Model):
+    """
+    Background removal of a soft-deleted account or post and everything
+    hanging off it, run by ``manage.py purge_deleted`` (see core.purge).
+    """
+
+    USER = "user"
+    POST = "post"
+    KIND_CHOICES = [(USER, "User"), (POST, "Post")]
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    # shard holding a post; blank for accounts
+    database = models.CharField(max_length=50, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    # first stage not known to be finished; a resumed job starts here
+    stage = models.CharField(max_length=30, blank=True)
+    # stage -> rows deleted so far
+    progress = models.JSONField(default=dict)
+    deleted_rows = models.PositiveBigIntegerField(default=0)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    objects = PurgeJobManager()
+
+    class Meta:
+        ordering = ["created_at"]
+        indexes = [
+            # the worker's claim query: oldest pending or stale running job
+            models.Index(fields=["status", "updated_at"]),
+            models.Index(fields=["kind", "object_id"]),
+        ]
+
+    def __str__(self):
+        return f"purge {self.kind} {self.object_id} ({self.status})"
+
+
+class Task(models.Model):
+    """
+    Outbox row for a deferred side effect, written in the same transaction
+    as the change that triggers it and run by ``manage.py run_tasks``
+    (see core.tasks). Every database that takes writes has its own outbox.
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    # a key is enqueued at most once for as long as its row is kept
+    key = models.CharField(max_length=200, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=40, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["key"], name="unique_task_key"),
+        ]
+        indexes = [
+            # due tasks, and expired claims of crashed workers
+            models.Index(fields=["status", "run_after"]),
+            models.Index(fields=["status", "locked_until"]),
+            # pruning finished tasks
+            models.Index(fields=["status", "finished_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
+
+
+class ChangeLogEntry(models.Model):
+    """
+    Append-only record of a post, like or follow write, read by the delta
+    sync endpoint (see core.changes). Each database logs the writes it
+    takes, in the same transaction; ``id`` is the sequence number.
+    """
+
+    POST = "post"
+    LIKE = "like"
+    FOLLOW = "follow"
+    KIND_CHOICES = [(POST, "Post"), (LIKE, "Like"), (FOLLOW, "Follow")]
+
+    UPSERT = "upsert"
+    DELETE = "delete"
+    OP_CHOICES = [(UPSERT, "Created or updated"), (DELETE, "Deleted")]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    op = models.CharField(max_length=10, choices=OP_CHOICES)
+    object_id = models.BigIntegerField()
+    # post author, liker or follower
+    actor_id = models.BigIntegerField()
+    # liked post's author or followed user
+    target_id = models.BigIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["actor_id", "id"]),
+            models.Index(fields=["target_id", "id"]),
+            # compaction
+            models.Index(fields=["created_at"]),
+        ]
+
+    def __str__(self):
+        return f"#{self.pk} {self.op} {self.kind} {self.object_id}"
@@ -0,0 +1,166 @@
+"""
+Id-keyed cache of serialized posts and users behind the batch endpoints.
+
+Clients holding ids from notifications and deep links fetch up to
+``MAX_IDS`` objects in one request. Cached entries only hold what looks
+the same to every viewer: a post without its author or ``is_liked``, a user
+as ``UserListSerializer`` renders it. A batch is answered from the cache;
+the misses are read with one query per kind (per shard for posts), and
+``is_liked`` with one more, however many ids are asked for.
+
+Writes drop the entries they change once they commit: post edits and
+deletions, likes (the count), profile and account saves and counter
+updates. Without a shared ``BACKEND`` another process can serve an
+entry for up to ``TTL`` seconds after a write.
+"""
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from . import sharding
+from .cache import TTLLRUCache
+
+DEFAULTS = {
+    "MAX_IDS": 100,
+    "MAX_ENTRIES": 10000,
+    "TTL": 30,
+    "BACKEND": None,
+    "LOCAL_TTL": None,
+}
+
+POST = "post"
+USER = "user"
+
+
+def config():
+    return {**DEFAULTS, **getattr(settings, "OBJECT_CACHE", {})}
+
+
+_options = config()
+object_cache = TTLLRUCache(
+    "objects",
+    maxsize=_options["MAX_ENTRIES"],
+    ttl=_options["TTL"],
+    backend=_options["BACKEND"],
+    local_ttl=_options["LOCAL_TTL"],
+)
+
+
+def _key(kind, object_id):
+    return f"{kind}:{object_id}"
+
+
+def parse_ids(value):
+    """
+    The ids in a comma separated ``?ids=`` value, in order; raises
+    ValueError for a non-numeric id or more than ``MAX_IDS``
+    """
+    try:
+        ids = [int(part) for part in value.split(",") if part.strip()]
+    except ValueError:
+        raise ValueError("ids must be comma separated numbers")
+    limit = config()["MAX_IDS"]
+    if len(ids) > limit:
+        raise ValueError(f"At most {limit} ids per request")
+    return ids
+
+
+def get_many(kind, ids, load):
+    """
+    ``{id: data}`` for the ``ids`` that exist; misses are read with
+    ``load(ids)``, which returns the same mapping, and cached
+    """
+    ids = list(dict.fromkeys(ids))
+    cached = object_cache.get_many([_key(kind, object_id) for object_id in ids])
+    found = {}
+    missing = []
+    for object_id in ids:
+        key = _key(kind, object_id)
+        if key not in cached:
+            missing.append(object_id)
+        elif cached[key] is not None:
+            found[object_id] = cached[key]
+    if missing:
+        loaded = load(missing)
+        # ids that don't exist are cached too, as None; creating the
+        # object drops that entry like any other write
+        object_cache.set_many(
+            {_key(kind, object_id): loaded.get(object_id) for object_id in missing}
+        )
+        found.update(loaded)
+    return found
+
+
+def invalidate(kind, ids):
+    object_cache.delete_many([_key(kind, object_id) for object_id in ids])
+
+
+def invalidate_on_commit(kind, ids, using=DEFAULT_DB_ALIAS):
+    """Drop the entries once the current transaction on ``using`` commits"""
+    ids = list(ids)
+    transaction.on_commit(lambda: invalidate(kind, ids), using=using)
+
+
+def _load_users(ids):
+    from django.contrib.auth import get_user_model
+
+    from users.serializers import UserListSerializer
+
+    users = (
+        get_user_model()
+        .objects.select_related("profile")
+        .filter(pk__in=ids, deleted_at__isnull=True)
+    )
+    return {row["id"]: row for row in UserListSerializer(users, many=True).data}
+
+
+def _load_posts(ids):
+    from posts.models import Post
+    from posts.serializers import PostCacheSerializer
+
+    found = {}
+    for posts in sharding.on_shards(Post.objects.with_like_counts().filter(pk__in=ids)):
+        found.update((row["id"], row) for row in PostCacheSerializer(posts, many=True).data)
+    return found
+
+
+def users(ids):
+    """``UserListSerializer`` data of the live users among ``ids``"""
+    return get_many(USER, ids, _load_users)
+
+
+def posts(ids, viewer):
+    """``PostListSerializer`` data of the live posts among ``ids``, for ``viewer``"""
+    from social.models import Like
+
+    found = get_many(POST, ids, _load_posts)
+    authors = users({post["user_id"] for post in found.values()})
+    liked = set()
+    if found and viewer.is_authenticated:
+        likes = Like.objects.filter(user=viewer, post_id__in=list(found))
+        for shard_likes in sharding.on_shards(likes):
+            liked.update(shard_likes.values_list("post_id", flat=True))
+
+    hydrated = {}
+    for post_id, post in found.items():
+        author = authors.get(post["user_id"])
+        if author is None:
+            continue
+        # the same fields, in the same order, as PostListSerializer
+        hydrated[post_id] = {
+            "id": post_id,
+            "user": author,
+            "caption": post["caption"],
+            "image_url": post["image_url"],
+            "total_likes": post["total_likes"],
+            "is_liked": post_id in liked,
+            "created_at": post["created_at"],
+        }
+    return hydrated
+
+
+def in_order(ids, found):
+    """``{"results": [...], "missing": [...]}``, ``None`` in place of a missing id"""
+    return {
+        "results": [found.get(object_id) for object_id in ids],
+        "missing": list(dict.fromkeys(i for i in ids if i not in found)),
+    }
@@ -0,0 +1,128 @@
+"""
+Keyset (cursor) pagination for long per-user lists.
+
+Page N of a ``PageNumberPagination`` list costs an OFFSET over every
+earlier row plus a COUNT over all of them; a keyset page is one indexed
+range read of ``page_size + 1`` rows however deep the client scrolls.
+Unlike DRF's ``CursorPagination`` it also pages a ``ScatterGatherList``,
+reading the page from every shard and merging, and breaks ``created_at``
+ties on the primary key instead of an offset.
+"""
+import base64
+import binascii
+import heapq
+import json
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+def keyset_after(keys, row):
+    """
+    Rows strictly after ``row`` in ``keys`` order, as a Q. A ``-`` prefix
+    marks a descending key.
+    """
+    condition = Q()
+    for i in reversed(range(len(keys))):
+        equal = {key.lstrip("-"): row[key.lstrip("-")] for key in keys[:i]}
+        field = keys[i].lstrip("-")
+        lookup = "lt" if keys[i].startswith("-") else "gt"
+        condition = Q(**equal, **{f"{field}__{lookup}": row[field]}) | condition
+    return condition
+
+
+def _value(obj, field):
+    return obj[field] if isinstance(obj, dict) else getattr(obj, field)
+
+
+class KeysetPagination(BasePagination):
+    """Newest first on ``ordering``; each response links the next page"""
+
+    ordering = ("-created_at", "-id")
+    # ordering keys sent as ISO strings in the cursor
+    datetime_fields = ("created_at",)
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.GET[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.GET.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            position = dict(zip((key.lstrip("-") for key in self.ordering), values))
+            for field in self.datetime_fields:
+                position[field] = datetime.fromisoformat(position[field])
+        except (binascii.Error, ValueError, TypeError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def encode_cursor(self, obj):
+        values = [_value(obj, key.lstrip("-")) for key in self.ordering]
+        payload = json.dumps(values, default=datetime.isoformat, separators=(",", ":"))
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def sort_key(self, obj):
+        return tuple(_value(obj, key.lstrip("-")) for key in self.ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        One page of ``queryset``: a QuerySet, or a ``ScatterGatherList``
+        whose shards are each read up to the page and merged.
+        """
+        self.request = request
+        page_size = self.get_page_size(request)
+        position = self.decode_cursor(request)
+
+        pages = []
+        for part in getattr(queryset, "querysets", [queryset]):
+            part = part.order_by(*self.ordering)
+            if position is not None:
+                part = part.filter(keyset_after(self.ordering, position))
+            pages.append(list(part[: page_size + 1]))
+
+        rows = pages[0] if len(pages) == 1 else list(
+            heapq.merge(*pages, key=self.sort_key, reverse=True)
+        )
+        self.next_cursor = (
+            self.encode_cursor(rows[page_size - 1]) if len(rows) > page_size else None
+        )
+        return rows[:page_size]
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_data(self, data):
+        return {"next": self.get_next_link(), "results": data}
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
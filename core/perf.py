@@ -0,0 +1,104 @@
+"""
+Per-request performance timings.
+
+``PerformanceMiddleware`` starts a ``RequestTimings`` for each sampled
+request and keeps it in a ContextVar, which ``sync_to_async`` copies into
+worker threads, so the query counter in ``core.db`` and the timed sections
+below add to the right request in sync and async views alike. Outside a
+sampled request every hook is a single ContextVar lookup.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+_current = ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.route = None
+        self.view_started = None
+        self.db_queries = 0
+        self.db_ms = 0.0
+        # section name -> ms; nested sections of the same name count once
+        self.sections = {}
+        self._open = set()
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def add(self, name, ms):
+        self.sections[name] = self.sections.get(name, 0.0) + ms
+
+
+def start():
+    """Start timing a request; nested middleware share the outer timings"""
+    timings = _current.get()
+    if timings is not None:
+        return timings, None
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+
+def stop(token):
+    if token is not None:
+        _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+def set_route(request):
+    """Tag the current request with its URL name, e.g. ``posts:feed``"""
+    timings = _current.get()
+    if timings is not None and request.resolver_match is not None:
+        timings.route = request.resolver_match.view_name.removeprefix("core:")
+    return timings
+
+
+def record_query(ms):
+    timings = _current.get()
+    if timings is not None:
+        timings.db_queries += 1
+        timings.db_ms += ms
+
+
+@contextmanager
+def section(name):
+    """Add the time spent in the block to the current request's ``name``"""
+    timings = _current.get()
+    if timings is None or name in timings._open:
+        yield
+        return
+    timings._open.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings._open.discard(name)
+        timings.add(name, (time.perf_counter() - started) * 1000)
+
+
+def instrument_serializers():
+    """
+    Time ``serializer.data`` as the ``serialize`` section.
+
+    Every DRF serializer, ``many=True`` included, produces its output through
+    ``BaseSerializer.data``, so wrapping it there covers all views at once.
+    """
+    from rest_framework.serializers import BaseSerializer
+
+    original = BaseSerializer.data.fget
+    if getattr(original, "_timed", False):
+        return
+
+    @wraps(original)
+    def data(self):
+        with section("serialize"):
+            return original(self)
+
+    data._timed = True
+    BaseSerializer.data = property(data)
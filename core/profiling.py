@@ -0,0 +1,175 @@
+"""
+On-demand request profiling.
+
+``ProfilingMiddleware`` runs selected requests under ``cProfile`` and
+``tracemalloc`` and saves the results here: ``<id>.prof`` holds the raw
+pstats data (open it with ``python -m pstats`` or snakeviz) and
+``<id>.json`` a summary with the slowest functions and the top allocation
+sites. Both profilers are process-wide, so only one request is profiled
+at a time; requests arriving meanwhile run normally.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+DEFAULTS = {
+    "ENABLED": False,
+    "HEADER": "X-Profile",
+    "TOKEN": "",
+    "SAMPLE_RATE": 0.0,
+    "DIR": None,
+    "KEEP": 200,
+    "TOP_FUNCTIONS": 30,
+    "TOP_ALLOCATIONS": 25,
+}
+
+PROFILE_ID = re.compile(r"^[0-9]{20}-[0-9a-f]{8}$")
+
+_busy = threading.Lock()
+
+# allocations made by the profilers themselves are noise
+_IGNORED_ALLOCATIONS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, cProfile.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+)
+
+
+def config():
+    return {**DEFAULTS, **getattr(settings, "PROFILING", {})}
+
+
+def profile_dir():
+    # var/ is ignored by git, so profiles never end up in a commit
+    return str(config()["DIR"] or os.path.join(settings.BASE_DIR, "var", "profiles"))
+
+
+def new_profile_id():
+    return f"{datetime.now(timezone.utc):%Y%m%d%H%M%S%f}-{uuid.uuid4().hex[:8]}"
+
+
+class Profile:
+    def __init__(self):
+        self.id = new_profile_id()
+        self.profiler = cProfile.Profile()
+        self.snapshot = None
+        self.peak_bytes = 0
+        self.duration_ms = 0.0
+
+
+@contextmanager
+def profiled():
+    """
+    Profile the block. Yields a ``Profile``, or None when another request
+    is already being profiled.
+    """
+    if not _busy.acquire(blocking=False):
+        yield None
+        return
+    profile = Profile()
+    # leave tracemalloc alone if someone else started it
+    owns_tracemalloc = not tracemalloc.is_tracing()
+    try:
+        if owns_tracemalloc:
+            tracemalloc.start(10)
+        tracemalloc.reset_peak()
+        started = time.perf_counter()
+        profile.profiler.enable()
+        try:
+            yield profile
+        finally:
+            profile.profiler.disable()
+            profile.duration_ms = (time.perf_counter() - started) * 1000
+            profile.snapshot = tracemalloc.take_snapshot()
+            profile.peak_bytes = tracemalloc.get_traced_memory()[1]
+            if owns_tracemalloc:
+                tracemalloc.stop()
+    finally:
+        _busy.release()
+
+
+def top_functions(profiler, limit):
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats("cumulative").print_stats(limit)
+    return [line for line in stream.getvalue().splitlines() if line.strip()]
+
+
+def top_allocations(snapshot, limit):
+    stats = snapshot.filter_traces(_IGNORED_ALLOCATIONS).statistics("lineno")
+    return [
+        {
+            "site": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+            "size_kb": round(stat.size / 1024, 1),
+            "count": stat.count,
+        }
+        for stat in stats[:limit]
+    ]
+
+
+def save(profile, metadata):
+    """Write the pstats file and JSON summary, then drop the oldest profiles"""
+    options = config()
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    profile.profiler.dump_stats(os.path.join(directory, f"{profile.id}.prof"))
+
+    summary = {
+        "id": profile.id,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "duration_ms": round(profile.duration_ms, 2),
+        "peak_memory_kb": round(profile.peak_bytes / 1024, 1),
+        **metadata,
+        "top_functions": top_functions(profile.profiler, options["TOP_FUNCTIONS"]),
+        "top_allocations": top_allocations(profile.snapshot, options["TOP_ALLOCATIONS"]),
+    }
+    with open(os.path.join(directory, f"{profile.id}.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    prune(options["KEEP"])
+    return summary
+
+
+def profile_ids():
+    """Saved profile ids, newest first"""
+    try:
+        names = os.listdir(profile_dir())
+    except FileNotFoundError:
+        return []
+    ids = {name.rsplit(".", 1)[0] for name in names if name.endswith(".json")}
+    return sorted((i for i in ids if PROFILE_ID.match(i)), reverse=True)
+
+
+def prune(keep):
+    for profile_id in profile_ids()[keep:]:
+        for extension in ("json", "prof"):
+            try:
+                os.remove(os.path.join(profile_dir(), f"{profile_id}.{extension}"))
+            except FileNotFoundError:
+                pass
+
+
+def profile_path(profile_id, extension):
+    """Path of a saved profile file, or None for unknown or malformed ids"""
+    if not PROFILE_ID.match(profile_id):
+        return None
+    path = os.path.join(profile_dir(), f"{profile_id}.{extension}")
+    return path if os.path.exists(path) else None
+
+
+def load_summary(profile_id):
+    path = profile_path(profile_id, "json")
+    if path is None:
+        return None
+    with open(path) as f:
+        return json.load(f)
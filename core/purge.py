@@ -0,0 +1,307 @@
+"""
+Soft deletion with batched background purges.
+
+Deleting an account or a popular post cascades through every like, follow
+and post hanging off it, and doing that in one transaction holds SQLite's
+write lock for as long as it takes. Instead ``soft_delete_user`` and
+``soft_delete_post`` only stamp ``deleted_at`` (the default post manager
+hides those posts) and enqueue a ``PurgeJob``. ``manage.py purge_deleted``
+then removes the dependent rows stage by stage, a small transaction per
+batch with a pause in between so request writes get the lock. A stage can
+name a hook that runs in each batch's transaction before the rows go, for
+the bookkeeping a plain delete skips: counters kept by tasks, unread
+badges and the change log's tombstones. Progress is saved after every batch; a job whose
+worker died is picked up again once its lease runs out and resumes at the
+stage it was in.
+"""
+import logging
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from . import changes, conditional, objects, sharding, tasks
+from .db import retry_on_lock
+from .models import ChangeLogEntry, PurgeJob
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "BATCH_SIZE": 500,
+    "PAUSE_SECONDS": 0.05,
+    "LEASE_SECONDS": 300,
+    "MAX_ATTEMPTS": 5,
+}
+
+
+def config():
+    return {**DEFAULTS, **getattr(settings, "PURGE", {})}
+
+
+def soft_delete_user(user):
+    """Deactivate the account, hide its posts and schedule the purge"""
+    from posts.models import Post
+
+    now = timezone.now()
+    with transaction.atomic():
+        user.deleted_at = now
+        user.is_active = False
+        # saving first drops the cached credentials of every token
+        user.save(update_fields=["deleted_at", "is_active"])
+        Token.objects.filter(user=user).delete()
+        job = PurgeJob.objects.enqueue(PurgeJob.USER, user.pk)
+    posts = Post.objects.for_author(user.pk).filter(user_id=user.pk)
+    with transaction.atomic(using=posts.db):
+        ids = list(posts.values_list("pk", flat=True))
+        posts.update(deleted_at=now)
+        # tombstones for followers' synced timelines
+        ChangeLogEntry.objects.using(posts.db).bulk_create(
+            ChangeLogEntry(
+                kind=ChangeLogEntry.POST,
+                op=ChangeLogEntry.DELETE,
+                object_id=post_id,
+                actor_id=user.pk,
+            )
+            for post_id in ids
+        )
+        conditional.bump_on_commit([conditional.author_key(user.pk)], using=posts.db)
+        objects.invalidate_on_commit(objects.POST, ids, using=posts.db)
+    return job
+
+
+def soft_delete_post(post):
+    from posts.models import Post
+
+    alias = sharding.shard_for_user(post.user_id)
+    with transaction.atomic(using=alias):
+        Post.objects.for_author(post.user_id).filter(pk=post.pk).update(
+            deleted_at=timezone.now()
+        )
+        tasks.enqueue("users.recount_posts", {"user_id": post.user_id}, using=alias)
+        changes.record(
+            ChangeLogEntry.POST, ChangeLogEntry.DELETE, post.pk, post.user_id, using=alias
+        )
+    return PurgeJob.objects.enqueue(PurgeJob.POST, post.pk, database=alias)
+
+
+def _post_databases():
+    return sharding.shard_aliases() or [DEFAULT_DB_ALIAS]
+
+
+def _unfollowed(follows):
+    """Queue the counter updates and log the tombstones ``unfollow_user`` would have"""
+    rows = list(follows.values_list("pk", "follower_id", "following_id"))
+    for follow_id, follower_id, following_id in rows:
+        tasks.enqueue(
+            "users.adjust_follow_counts",
+            {"follower_id": follower_id, "following_id": following_id, "delta": -1},
+            key=f"follow:{follow_id}:deleted",
+            using=follows.db,
+        )
+    changes.record_many(ChangeLogEntry.FOLLOW, ChangeLogEntry.DELETE, rows, using=follows.db)
+
+
+def _unliked(likes):
+    """Log tombstones for delta sync and drop the cached like counts"""
+    rows = list(likes.values_list("pk", "user_id", "post__user_id", "post_id"))
+    changes.record_many(
+        ChangeLogEntry.LIKE,
+        ChangeLogEntry.DELETE,
+        [(like_id, user_id, author_id) for like_id, user_id, author_id, _ in rows],
+        using=likes.db,
+    )
+    objects.invalidate_on_commit(
+        objects.POST, {post_id for *_, post_id in rows}, using=likes.db
+    )
+
+
+def stages_for(job):
+    """
+    ``(stage name, querysets to empty, hook)`` in the order they are
+    purged; ``hook(rows)``, if any, is called with every batch before it
+    is deleted
+    """
+    from posts.models import Post
+    from social.models import Follow, Like, Notification
+    from social.notifications import discard
+
+    if job.kind == PurgeJob.POST:
+        alias = job.database or DEFAULT_DB_ALIAS
+        return [
+            ("likes", [Like.objects.using(alias).filter(post_id=job.object_id)], _unliked),
+            (
+                "notifications",
+                [Notification.objects.using(DEFAULT_DB_ALIAS).filter(post_id=job.object_id)],
+                discard,
+            ),
+            ("post", [Post.all_objects.using(alias).filter(pk=job.object_id)], None),
+        ]
+
+    user_id = job.object_id
+    shard = sharding.shard_for_user(user_id)
+    return [
+        (
+            "likes_given",
+            [Like.objects.using(alias).filter(user_id=user_id) for alias in _post_databases()],
+            _unliked,
+        ),
+        (
+            "likes_received",
+            [Like.objects.using(shard).filter(post__user_id=user_id)],
+            _unliked,
+        ),
+        ("posts", [Post.all_objects.using(shard).filter(user_id=user_id)], None),
+        (
+            "following",
+            [Follow.objects.using(DEFAULT_DB_ALIAS).filter(follower_id=user_id)],
+            _unfollowed,
+        ),
+        (
+            "followers",
+            [Follow.objects.using(DEFAULT_DB_ALIAS).filter(following_id=user_id)],
+            _unfollowed,
+        ),
+        (
+            "notifications",
+            [Notification.objects.using(DEFAULT_DB_ALIAS).filter(recipient_id=user_id)],
+            discard,
+        ),
+        # profile and token cascade with the account itself
+        (
+            "account",
+            [get_user_model().objects.using(DEFAULT_DB_ALIAS).filter(pk=user_id)],
+            None,
+        ),
+    ]
+
+
+def is_soft_deleted(job):
+    """A job only ever purges rows that were soft-deleted (or are gone)"""
+    from posts.models import Post
+
+    if job.kind == PurgeJob.POST:
+        target = Post.all_objects.using(job.database or DEFAULT_DB_ALIAS)
+    else:
+        target = get_user_model().objects.using(DEFAULT_DB_ALIAS)
+    row = target.filter(pk=job.object_id).values("deleted_at").first()
+    return row is None or row["deleted_at"] is not None
+
+
+@retry_on_lock
+def delete_batch(queryset, batch_size, hook=None):
+    """
+    Delete up to ``batch_size`` rows of ``queryset`` in one transaction,
+    calling ``hook(rows)`` in it first. Returns (rows selected, rows
+    deleted including cascades).
+    """
+    ids = list(queryset.order_by().values_list("pk", flat=True)[:batch_size])
+    if not ids:
+        return 0, 0
+    model = queryset.model
+    with transaction.atomic(using=queryset.db):
+        rows = model._base_manager.using(queryset.db).filter(pk__in=ids)
+        if hook is not None:
+            hook(rows)
+        deleted, _ = rows.delete()
+    return len(ids), deleted
+
+
+def claim_next(exclude=()):
+    """Mark the oldest pending (or abandoned) job as ours and return it"""
+    now = timezone.now()
+    stale = now - timedelta(seconds=config()["LEASE_SECONDS"])
+    candidates = (
+        PurgeJob.objects.filter(
+            Q(status=PurgeJob.PENDING) | Q(status=PurgeJob.RUNNING, updated_at__lt=stale)
+        )
+        .exclude(pk__in=exclude)
+        .order_by("created_at")[:10]
+    )
+    for job in candidates:
+        claimed = PurgeJob.objects.filter(
+            pk=job.pk, status=job.status, updated_at=job.updated_at
+        ).update(status=PurgeJob.RUNNING, attempts=F("attempts") + 1, updated_at=now)
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def run_job(job, deadline=None, batch_size=None, pause=None):
+    """
+    Purge ``job`` from its current stage on. Returns True when finished,
+    False when ``deadline`` (a ``time.monotonic()`` value) stopped it first.
+    """
+    options = config()
+    batch_size = batch_size or options["BATCH_SIZE"]
+    pause = options["PAUSE_SECONDS"] if pause is None else pause
+
+    if not is_soft_deleted(job):
+        _fail(job, "Target is not soft-deleted", retry=False)
+        return True
+
+    stages = stages_for(job)
+    names = [name for name, _, _ in stages]
+    start = names.index(job.stage) if job.stage in names else 0
+    for name, querysets, hook in stages[start:]:
+        if job.stage != name:
+            job.stage = name
+            job.save(update_fields=["stage", "updated_at"])
+        for queryset in querysets:
+            while True:
+                selected, deleted = delete_batch(queryset, batch_size, hook)
+                if not selected:
+                    break
+                job.progress[name] = job.progress.get(name, 0) + deleted
+                job.deleted_rows += deleted
+                # also renews the lease
+                job.save(update_fields=["progress", "deleted_rows", "updated_at"])
+                if deadline is not None and time.monotonic() >= deadline:
+                    return False
+                if selected == batch_size and pause:
+                    time.sleep(pause)
+
+    job.status = PurgeJob.DONE
+    job.stage = ""
+    job.finished_at = timezone.now()
+    job.save(update_fields=["status", "stage", "finished_at", "updated_at"])
+    return True
+
+
+def _fail(job, error, retry=True):
+    retry = retry and job.attempts < config()["MAX_ATTEMPTS"]
+    job.status = PurgeJob.PENDING if retry else PurgeJob.FAILED
+    job.last_error = error
+    job.save(update_fields=["status", "last_error", "updated_at"])
+
+
+def run_pending(deadline=None, batch_size=None, pause=None, max_jobs=None):
+    """Run claimable jobs until none are left, ``deadline`` or ``max_jobs``"""
+    finished = 0
+    # failed jobs are retried by a later run, not straight away
+    failed = []
+    while max_jobs is None or finished < max_jobs:
+        if deadline is not None and time.monotonic() >= deadline:
+            break
+        job = claim_next(exclude=failed)
+        if job is None:
+            break
+        try:
+            done = run_job(job, deadline, batch_size, pause)
+        except Exception:
+            logger.exception("Purge of %s %s failed", job.kind, job.object_id)
+            _fail(job, traceback.format_exc(limit=5))
+            failed.append(job.pk)
+            continue
+        if not done:
+            # release the claim so the next run resumes it right away
+            PurgeJob.objects.filter(pk=job.pk).update(status=PurgeJob.PENDING)
+            break
+        finished += 1
+    return finished
@@ -0,0 +1,80 @@
+"""
+Query budgets for every API endpoint, enforced by core/test_query_budgets.py.
+
+Each URL name maps to the most queries one request may issue with a page
+size of 1 and of 100, plus a ceiling on the total SQL time that
+``manage.py loadtest --enforce-budgets`` holds the p95 to (wall-clock
+time is too noisy to assert in the test suite). A list that
+costs more at 100 than at 1 has an N+1; keep the two numbers equal unless
+an endpoint genuinely does per-page work. Requests are made already
+authenticated, so token lookups are not counted.
+"""
+from typing import NamedTuple
+
+DEFAULT_MAX_MS = 250.0
+
+
+class Budget(NamedTuple):
+    page_1: int
+    page_100: int
+    max_ms: float = DEFAULT_MAX_MS
+
+
+QUERY_BUDGETS = {
+    # users/urls.py
+    "users:register": Budget(12, 12),
+    "users:login": Budget(6, 6),
+    "users:logout": Budget(2, 2),
+    "users:user-list": Budget(2, 2),
+    # conditional GET: the timestamps behind the validators, then the user
+    "users:current-user": Budget(2, 2),
+    "users:export-data": Budget(4, 4),
+    # follows, the log, then one read per kind of changed object
+    "users:sync-changes": Budget(5, 5),
+    "users:user-detail": Budget(2, 2),
+    # users missing from the object cache, in one query
+    "users:user-batch": Budget(1, 1),
+    # posts/urls.py
+    "posts:post-list-create": Budget(2, 2),
+    # conditional GET: detail views read updated_at, the feeds the followed
+    # authors whose versions make up the ETag, before the page itself
+    "posts:post-detail": Budget(2, 2),
+    "posts:feed": Budget(4, 4),
+    "posts:timeline": Budget(6, 6),
+    "posts:discover": Budget(2, 2),
+    "posts:popular-posts": Budget(2, 2),
+    "posts:my-posts": Budget(1, 1),
+    "posts:user-posts": Budget(2, 2),
+    "posts:post-stats": Budget(4, 4),
+    "posts:feed-stats": Budget(7, 7),
+    "posts:feed-new": Budget(2, 2),
+    # cache misses: the posts, then their authors; is_liked for the viewer
+    "posts:post-batch": Budget(3, 3),
+    "posts:timeline-new": Budget(2, 2),
+    # social/urls.py
+    # both write a counter task (savepoint, insert, release) and a change log
+    # entry with the follow, following also a notification task
+    "social:follow-user": Budget(21, 21),
+    "social:unfollow-user": Budget(10, 10),
+    "social:user-followers": Budget(3, 3),
+    "social:user-following": Budget(3, 3),
+    "social:my-followers": Budget(2, 2),
+    "social:my-following": Budget(2, 2),
+    # the notification task (savepoint, insert, release) and a change log
+    # entry are written with the like
+    "social:like-post": Budget(17, 17),
+    "social:unlike-post": Budget(7, 7),
+    "social:post-likes": Budget(2, 2),
+    "social:user-likes": Budget(3, 3),
+    "social:my-likes": Budget(2, 2),
+    "social:follow-stats": Budget(2, 2),
+    "social:user-follow-stats": Budget(7, 7),
+    "social:like-stats": Budget(4, 4),
+    "social:user-like-stats": Budget(5, 5),
+    "social:suggested-users": Budget(2, 2),
+    "social:mutual-follows": Budget(4, 4),
+    "social:trending-posts": Budget(1, 1),
+    "social:notifications": Budget(1, 1),
+    "social:unread-notifications": Budget(1, 1),
+    "social:mark-notifications-read": Budget(4, 4),
+}
@@ -0,0 +1,143 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PRIMARY = DEFAULT_DB_ALIAS
+
+# models whose reads never go to a replica: a token issued by login must
+# authenticate the very next request
+PRIMARY_ONLY_MODELS = {"authtoken.token"}
+
+_current_pin = ContextVar("replica_pin", default=None)
+
+
+def pin_cache_key(user_id):
+    return f"replica-pin:{user_id}"
+
+
+def mark_recent_write(user_id):
+    """Keep this user's reads on the primary for ``REPLICA_PIN_SECONDS``"""
+    cache.set(pin_cache_key(user_id), True, getattr(settings, "REPLICA_PIN_SECONDS", 5))
+
+
+class RequestPin:
+    """
+    Decides whether the current request must read from the primary.
+
+    The user isn't known until DRF authenticates inside the view, so the
+    "recently wrote" lookup happens on the first routed read after that
+    and is remembered for the rest of the request.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.writes = request.method not in ("GET", "HEAD", "OPTIONS")
+        self._recent_writer = None
+        self._replica = None
+
+    def replica(self, replicas):
+        """One replica per request, so all its reads see the same snapshot"""
+        if self._replica is None:
+            self._replica = random.choice(replicas)
+        return self._replica
+
+    def user_id(self):
+        user = getattr(self.request, "user", None)
+        if user is not None and user.is_authenticated:
+            return user.pk
+        return None
+
+    def use_primary(self):
+        if self.writes:
+            return True
+        if self._recent_writer is None:
+            user_id = self.user_id()
+            if user_id is None:
+                return False
+            self._recent_writer = bool(cache.get(pin_cache_key(user_id)))
+        return self._recent_writer
+
+
+def activate_pin(request):
+    return _current_pin.set(RequestPin(request))
+
+
+def deactivate_pin(token):
+    _current_pin.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Sends reads to one of ``DATABASE_REPLICAS`` and writes to the primary.
+
+    Reads stay on the primary inside transactions, during unsafe requests
+    and for users who wrote within the last ``REPLICA_PIN_SECONDS`` (see
+    ``core.middleware.ReplicaPinningMiddleware``), so people always see
+    their own likes, follows and posts.
+    """
+
+    def __init__(self, replicas=None):
+        if replicas is None:
+            replicas = getattr(settings, "DATABASE_REPLICAS", [])
+        self.replicas = list(replicas)
+
+    def db_for_read(self, model, **hints):
+        if not self.replicas:
+            return PRIMARY
+        if model._meta.label_lower in PRIMARY_ONLY_MODELS:
+            return PRIMARY
+        if connections[PRIMARY].in_atomic_block:
+            return PRIMARY
+
+        pin = _current_pin.get()
+        if pin is None:
+            return random.choice(self.replicas)
+        if pin.use_primary():
+            return PRIMARY
+        return pin.replica(self.replicas)
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        pool = {PRIMARY, *self.replicas}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas are copies of the primary, never migrated directly
+        return db == PRIMARY
+
+
+class CacheRouter:
+    """
+    Keeps the table of Django's database cache (``django_cache``) on its own
+    SQLite file, ``CACHE_DATABASE``, so cache writes from every worker never
+    wait for the primary's write lock.
+    """
+
+    def __init__(self, alias=None):
+        self.alias = alias or getattr(settings, "CACHE_DATABASE", "cache")
+
+    def _route(self, model):
+        if model._meta.app_label == "django_cache":
+            return self.alias
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._route(model)
+
+    def db_for_write(self, model, **hints):
+        return self._route(model)
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label == "django_cache":
+            return db == self.alias
+        # the cache database holds nothing else
+        if db == self.alias:
+            return False
+        return None
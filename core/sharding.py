@@ -0,0 +1,336 @@
+"""
+User-id based sharding of posts and likes.
+
+Posts live on the shard picked for their author, likes live next to the
+post they belong to, so everything about one author's posts stays on one
+database. Users and profiles are reference data: they are written to the
+primary and mirrored onto every shard, which keeps foreign keys and
+``select_related`` working inside a shard.
+
+Sharding is off unless ``POST_SHARDS`` lists database aliases (see
+``settings/sharded.py``); every helper then falls back to the primary.
+"""
+import bisect
+import copy
+import hashlib
+import heapq
+import itertools
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS
+from django.http import Http404
+
+SHARDED_MODELS = {"posts.post", "social.like"}
+REFERENCE_MODELS = {"users.user", "users.userprofile"}
+
+# virtual nodes per shard on the hash ring
+RING_REPLICAS = 64
+
+
+def shard_aliases():
+    return list(getattr(settings, "POST_SHARDS", []))
+
+
+def enabled():
+    return bool(shard_aliases())
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(str(value).encode()).digest()[:8], "big")
+
+
+class ShardMap:
+    """
+    Consistent hash ring mapping user ids to shard aliases.
+
+    Adding a shard only moves the users whose ring segment it takes over
+    (about 1/N of them) instead of reshuffling everybody.
+    """
+
+    def __init__(self, aliases, replicas=RING_REPLICAS):
+        self.aliases = list(aliases)
+        self._ring = sorted(
+            (_hash(f"{alias}#{i}"), alias)
+            for alias in self.aliases
+            for i in range(replicas)
+        )
+        self._points = [point for point, _ in self._ring]
+
+    def shard_for(self, user_id):
+        index = bisect.bisect(self._points, _hash(user_id)) % len(self._ring)
+        return self._ring[index][1]
+
+
+_maps = {}
+
+
+def shard_map():
+    aliases = tuple(shard_aliases())
+    if aliases not in _maps:
+        _maps[aliases] = ShardMap(aliases)
+    return _maps[aliases]
+
+
+def shard_for_user(user_id):
+    if not enabled():
+        return DEFAULT_DB_ALIAS
+    return shard_map().shard_for(user_id)
+
+
+def shard_for_post(post):
+    """Likes are stored on their post's shard"""
+    return shard_for_user(post.user_id)
+
+
+def group_by_shard(user_ids):
+    groups = {}
+    for user_id in user_ids:
+        groups.setdefault(shard_for_user(user_id), []).append(user_id)
+    return groups
+
+
+def on_shards(queryset):
+    """The same queryset bound to each shard (or just the queryset when off)"""
+    if not enabled():
+        return [queryset]
+    return [queryset.using(alias) for alias in shard_aliases()]
+
+
+def find(queryset, **lookup):
+    """First match for ``lookup`` on any shard, or None"""
+    for shard_queryset in on_shards(queryset):
+        obj = shard_queryset.filter(**lookup).first()
+        if obj is not None:
+            return obj
+    return None
+
+
+def get_or_404(queryset, **lookup):
+    obj = find(queryset, **lookup)
+    if obj is None:
+        raise Http404(f"No {queryset.model._meta.object_name} matches the given query.")
+    return obj
+
+
+class ScatterGatherList:
+    """
+    Results of the same ordered query run on several shards, merged.
+
+    Supports ``count()`` and slicing, which is all Django's paginator (and
+    so DRF pagination) needs. A slice ``[start:stop]`` fetches at most
+    ``stop`` rows from each shard and k-way merges them with ``heapq.merge``.
+    """
+
+    def __init__(self, querysets, key, reverse=True):
+        self.querysets = list(querysets)
+        self.key = key
+        self.reverse = reverse
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            self._count = sum(queryset.count() for queryset in self.querysets)
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return heapq.merge(*self.querysets, key=self.key, reverse=self.reverse)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if index.step not in (None, 1):
+                raise ValueError("ScatterGatherList does not support slice steps")
+            start = index.start or 0
+            stop = index.stop
+            if stop is None:
+                return list(itertools.islice(iter(self), start, None))
+            merged = heapq.merge(
+                *(queryset[:stop] for queryset in self.querysets),
+                key=self.key,
+                reverse=self.reverse,
+            )
+            return list(itertools.islice(merged, start, stop))
+
+        results = self[index : index + 1]
+        if not results:
+            raise IndexError("ScatterGatherList index out of range")
+        return results[0]
+
+
+def recency_key(obj):
+    return (obj.created_at, obj.pk)
+
+
+def scatter_gather(querysets_by_shard, key=recency_key):
+    """Single shard: the queryset itself; several: a merged ScatterGatherList"""
+    querysets = list(querysets_by_shard.values())
+    if len(querysets) == 1:
+        return querysets[0]
+    return ScatterGatherList(querysets, key=key)
+
+
+def gather(queryset, key=recency_key):
+    """An ordered queryset run on every shard, merged with ``key``"""
+    return scatter_gather(dict(enumerate(on_shards(queryset))), key=key)
+
+
+def count(queryset):
+    """Rows matching ``queryset`` summed over every shard"""
+    return sum(shard_queryset.count() for shard_queryset in on_shards(queryset))
+
+
+def top(queryset, limit, key):
+    """
+    The first ``limit`` rows of an ordered queryset across every shard:
+    each shard's first ``limit``, re-ranked by ``key`` (largest first)
+    """
+    rows = [row for shard_queryset in on_shards(queryset) for row in shard_queryset[:limit]]
+    return heapq.nlargest(limit, rows, key=key)
+
+
+def using_shard(queryset, alias):
+    """Bind to ``alias`` only when sharding is on, so other routers still apply"""
+    return queryset.using(alias) if enabled() else queryset
+
+
+class IdGenerator:
+    """
+    Snowflake-style 63-bit ids (ms timestamp, worker, sequence).
+
+    Every shard has its own autoincrement counter, so sharded rows need ids
+    that are unique across shards and survive being moved by a rebalance.
+    That only holds if no two live processes share a worker id, so it comes
+    from ``SHARD_WORKER_ID`` rather than anything derived locally.
+    """
+
+    EPOCH_MS = 1704067200000  # 2024-01-01
+    WORKER_BITS = 10
+    SEQUENCE_BITS = 12
+
+    def __init__(self, worker_id=None):
+        # None: read SHARD_WORKER_ID when the first id is needed
+        self._worker_id = None if worker_id is None else self._checked(worker_id)
+        self._last_ms = -1
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def _checked(cls, worker_id):
+        try:
+            worker_id = int(worker_id)
+        except (TypeError, ValueError):
+            raise ImproperlyConfigured(f"SHARD_WORKER_ID must be an integer, not {worker_id!r}")
+        if not 0 <= worker_id < 1 << cls.WORKER_BITS:
+            raise ImproperlyConfigured(
+                f"SHARD_WORKER_ID must be between 0 and {(1 << cls.WORKER_BITS) - 1}, not {worker_id}"
+            )
+        return worker_id
+
+    @property
+    def worker_id(self):
+        if self._worker_id is not None:
+            return self._worker_id
+        worker_id = getattr(settings, "SHARD_WORKER_ID", None)
+        if worker_id is None or worker_id == "":
+            raise ImproperlyConfigured(
+                "SHARD_WORKER_ID (or DJANGO_SHARD_WORKER_ID) must be set, and differ "
+                "between processes, when POST_SHARDS is"
+            )
+        return self._checked(worker_id)
+
+    def next_id(self):
+        worker_id = self.worker_id
+        with self._lock:
+            now = int(time.time() * 1000)
+            if now <= self._last_ms:
+                # same millisecond (or clock went back): keep counting
+                now = self._last_ms
+                self._sequence = (self._sequence + 1) & ((1 << self.SEQUENCE_BITS) - 1)
+                if self._sequence == 0:
+                    now += 1
+            else:
+                self._sequence = 0
+            self._last_ms = now
+            return (
+                (now - self.EPOCH_MS) << (self.WORKER_BITS + self.SEQUENCE_BITS)
+                | worker_id << self.SEQUENCE_BITS
+                | self._sequence
+            )
+
+
+id_generator = IdGenerator()
+
+
+def assign_shard_id(sender, instance, raw=False, **kwargs):
+    """``pre_save`` hook giving new sharded rows a globally unique id"""
+    if raw or not enabled() or instance.pk is not None:
+        return
+    if sender._meta.label_lower in SHARDED_MODELS:
+        instance.pk = id_generator.next_id()
+
+
+def mirror_reference_save(sender, instance, raw=False, using=None, **kwargs):
+    """``post_save`` hook copying users and profiles onto every shard"""
+    if raw or not enabled() or using != DEFAULT_DB_ALIAS:
+        return
+    if sender._meta.label_lower not in REFERENCE_MODELS:
+        return
+    for alias in shard_aliases():
+        # save a copy so the caller's instance stays bound to the primary
+        copy.copy(instance).save(using=alias)
+
+
+def mirror_reference_delete(sender, instance, using=None, **kwargs):
+    if not enabled() or using != DEFAULT_DB_ALIAS:
+        return
+    if sender._meta.label_lower not in REFERENCE_MODELS:
+        return
+    for alias in shard_aliases():
+        sender._default_manager.using(alias).filter(pk=instance.pk).delete()
+
+
+class ShardRouter:
+    """
+    Routes posts and likes to their shard, everything else to the primary.
+
+    Sharded models need to know the row to pick a shard, so writes use the
+    instance and reads follow the instance hint Django passes for related
+    lookups (``post.likes``, ``like.post``). Reads without a hint should go
+    through ``core.sharding`` helpers or ``.using()``.
+    """
+
+    def _is_sharded(self, model):
+        return model._meta.label_lower in SHARDED_MODELS
+
+    def db_for_read(self, model, **hints):
+        instance = hints.get("instance")
+        if self._is_sharded(model) and instance is not None and instance._state.db:
+            return instance._state.db
+        return None
+
+    def db_for_write(self, model, **hints):
+        if not self._is_sharded(model):
+            return DEFAULT_DB_ALIAS
+        instance = hints.get("instance")
+        # assigning a relation passes the related object as the hint
+        if not isinstance(instance, model):
+            return None
+        if not instance._state.adding and instance._state.db:
+            # existing rows stay where they are until a rebalance moves them
+            return instance._state.db
+        if model._meta.label_lower == "posts.post":
+            return shard_for_user(instance.user_id)
+        return shard_for_post(instance.post)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # reference rows are mirrored everywhere, sharded rows stay together
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # every shard carries the full schema; only the rows are partitioned
+        return True
@@ -0,0 +1,282 @@
+"""
+Slow-query log.
+
+``core.db.count_queries`` sees every statement; those slower than
+``SLOW_QUERY_LOG["THRESHOLD_MS"]`` (a ``SAMPLE_RATE`` share of them) are
+queued here together with the URL name of the request and a fingerprint of
+the application frames that issued them. A background thread runs
+``EXPLAIN QUERY PLAN`` once per fingerprint and writes one JSON line per
+fingerprint and flush interval to a rotating file, so a hot slow query
+shows up as a count instead of thousands of lines. ``manage.py
+slow_queries`` summarizes the file.
+
+Query parameters can hold secrets (token keys, password hashes), so they
+are only used for the EXPLAIN and never written unless ``LOG_PARAMS`` is
+on. Every worker process appends to the same file; appends and rotation
+happen under a lock on ``PATH.lock``.
+"""
+import atexit
+import hashlib
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+except ImportError:  # Windows: one process, nothing to coordinate with
+    fcntl = None
+
+from django.conf import settings
+from django.db import connections
+
+from . import perf
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "PATH": None,
+    "THRESHOLD_MS": 100,
+    "SAMPLE_RATE": 1.0,
+    "MAX_BYTES": 10 * 1024 * 1024,
+    "BACKUP_COUNT": 5,
+    "FLUSH_SECONDS": 30,
+    "LOG_PARAMS": False,
+}
+
+# application frames kept in the call-site fingerprint
+STACK_DEPTH = 4
+
+_SKIPPED_FILES = (
+    os.path.join("core", "db.py"),
+    os.path.join("core", "slow_queries.py"),
+)
+
+
+def config():
+    return {**DEFAULTS, **getattr(settings, "SLOW_QUERY_LOG", {})}
+
+
+def call_site():
+    """The innermost application frames, as ``path:line in function``"""
+    root = str(settings.BASE_DIR)
+    frames = []
+    for frame in reversed(traceback.extract_stack()):
+        filename = frame.filename
+        if (
+            not filename.startswith(root)
+            or "site-packages" in filename
+            or filename.endswith(_SKIPPED_FILES)
+        ):
+            continue
+        relative = os.path.relpath(filename, root)
+        frames.append(f"{relative}:{frame.lineno} in {frame.name}")
+        if len(frames) == STACK_DEPTH:
+            break
+    return frames
+
+
+def fingerprint(sql, stack):
+    digest = hashlib.sha1("\n".join([sql, *stack]).encode())
+    return digest.hexdigest()[:16]
+
+
+def explain(alias, sql, params):
+    """Plan rows for a SELECT, or None for statements that can't be explained"""
+    if not sql.lstrip().upper().startswith(("SELECT", "WITH")):
+        return None
+    connection = connections[alias]
+    prefix = "EXPLAIN QUERY PLAN" if connection.vendor == "sqlite" else "EXPLAIN"
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"{prefix} {sql}", params)
+            return [" ".join(str(column) for column in row[-1:]) for row in cursor.fetchall()]
+    except Exception as exc:  # the plan is best effort
+        return [f"EXPLAIN failed: {exc}"]
+    finally:
+        connection.close()
+
+
+@contextmanager
+def _file_lock(path):
+    with open(path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _rotate(path, backup_count):
+    """Shift ``path`` to ``path.1``, ``path.1`` to ``path.2``, ... like RotatingFileHandler"""
+    if not backup_count:
+        os.remove(path)
+        return
+    for index in range(backup_count - 1, 0, -1):
+        source = f"{path}.{index}"
+        if os.path.exists(source):
+            os.replace(source, f"{path}.{index + 1}")
+    os.replace(path, f"{path}.1")
+
+
+def append_lines(path, lines, max_bytes, backup_count):
+    """
+    Append ``lines`` to ``path`` with one write, rotating it first when
+    they would take it past ``max_bytes``; safe across processes
+    """
+    data = "".join(f"{line}\n" for line in lines).encode()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with _file_lock(f"{path}.lock"):
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            size = 0
+        if max_bytes and size and size + len(data) > max_bytes:
+            _rotate(path, backup_count)
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+
+class SlowQueryLog:
+    """Queue of slow statements drained by one background writer thread"""
+
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=1000)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._atexit_registered = False
+        # fingerprint -> entry being aggregated until the next flush
+        self._pending = {}
+        self._explained = set()
+        self._last_flush = time.monotonic()
+        self.dropped = 0
+
+    def observe(self, sql, params, many, alias, elapsed_ms):
+        """Called for every statement; cheap unless it is slow"""
+        options = getattr(settings, "SLOW_QUERY_LOG", None)
+        if not options or not options.get("PATH"):
+            return
+        if elapsed_ms < options.get("THRESHOLD_MS", DEFAULTS["THRESHOLD_MS"]):
+            return
+        if threading.current_thread() is self._thread:
+            return  # our own EXPLAINs
+        sample_rate = options.get("SAMPLE_RATE", DEFAULTS["SAMPLE_RATE"])
+        if sample_rate < 1 and random.random() >= sample_rate:
+            return
+
+        timings = perf.current()
+        item = {
+            "sql": sql,
+            "params": None if many else params,
+            "alias": alias,
+            "elapsed_ms": elapsed_ms,
+            "route": timings.route if timings is not None else None,
+            "stack": call_site(),
+            "at": datetime.now(timezone.utc).isoformat(),
+        }
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(
+                        target=self._run, name="slow-query-log", daemon=True
+                    )
+                    self._thread.start()
+                    if not self._atexit_registered:
+                        atexit.register(self.flush)
+                        self._atexit_registered = True
+
+    def _run(self):
+        while True:
+            flush_seconds = config()["FLUSH_SECONDS"]
+            try:
+                item = self._queue.get(timeout=flush_seconds)
+            except queue.Empty:
+                item = None
+            try:
+                if item is not None:
+                    with self._lock:
+                        self._add(item)
+                if time.monotonic() - self._last_flush >= flush_seconds:
+                    self._write_pending()
+            finally:
+                if item is not None:
+                    self._queue.task_done()
+
+    def _add(self, item):
+        key = fingerprint(item["sql"], item["stack"])
+        entry = self._pending.get(key)
+        if entry is None:
+            entry = self._pending[key] = {
+                "fingerprint": key,
+                "sql": item["sql"],
+                "route": item["route"],
+                "stack": item["stack"],
+                "alias": item["alias"],
+                "count": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "first_seen": item["at"],
+            }
+            if key not in self._explained:
+                self._explained.add(key)
+                if config()["LOG_PARAMS"]:
+                    entry["params"] = _jsonable(item["params"])
+                entry["plan"] = explain(item["alias"], item["sql"], item["params"])
+        entry["count"] += 1
+        entry["total_ms"] = round(entry["total_ms"] + item["elapsed_ms"], 3)
+        entry["max_ms"] = round(max(entry["max_ms"], item["elapsed_ms"]), 3)
+        entry["last_seen"] = item["at"]
+
+    def _write_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+            if not pending:
+                return
+            options = config()
+            if not options["PATH"]:
+                return
+            append_lines(
+                str(options["PATH"]),
+                [json.dumps(entry, separators=(",", ":")) for entry in pending.values()],
+                options["MAX_BYTES"],
+                options["BACKUP_COUNT"],
+            )
+
+    def flush(self):
+        """Wait for queued statements and write everything aggregated so far"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+        try:
+            self._write_pending()
+        except OSError:
+            logger.exception("Could not write the slow-query log")
+
+
+def _jsonable(params):
+    try:
+        json.dumps(params)
+    except TypeError:
+        return repr(params)
+    return params
+
+
+slow_query_log = SlowQueryLog()
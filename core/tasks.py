@@ -0,0 +1,200 @@
+"""
+Database-backed task queue for deferred side effects.
+
+``enqueue`` writes a ``Task`` row on the database of the triggering write,
+so calling it inside that write's ``atomic`` block commits both or
+neither; there is no broker to fall out of sync with. Handlers are plain
+functions registered with ``@task`` in an app's ``tasks.py``.
+
+``manage.py run_tasks`` claims due rows in batches (a conditional UPDATE,
+so several workers never take the same row) and runs them on a thread
+pool. A handler runs in a transaction on the task's database that also
+marks the task done, so side effects on that database happen exactly once;
+handlers touching other databases should be idempotent. Failures are
+retried with jittered exponential backoff until ``max_attempts``; a claim
+whose worker died expires after ``LEASE_SECONDS``.
+"""
+import logging
+import random
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import sharding
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "THREADS": 4,
+    "BATCH_SIZE": 50,
+    "LEASE_SECONDS": 60,
+    "MAX_ATTEMPTS": 5,
+    "BACKOFF_BASE": 1.0,
+    "BACKOFF_MAX": 300.0,
+    "KEEP_DONE_SECONDS": 7 * 24 * 3600,
+}
+
+_registry = {}
+
+
+def config():
+    return {**DEFAULTS, **getattr(settings, "TASKS", {})}
+
+
+def task(name):
+    """Register the decorated function as the handler for ``name``"""
+
+    def register(func):
+        _registry[name] = func
+        return func
+
+    return register
+
+
+def registered_tasks():
+    return dict(_registry)
+
+
+def databases():
+    """Every database with an outbox: the primary and the post shards"""
+    return [DEFAULT_DB_ALIAS] + [a for a in sharding.shard_aliases() if a != DEFAULT_DB_ALIAS]
+
+
+def enqueue(name, payload=None, key=None, delay=0, using=DEFAULT_DB_ALIAS, max_attempts=None):
+    """
+    Add a task on ``using``; call it inside the triggering write's
+    transaction. With a ``key`` that is already queued nothing is added
+    and None is returned.
+    """
+    if name not in _registry:
+        raise KeyError(f"Unknown task {name!r}")
+    row = Task(
+        name=name,
+        payload=payload or {},
+        key=key,
+        run_after=timezone.now() + timedelta(seconds=delay),
+        max_attempts=max_attempts or config()["MAX_ATTEMPTS"],
+    )
+    if key is None:
+        row.save(using=using)
+        return row
+    try:
+        # a savepoint, so a duplicate key leaves the caller's transaction usable
+        with transaction.atomic(using=using):
+            row.save(using=using)
+    except IntegrityError:
+        return None
+    return row
+
+
+def backoff(attempts):
+    """Seconds to wait before retry number ``attempts``, jittered"""
+    options = config()
+    ceiling = min(options["BACKOFF_MAX"], options["BACKOFF_BASE"] * 2 ** (attempts - 1))
+    return random.uniform(ceiling / 2, ceiling)
+
+
+def claim(using, worker_id, limit):
+    """Claim up to ``limit`` due tasks on ``using`` for ``worker_id``"""
+    now = timezone.now()
+    due = Q(status=Task.PENDING, run_after__lte=now) | Q(
+        status=Task.RUNNING, locked_until__lt=now
+    )
+    tasks = Task.objects.using(using)
+    ids = list(tasks.filter(due).order_by("run_after").values_list("pk", flat=True)[:limit])
+    if not ids:
+        return []
+    tasks.filter(due, pk__in=ids).update(
+        status=Task.RUNNING,
+        claimed_by=worker_id,
+        locked_until=now + timedelta(seconds=config()["LEASE_SECONDS"]),
+        attempts=F("attempts") + 1,
+    )
+    return list(tasks.filter(pk__in=ids, status=Task.RUNNING, claimed_by=worker_id))
+
+
+def execute(row, worker_id):
+    """Run one claimed task and record the outcome. Returns True on success."""
+    using = row._state.db
+    mine = Task.objects.using(using).filter(pk=row.pk, claimed_by=worker_id)
+    try:
+        handler = _registry.get(row.name)
+        if handler is None:
+            raise LookupError(f"No handler registered for {row.name!r}")
+        with transaction.atomic(using=using):
+            handler(**row.payload)
+            mine.update(status=Task.DONE, finished_at=timezone.now(), last_error="")
+        return True
+    except Exception:
+        logger.exception("Task %s #%s failed (attempt %s)", row.name, row.pk, row.attempts)
+        error = traceback.format_exc(limit=5)
+        if row.attempts >= row.max_attempts:
+            mine.update(status=Task.FAILED, last_error=error, finished_at=timezone.now())
+        else:
+            mine.update(
+                status=Task.PENDING,
+                last_error=error,
+                run_after=timezone.now() + timedelta(seconds=backoff(row.attempts)),
+            )
+        return False
+
+
+def _execute_in_thread(row, worker_id):
+    try:
+        return execute(row, worker_id)
+    finally:
+        # pool threads outlive the task; don't keep connections past CONN_MAX_AGE
+        close_old_connections()
+
+
+def run_pending(threads=None, batch_size=None, worker_id=None):
+    """
+    Claim and run due tasks on every database until none are left.
+    ``threads=0`` runs them in the calling thread. Returns (succeeded, failed).
+    """
+    options = config()
+    threads = options["THREADS"] if threads is None else threads
+    batch_size = batch_size or options["BATCH_SIZE"]
+    worker_id = worker_id or uuid.uuid4().hex
+    results = []
+
+    executor = None
+    if threads:
+        executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="tasks")
+    try:
+        while True:
+            batch = [row for using in databases() for row in claim(using, worker_id, batch_size)]
+            if not batch:
+                break
+            if executor is None:
+                results += [execute(row, worker_id) for row in batch]
+            else:
+                results += executor.map(lambda row: _execute_in_thread(row, worker_id), batch)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return results.count(True), results.count(False)
+
+
+def prune(older_than=None, batch_size=1000):
+    """Delete finished tasks past the retention window, in batches"""
+    from .purge import delete_batch
+
+    seconds = config()["KEEP_DONE_SECONDS"] if older_than is None else older_than
+    cutoff = timezone.now() - timedelta(seconds=seconds)
+    removed = 0
+    for using in databases():
+        finished = Task.objects.using(using).filter(status=Task.DONE, finished_at__lt=cutoff)
+        while True:
+            selected, _ = delete_batch(finished, batch_size)
+            if not selected:
+                break
+            removed += selected
+    return removed
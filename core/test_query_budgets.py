@@ -0,0 +1,228 @@
+"""
+Enforce core.query_budgets: every endpoint is requested against a seeded
+dataset at page sizes 1 and 100 and must stay within its query budget.
+"""
+import uuid
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.urls import URLPattern, get_resolver, reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.test import APITestCase
+
+from core import changes
+from core.benchmarks import QueryCounter
+from core.models import ChangeLogEntry
+from core.pagination import KeysetPagination
+from core.query_budgets import QUERY_BUDGETS
+from posts.models import Post
+from social.models import Follow, Like, Notification
+from users.models import UserProfile
+
+User = get_user_model()
+
+PAGE_SIZES = (1, 100)
+PASSWORD = "testpass123"
+
+
+class _Rollback(Exception):
+    pass
+
+
+class QueryBudgetTests(APITestCase):
+    """Every endpoint stays within its declared query budget"""
+
+    @classmethod
+    def setUpTestData(cls):
+        password = make_password(PASSWORD)
+
+        def make_users(prefix, count, with_profile=True):
+            users = User.objects.bulk_create(
+                User(
+                    username=f"{prefix}_{i}_{uuid.uuid4().hex[:6]}",
+                    email=f"{prefix}_{i}_{uuid.uuid4().hex[:6]}@example.com",
+                    password=password,
+                )
+                for i in range(count)
+            )
+            if with_profile:
+                UserProfile.objects.bulk_create(UserProfile(user=u) for u in users)
+            return users
+
+        cls.me = make_users("me", 1)[0]
+        cls.stranger = make_users("stranger", 1)[0]
+        cls.authors = make_users("author", 5)
+        # some users have no profile, which must not cost extra queries
+        cls.fans = make_users("fan", 100) + make_users("bare", 10, with_profile=False)
+
+        cls.posts = Post.objects.bulk_create(
+            Post(
+                user=author,
+                caption=f"budget post {i}",
+                image_url="https://picsum.photos/400/400.jpg",
+            )
+            for author in cls.authors
+            for i in range(25)
+        )
+        cls.my_post = Post.objects.create(
+            user=cls.me, caption="mine", image_url="https://picsum.photos/1.jpg"
+        )
+
+        Follow.objects.bulk_create(
+            [Follow(follower=cls.me, following=u) for u in cls.authors + cls.fans]
+            + [Follow(follower=u, following=cls.me) for u in cls.fans]
+            + [Follow(follower=cls.authors[0], following=u) for u in cls.fans[:50]]
+        )
+        Like.objects.bulk_create(
+            [Like(user=cls.me, post=post) for post in cls.posts[:110]]
+            + [Like(user=fan, post=cls.posts[0]) for fan in cls.fans]
+            + [Like(user=fan, post=cls.my_post) for fan in cls.fans[:3]]
+        )
+        window = timezone.now().replace(minute=0, second=0, microsecond=0)
+        Notification.objects.bulk_create(
+            Notification(
+                recipient=cls.me,
+                verb=Notification.LIKE,
+                post_id=cls.my_post.pk,
+                window_start=window - timedelta(hours=i),
+                actor_count=3,
+                last_actor=fan,
+            )
+            for i, fan in enumerate(cls.fans)
+        )
+        ChangeLogEntry.objects.bulk_create(
+            [
+                ChangeLogEntry(kind="post", op="upsert", object_id=p.pk, actor_id=p.user_id)
+                for p in cls.posts
+            ]
+            + [
+                ChangeLogEntry(kind="like", op="upsert", object_id=like.pk, actor_id=cls.me.pk)
+                for like in Like.objects.filter(user=cls.me)
+            ]
+            + [
+                ChangeLogEntry(
+                    kind="follow", op="upsert", object_id=f.pk, actor_id=f.follower_id,
+                    target_id=cls.me.pk,
+                )
+                for f in Follow.objects.filter(following=cls.me)
+            ]
+        )
+        cls.token = Token.objects.create(user=cls.me)
+
+    def endpoint_requests(self):
+        """URL name -> (method, reverse kwargs, request data)"""
+        author = self.authors[0]
+        post = self.posts[0]
+        unliked = self.posts[-1]
+        return {
+            "users:register": (
+                "post",
+                {},
+                {
+                    "username": "budget_new",
+                    "email": "budget_new@example.com",
+                    "password": "Sup3r-secret-pw",
+                    "password_confirm": "Sup3r-secret-pw",
+                },
+            ),
+            "users:login": ("post", {}, {"username": author.username, "password": PASSWORD}),
+            "users:logout": ("post", {}, None),
+            "users:user-list": ("get", {}, None),
+            "users:current-user": ("get", {}, None),
+            "users:export-data": ("get", {}, None),
+            "users:sync-changes": ("get", {}, {"token": changes.encode_token({})}),
+            "users:user-detail": ("get", {"pk": str(author.pk)}, None),
+            "users:user-batch": (
+                "get", {}, {"ids": ",".join(str(u.pk) for u in self.fans[:100])}
+            ),
+            "posts:post-list-create": ("get", {}, None),
+            "posts:post-detail": ("get", {"pk": post.pk}, None),
+            "posts:feed": ("get", {}, None),
+            "posts:timeline": ("get", {}, None),
+            "posts:discover": ("get", {}, None),
+            "posts:popular-posts": ("get", {}, None),
+            "posts:my-posts": ("get", {}, None),
+            "posts:user-posts": ("get", {"user_id": author.pk}, None),
+            "posts:post-stats": ("get", {}, None),
+            "posts:feed-stats": ("get", {}, None),
+            "posts:feed-new": ("get", {}, None),
+            "posts:timeline-new": ("get", {}, None),
+            "posts:post-batch": (
+                "get", {}, {"ids": ",".join(str(p.pk) for p in self.posts[:100])}
+            ),
+            "social:follow-user": ("post", {"user_id": self.stranger.pk}, None),
+            "social:unfollow-user": ("delete", {"user_id": author.pk}, None),
+            "social:user-followers": ("get", {"user_id": self.fans[0].pk}, None),
+            "social:user-following": ("get", {"user_id": author.pk}, None),
+            "social:my-followers": ("get", {}, None),
+            "social:my-following": ("get", {}, None),
+            "social:like-post": ("post", {"post_id": unliked.pk}, None),
+            "social:unlike-post": ("delete", {"post_id": post.pk}, None),
+            "social:post-likes": ("get", {"post_id": post.pk}, None),
+            "social:user-likes": ("get", {"user_id": self.me.pk}, None),
+            "social:my-likes": ("get", {}, None),
+            "social:follow-stats": ("get", {}, None),
+            "social:user-follow-stats": ("get", {"user_id": author.pk}, None),
+            "social:like-stats": ("get", {}, None),
+            "social:user-like-stats": ("get", {"user_id": author.pk}, None),
+            "social:suggested-users": ("get", {}, None),
+            "social:mutual-follows": ("get", {"user_id": author.pk}, None),
+            "social:trending-posts": ("get", {}, None),
+            "social:notifications": ("get", {}, None),
+            "social:unread-notifications": ("get", {}, None),
+            "social:mark-notifications-read": ("post", {}, None),
+        }
+
+    def measure(self, name, page_size):
+        method, kwargs, data = self.endpoint_requests()[name]
+        url = reverse(f"core:{name}", kwargs=kwargs)
+        # a fresh instance, so no relation caches carry over between requests
+        self.client.force_authenticate(User.objects.get(pk=self.me.pk))
+        counter = QueryCounter()
+        try:
+            # each measurement starts from the seeded state
+            with transaction.atomic():
+                with mock.patch.object(
+                    PageNumberPagination, "page_size", page_size
+                ), mock.patch.object(KeysetPagination, "page_size", page_size):
+                    with connection.execute_wrapper(counter):
+                        response = getattr(self.client, method)(url, data, format="json")
+                        # streamed bodies run their queries as they are read
+                        if response.streaming:
+                            content = b"".join(response.streaming_content)
+                        else:
+                            content = response.content
+                raise _Rollback
+        except _Rollback:
+            pass
+        self.assertLess(response.status_code, 400, f"{name}: {content[:200]}")
+        return counter.queries
+
+    def test_every_url_name_has_a_budget(self):
+        resolver = get_resolver()
+        names = set()
+        for app in ("users", "posts", "social"):
+            urlconf = resolver.namespace_dict["core"][1].namespace_dict[app][1]
+            names.update(
+                f"{app}:{pattern.name}"
+                for pattern in urlconf.url_patterns
+                if isinstance(pattern, URLPattern)
+            )
+        self.assertEqual(names, set(QUERY_BUDGETS))
+        self.assertEqual(set(self.endpoint_requests()), set(QUERY_BUDGETS))
+
+    def test_endpoints_stay_within_budget(self):
+        for name, budget in QUERY_BUDGETS.items():
+            for page_size, limit in zip(PAGE_SIZES, (budget.page_1, budget.page_100)):
+                with self.subTest(name=name, page_size=page_size):
+                    queries = self.measure(name, page_size)
+                    self.assertLessEqual(
+                        queries,
+                        limit,
+                        f"{name} ran {queries} queries at page size {page_size}, budget {limit}",
+                    )
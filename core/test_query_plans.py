@@ -0,0 +1,141 @@
+"""
+EXPLAIN QUERY PLAN regression tests for the hot read endpoints.
+
+Every SELECT an endpoint issues is re-run under ``EXPLAIN QUERY PLAN``; a
+bare ``SCAN <table>`` (a full table scan, as opposed to a scan of an index)
+on one of the big tables fails the test.
+"""
+import re
+import uuid
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from posts.models import Post
+from social.models import Follow, Like
+
+User = get_user_model()
+
+HOT_TABLES = {"posts_post", "social_like", "social_follow"}
+
+FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+
+
+class QueryRecorder:
+    """Execute wrapper keeping the raw SQL and params of each SELECT"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip().upper().startswith("SELECT"):
+            self.queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+def full_scans(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        details = [row[-1] for row in cursor.fetchall()]
+    return [
+        detail
+        for detail in details
+        if (match := FULL_SCAN.match(detail)) and match.group(1) in HOT_TABLES
+    ]
+
+
+class QueryPlanTests(APITestCase):
+    """Hot endpoints must be served from indexes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        def make_user():
+            unique_id = str(uuid.uuid4())[:8]
+            return User.objects.create_user(
+                username=f"plan_{unique_id}",
+                email=f"plan_{unique_id}@example.com",
+                password="testpass123",
+            )
+
+        cls.user = make_user()
+        cls.others = [make_user() for _ in range(3)]
+        cls.token = Token.objects.create(user=cls.user)
+        for other in cls.others:
+            Follow.objects.create(follower=cls.user, following=other)
+            Follow.objects.create(follower=other, following=cls.user)
+
+        cls.posts = [
+            Post.objects.create(
+                user=author,
+                caption=f"plan post {i}",
+                image_url="https://picsum.photos/400/400.jpg",
+            )
+            for i, author in enumerate([cls.user] + cls.others)
+        ]
+        for post in cls.posts[1:]:
+            Like.objects.create(user=cls.user, post=post)
+        Like.objects.create(user=cls.others[0], post=cls.posts[0])
+        Like.objects.filter(post=cls.posts[1]).update(
+            created_at=timezone.now() - timedelta(days=1)
+        )
+
+    def setUp(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+    def hot_endpoints(self):
+        post = self.posts[1]
+        other = self.others[0]
+        return [
+            "/api/v1/posts/",
+            f"/api/v1/posts/{post.pk}/",
+            "/api/v1/posts/feed/",
+            "/api/v1/posts/timeline/",
+            "/api/v1/posts/discover/",
+            "/api/v1/posts/my-posts/",
+            f"/api/v1/posts/user/{other.pk}/",
+            f"/api/v1/social/posts/{post.pk}/likes/",
+            "/api/v1/social/my-likes/",
+            f"/api/v1/social/users/{other.pk}/likes/",
+            "/api/v1/social/my-followers/",
+            "/api/v1/social/my-following/",
+            f"/api/v1/social/users/{other.pk}/followers/",
+            "/api/v1/social/stats/",
+            "/api/v1/social/like-stats/",
+            "/api/v1/social/trending/",
+            f"/api/v1/posts/feed/new/?since={self.posts[0].pk}",
+            "/api/v1/posts/timeline/new/",
+        ]
+
+    def test_hot_endpoints_avoid_full_table_scans(self):
+        for url in self.hot_endpoints():
+            with self.subTest(url=url):
+                recorder = QueryRecorder()
+                with connection.execute_wrapper(recorder):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(recorder.queries)
+
+                scans = {
+                    scan
+                    for sql, params in recorder.queries
+                    for scan in full_scans(sql, params)
+                }
+                self.assertFalse(scans, f"{url} does a full scan: {sorted(scans)}")
+
+    def test_new_posts_probe_reads_only_indexes(self):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            response = self.client.get("/api/v1/posts/timeline/new/")
+        self.assertEqual(response.json()["count"], len(self.posts))
+        for sql, params in recorder.queries:
+            with connection.cursor() as cursor:
+                cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+                details = [row[-1] for row in cursor.fetchall()]
+            searches = [d for d in details if d.startswith(("SEARCH", "SCAN"))]
+            self.assertTrue(
+                all("COVERING INDEX" in d for d in searches), f"{sql} reads rows: {details}"
+            )
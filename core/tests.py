@@ -1,3 +1,1055 @@
-from django.test import TestCase
+import json
+import os
+import sqlite3
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.cache.backends.db import DatabaseCache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection, transaction
+from django.db.models import Count, F
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from core import purge, sharding, tasks
+from core.benchmarks import QUERY_COUNT_HEADER, QueryCountingApp, compare_to_baseline
+from core.cache import TTLLRUCache
+from core.metrics import MmapValues, Registry
+from core.models import PurgeJob, Task
+from core.pagination import KeysetPagination
+from core.slow_queries import append_lines, slow_query_log
+from core.db import apply_pragmas, configure_sqlite, query_counts, retry_on_lock
+from core.middleware import ReplicaPinningMiddleware
+from core.routers import (
+    CacheRouter,
+    ReplicaRouter,
+    activate_pin,
+    deactivate_pin,
+    mark_recent_write,
+    pin_cache_key,
+)
+from posts.models import Post
+from social.models import Follow, Like
+from users.models import UserProfile
+
+User = get_user_model()
+
+
+class RetryOnLockTests(SimpleTestCase):
+    """Test the write retry wrapper"""
+
+    def setUp(self):
+        patcher = mock.patch("core.db.time.sleep")
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_retries_lock_errors_then_succeeds(self):
+        calls = []
+
+        @retry_on_lock
+        def write():
+            calls.append(1)
+            if len(calls) < 3:
+                raise OperationalError("database is locked")
+            return "ok"
+
+        self.assertEqual(write(), "ok")
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(self.sleep.call_count, 2)
+
+    @override_settings(SQLITE_WRITE_RETRY={"ATTEMPTS": 2})
+    def test_gives_up_after_attempts(self):
+        write = retry_on_lock(mock.Mock(side_effect=OperationalError("database is locked")))
+        with self.assertRaises(OperationalError):
+            write()
+        self.assertEqual(write.__wrapped__.call_count, 2)
+
+    def test_other_errors_are_not_retried(self):
+        write = retry_on_lock(mock.Mock(side_effect=OperationalError("no such table: x")))
+        with self.assertRaises(OperationalError):
+            write()
+        self.assertEqual(write.__wrapped__.call_count, 1)
+
+    def test_not_retried_inside_outer_transaction(self):
+        write = retry_on_lock(mock.Mock(side_effect=OperationalError("database is locked")))
+        with mock.patch.object(connection, "in_atomic_block", True):
+            with self.assertRaises(OperationalError):
+                write()
+        self.assertEqual(write.__wrapped__.call_count, 1)
+
+
+class SqlitePragmaTests(SimpleTestCase):
+    """Test the connection init hook"""
+
+    def test_apply_pragmas(self):
+        conn = sqlite3.connect(":memory:")
+        apply_pragmas(conn.cursor(), {"busy_timeout": 1234, "temp_store": "MEMORY"})
+        self.assertEqual(conn.execute("PRAGMA busy_timeout").fetchone()[0], 1234)
+        self.assertEqual(conn.execute("PRAGMA temp_store").fetchone()[0], 2)
+
+    @override_settings(SQLITE_PRAGMAS={})
+    def test_hook_is_noop_without_pragmas(self):
+        fake = mock.Mock(vendor="sqlite")
+        configure_sqlite(sender=None, connection=fake)
+        fake.cursor.assert_not_called()
+
+
+class ReplicaRouterTests(TestCase):
+    """Test read replica routing and read-your-writes pinning"""
+
+    def setUp(self):
+        cache.clear()
+        self.router = ReplicaRouter(replicas=["replica1", "replica2"])
+        self.user = User.objects.create_user(
+            username="router_user", email="router@example.com", password="pw"
+        )
+        self.factory = RequestFactory()
+
+    def _route_during(self, request, model=Post):
+        token = activate_pin(request)
+        try:
+            return self.router.db_for_read(model)
+        finally:
+            deactivate_pin(token)
+
+    def _get(self, user=None):
+        request = self.factory.get("/api/v1/posts/feed/")
+        request.user = user or AnonymousUser()
+        return request
+
+    def test_reads_go_to_replicas_and_writes_to_primary(self):
+        # TestCase wraps each test in a transaction, which pins to the primary
+        with mock.patch.object(connection, "in_atomic_block", False):
+            self.assertIn(self._route_during(self._get(self.user)), ["replica1", "replica2"])
+        self.assertEqual(self.router.db_for_write(Post), "default")
+
+    def test_recent_writer_reads_from_primary(self):
+        with mock.patch.object(connection, "in_atomic_block", False):
+            self.assertNotEqual(self._route_during(self._get(self.user)), "default")
+            mark_recent_write(self.user.pk)
+            self.assertEqual(self._route_during(self._get(self.user)), "default")
+            # other users are unaffected
+            self.assertNotEqual(self._route_during(self._get()), "default")
+
+    def test_unsafe_requests_and_tokens_use_primary(self):
+        with mock.patch.object(connection, "in_atomic_block", False):
+            request = self.factory.post("/api/v1/social/like/1/")
+            request.user = self.user
+            self.assertEqual(self._route_during(request), "default")
+            self.assertEqual(self.router.db_for_read(Token), "default")
+
+    def test_middleware_pins_user_after_successful_write(self):
+        request = self.factory.post("/api/v1/social/like/1/")
+        request.user = self.user
+        middleware = ReplicaPinningMiddleware(lambda r: HttpResponse(status=201))
+        middleware(request)
+        self.assertTrue(cache.get(pin_cache_key(self.user.pk)))
+
+        other = User.objects.create_user(
+            username="router_other", email="router_other@example.com", password="pw"
+        )
+        request = self.factory.post("/api/v1/social/like/1/")
+        request.user = other
+        ReplicaPinningMiddleware(lambda r: HttpResponse(status=400))(request)
+        self.assertIsNone(cache.get(pin_cache_key(other.pk)))
+
+    def test_query_counters_per_alias(self):
+        before = query_counts().get("default", {}).get("queries", 0)
+        list(Post.objects.all())
+        self.assertEqual(query_counts()["default"]["queries"], before + 1)
+
+
+class CacheRouterTests(SimpleTestCase):
+    """Test the shared cache's database and the caches that use it"""
+
+    def test_cache_table_lives_on_its_own_database(self):
+        router = CacheRouter("cache")
+        cache_model = DatabaseCache("shared_cache", {}).cache_model_class
+        self.assertEqual(router.db_for_read(cache_model), "cache")
+        self.assertEqual(router.db_for_write(cache_model), "cache")
+        self.assertIsNone(router.db_for_read(Post))
+        self.assertTrue(router.allow_migrate("cache", "django_cache"))
+        self.assertFalse(router.allow_migrate("default", "django_cache"))
+        self.assertFalse(router.allow_migrate("cache", "posts"))
+        self.assertIsNone(router.allow_migrate("default", "posts"))
+
+    @override_settings(
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+            "shared": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        }
+    )
+    def test_workers_see_each_others_writes_without_local_ttl(self):
+        # two instances stand in for the same cache in two worker processes
+        one, other = (
+            TTLLRUCache("versions-test", backend="shared", local_ttl=0) for _ in range(2)
+        )
+        one.set("author:1", "a")
+        self.assertEqual(other.get("author:1"), "a")
+        other.set("author:1", "b")
+        self.assertEqual(one.get("author:1"), "b")
+
+
+class FakeShardResults:
+    """Stands in for an ordered shard queryset: count() and slicing"""
+
+    def __init__(self, items):
+        self.items = items
+        self.slices = []
+
+    def count(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __getitem__(self, index):
+        self.slices.append(index)
+        return self.items[index]
+
+
+@override_settings(POST_SHARDS=["shard0", "shard1", "shard2"])
+class ShardingTests(SimpleTestCase):
+    """Test shard placement, scatter-gather merging and shard routing"""
+
+    def test_shard_map_is_stable_and_moves_few_users_when_growing(self):
+        users = range(1, 2001)
+        placement = {user_id: sharding.shard_for_user(user_id) for user_id in users}
+        self.assertEqual(set(placement.values()), {"shard0", "shard1", "shard2"})
+        self.assertEqual(placement, {u: sharding.shard_for_user(u) for u in users})
+
+        with override_settings(POST_SHARDS=["shard0", "shard1", "shard2", "shard3"]):
+            moved = {
+                u: sharding.shard_for_user(u)
+                for u in users
+                if sharding.shard_for_user(u) != placement[u]
+            }
+        # only users taken over by the new shard move (~1/4), never between old ones
+        self.assertLess(len(moved), len(users) / 2)
+        self.assertEqual(set(moved.values()), {"shard3"})
+
+    def test_scatter_gather_merges_pages_in_order(self):
+        shards = [
+            FakeShardResults([(9, "a"), (6, "a"), (1, "a")]),
+            FakeShardResults([(8, "b"), (7, "b"), (2, "b")]),
+            FakeShardResults([(5, "c")]),
+        ]
+        merged = sharding.ScatterGatherList(shards, key=lambda row: row[0])
+
+        self.assertEqual(merged.count(), 7)
+        self.assertEqual([row[0] for row in merged[0:3]], [9, 8, 7])
+        self.assertEqual([row[0] for row in merged[3:6]], [6, 5, 2])
+        self.assertEqual(merged[6], (1, "a"))
+        # each shard is asked for at most `stop` rows
+        self.assertEqual(shards[0].slices[-1], slice(None, 7))
+
+    def test_single_shard_returns_queryset_unchanged(self):
+        queryset = Post.objects.all()
+        self.assertIs(sharding.scatter_gather({"shard0": queryset}), queryset)
+
+    def test_ids_are_unique_and_increasing(self):
+        generator = sharding.IdGenerator(worker_id=7)
+        ids = [generator.next_id() for _ in range(5000)]
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertEqual(ids, sorted(ids))
+
+    def test_worker_id_comes_from_settings(self):
+        generator = sharding.IdGenerator()
+        with override_settings(SHARD_WORKER_ID="5"):
+            self.assertEqual(generator.next_id() >> 12 & 1023, 5)
+        with override_settings(SHARD_WORKER_ID=None):
+            with self.assertRaises(ImproperlyConfigured):
+                generator.next_id()
+        with self.assertRaises(ImproperlyConfigured):
+            sharding.IdGenerator(worker_id=1024)
+
+    def test_router_places_posts_by_author_and_likes_with_post(self):
+        router = sharding.ShardRouter()
+        author = User(pk=42, username="author")
+        post = Post(user=author, caption="x", image_url="https://picsum.photos/1.jpg")
+        post_shard = sharding.shard_for_user(42)
+
+        self.assertEqual(router.db_for_write(Post, instance=post), post_shard)
+        like = Like(user=User(pk=7, username="fan"), post=post)
+        self.assertEqual(router.db_for_write(Like, instance=like), post_shard)
+        # reference data always goes to the primary
+        self.assertEqual(router.db_for_write(User, instance=author), "default")
+
+        post._state.adding = False
+        post._state.db = "shard0"
+        self.assertEqual(router.db_for_write(Post, instance=post), "shard0")
+        self.assertEqual(router.db_for_read(Like, instance=post), "shard0")
+
+
+@override_settings(
+    POST_SHARDS=["shard0", "shard1"], DATABASE_ROUTERS=["core.sharding.ShardRouter"]
+)
+class ShardedEndpointTests(TestCase):
+    """Counts and rankings over posts and likes read every shard"""
+
+    databases = {"default", "shard0", "shard1"}
+
+    def setUp(self):
+        users = [
+            User.objects.create_user(
+                username=f"sharded_{i}", email=f"sharded_{i}@example.com", password="pw"
+            )
+            for i in range(10)
+        ]
+        for user in users:
+            UserProfile.objects.create(user=user)
+        self.me = users[0]
+        self.author = next(
+            u for u in users if sharding.shard_for_user(u.pk) != sharding.shard_for_user(self.me.pk)
+        )
+        fan = next(u for u in users if u not in (self.me, self.author))
+
+        self.mine = [
+            Post.objects.create(user=self.me, caption=f"mine {i}", image_url="https://picsum.photos/1.jpg")
+            for i in range(2)
+        ]
+        self.theirs = [
+            Post.objects.create(user=self.author, caption=f"theirs {i}", image_url="https://picsum.photos/1.jpg")
+            for i in range(3)
+        ]
+        Like.objects.create(user=self.me, post=self.theirs[0])
+        Like.objects.create(user=fan, post=self.theirs[0])
+        Like.objects.create(user=self.author, post=self.mine[1])
+
+        token = Token.objects.create(user=self.me)
+        self.auth = {"HTTP_AUTHORIZATION": f"Token {token.key}"}
+
+    def get(self, url, asgi=False):
+        urlconf = "image_sharing_api.asgi_urls" if asgi else "image_sharing_api.urls"
+        with override_settings(ROOT_URLCONF=urlconf):
+            response = self.client.get(url, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_rows_are_spread_over_both_shards(self):
+        self.assertEqual(Post.objects.using(sharding.shard_for_user(self.me.pk)).count(), 2)
+        self.assertEqual(Post.objects.using(sharding.shard_for_user(self.author.pk)).count(), 3)
+
+    def test_post_stats(self):
+        stats = self.get("/api/v1/posts/stats/")
+        self.assertEqual(stats["total_posts"], 5)
+        self.assertEqual(stats["user_posts"], 2)
+        self.assertEqual(stats["most_liked_post"]["id"], self.theirs[0].pk)
+        self.assertEqual(stats["most_liked_post"]["total_likes"], 2)
+
+    def test_feed_stats(self):
+        stats = self.get("/api/v1/posts/feed-stats/")["feed_stats"]
+        self.assertEqual(stats["own_posts"], 2)
+        self.assertEqual(stats["timeline_posts"], 2)
+        self.assertEqual(stats["discover_posts"], 3)
+
+    def test_timeline_own_posts_count(self):
+        for asgi in (False, True):
+            meta = self.get("/api/v1/posts/timeline/", asgi=asgi)["timeline_meta"]
+            self.assertEqual(meta["own_posts_count"], 2)
+
+    def test_like_stats(self):
+        for asgi in (False, True):
+            stats = self.get("/api/v1/social/like-stats/", asgi=asgi)
+            self.assertEqual(stats["total_likes_given"], 1)
+            self.assertEqual(stats["total_likes_received"], 1)
+            self.assertEqual(stats["most_liked_post"]["id"], self.mine[1].pk)
+            self.assertEqual([like["post_id"] for like in stats["recent_likes"]], [self.theirs[0].pk])
+
+            stats = self.get(f"/api/v1/social/like-stats/{self.author.pk}/", asgi=asgi)
+            self.assertEqual(stats["total_likes_given"], 1)
+            self.assertEqual(stats["total_likes_received"], 2)
+
+    def test_trending_posts_merges_shards(self):
+        trending = self.get("/api/v1/social/trending/")
+        self.assertEqual([post["id"] for post in trending], [self.theirs[0].pk, self.mine[1].pk])
+        self.assertEqual(trending[0]["total_likes"], 2)
+        self.assertTrue(trending[0]["is_liked"])
+
+
+class LoadTestHelperTests(TestCase):
+    """Test the load benchmark's query counting and baseline comparison"""
+
+    def test_query_count_header(self):
+        def app(environ, start_response):
+            User.objects.count()
+            User.objects.exists()
+            start_response("200 OK", [])
+            return [b""]
+
+        captured = {}
+
+        def start_response(status, headers, exc_info=None):
+            captured.update(headers)
+
+        QueryCountingApp(app)({}, start_response)
+        self.assertEqual(captured[QUERY_COUNT_HEADER], "2")
+
+    def test_compare_to_baseline_flags_regressions(self):
+        baseline = {"posts:feed": {"p95_ms": 100.0, "rps": 50.0}}
+        current = {
+            "posts:feed": {"p95_ms": 125.0, "rps": 48.0},
+            "posts:popular-posts": {"p95_ms": 10.0, "rps": 5.0},
+        }
+        rows, regressions = compare_to_baseline(current, baseline, max_regression=10)
+        self.assertEqual(
+            rows,
+            [
+                ("posts:feed", "p95_ms", 100.0, 125.0, 25.0),
+                ("posts:feed", "rps", 50.0, 48.0, -4.0),
+            ],
+        )
+        self.assertEqual(regressions, [rows[0]])
+
+        _, regressions = compare_to_baseline(
+            current, baseline, max_regression=10, thresholds={"posts:feed": 30}
+        )
+        self.assertEqual(regressions, [])
+
+
+class PerformanceMiddlewareTests(TestCase):
+    """Test the per-request timings"""
+
+    def setUp(self):
+        user = User.objects.create_user(
+            username="perf", email="perf@example.com", password="testpass123"
+        )
+        Post.objects.create(user=user, caption="timed", image_url="https://picsum.photos/1.jpg")
+        self.auth = {"HTTP_AUTHORIZATION": f"Token {Token.objects.create(user=user).key}"}
+
+    def test_server_timing_and_log_line(self):
+        with self.assertLogs("core.performance", "INFO") as logs:
+            response = self.client.get("/api/v1/posts/my-posts/", **self.auth)
+
+        timing = response["Server-Timing"]
+        for name in ("db", "view", "serialize", "render", "total"):
+            self.assertIn(f"{name};dur=", timing)
+        record = logs.records[0].performance
+        self.assertEqual(record["route"], "posts:my-posts")
+        self.assertEqual(record["status"], 200)
+        self.assertGreater(record["db_queries"], 0)
+        self.assertEqual(record["bytes"], len(response.content))
+
+    @override_settings(PERFORMANCE_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_timed(self):
+        response = self.client.get("/api/v1/posts/my-posts/", **self.auth)
+        self.assertNotIn("Server-Timing", response)
+
+
+class MetricsRegistryTests(SimpleTestCase):
+    """Test metric storage and aggregation across worker files"""
+
+    def make_registry(self, directory, pid=None):
+        registry = Registry(directory)
+        registry.requests = registry.counter("requests_total", "Requests", ["route"])
+        registry.latency = registry.histogram(
+            "latency_seconds", "Latency", ["route"], buckets=(0.1, 1.0)
+        )
+        registry.busy = registry.gauge("busy", "Busy workers")
+        if pid is not None:
+            # pretend to be another worker writing its own file
+            registry._values = MmapValues(os.path.join(directory, f"metrics_{pid}.db"))
+            registry._pid = os.getpid()
+        return registry
+
+    def test_workers_are_aggregated_on_scrape(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            mine = self.make_registry(tmp)
+            # a pid that can't be running, so its gauges are dropped
+            other = self.make_registry(tmp, pid=2**22 + 1)
+            for registry in (mine, other):
+                registry.requests.inc(route="posts:feed")
+                registry.latency.observe(0.05, route="posts:feed")
+                registry.busy.set(1)
+            mine.latency.observe(0.5, route="posts:feed")
+            mine.latency.observe(3, route="posts:feed")
+
+            text = mine.exposition()
+
+        self.assertIn('requests_total{route="posts:feed"} 2', text)
+        self.assertIn('latency_seconds_bucket{route="posts:feed",le="0.1"} 2', text)
+        self.assertIn('latency_seconds_bucket{route="posts:feed",le="1"} 3', text)
+        self.assertIn('latency_seconds_bucket{route="posts:feed",le="+Inf"} 4', text)
+        self.assertIn('latency_seconds_count{route="posts:feed"} 4', text)
+        self.assertIn("busy 1", text)
+
+    def test_dead_workers_are_folded_into_the_archive(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            mine = self.make_registry(tmp)
+            dead = self.make_registry(tmp, pid=2**22 + 1)
+            dead.requests.inc(3, route="posts:feed")
+            dead.busy.set(1)
+            mine.requests.inc(route="posts:feed")
+
+            for _ in range(2):
+                text = mine.exposition()
+                self.assertIn('requests_total{route="posts:feed"} 4', text)
+            self.assertNotIn("busy 1", text)
+            self.assertEqual(
+                sorted(os.listdir(tmp)),
+                ["metrics.lock", f"metrics_{os.getpid()}.db", "metrics_archive.db"],
+            )
+
+    def test_reused_pid_starts_a_fresh_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            previous = self.make_registry(tmp)
+            previous.requests.inc(2, route="posts:feed")
+            previous.busy.set(1)
+            # a new process that got the same pid
+            current = self.make_registry(tmp)
+            current.requests.inc(route="posts:feed")
+
+            text = current.exposition()
+
+        self.assertIn('requests_total{route="posts:feed"} 3', text)
+        self.assertNotIn("busy 1", text)
+
+    def test_values_survive_reopening_the_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "metrics_1.db")
+            values = MmapValues(path, initial_size=64)
+            for i in range(50):
+                values.inc(f"key-{i}", i)
+            values.inc("key-3", 1)
+            self.assertEqual(dict(MmapValues(path).items())["key-3"], 4)
+            self.assertEqual(len(MmapValues(path).items()), 50)
+
+
+class MetricsEndpointTests(TestCase):
+    """Test the admin metrics endpoint"""
+
+    def test_admin_scrape_includes_request_metrics(self):
+        admin = User.objects.create_superuser(
+            username="metrics_admin", email="metrics@example.com", password="testpass123"
+        )
+        auth = {"HTTP_AUTHORIZATION": f"Token {Token.objects.create(user=admin).key}"}
+        self.client.get("/api/v1/posts/feed/", **auth)
+
+        response = self.client.get("/api/v1/core/metrics/", **auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        text = response.content.decode()
+        self.assertIn('http_requests_total{route="posts:feed",method="GET",status="200"}', text)
+        self.assertIn(
+            'http_request_duration_seconds_bucket{route="posts:feed",method="GET",le="+Inf"}',
+            text,
+        )
+        self.assertIn('cache_hit_ratio{cache="auth-token"}', text)
+
+    def test_requires_admin(self):
+        user = User.objects.create_user(
+            username="metrics_user", email="metrics_user@example.com", password="testpass123"
+        )
+        token = Token.objects.create(user=user)
+        response = self.client.get(
+            "/api/v1/core/metrics/", HTTP_AUTHORIZATION=f"Token {token.key}"
+        )
+        self.assertEqual(response.status_code, 403)
+
+
+class SlowQueryLogTests(TestCase):
+    """Test slow statement capture and the summary command"""
+
+    def test_slow_statements_are_logged_with_plan_and_call_site(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "slow.jsonl")
+            with override_settings(SLOW_QUERY_LOG={"PATH": path, "THRESHOLD_MS": 0}):
+                for _ in range(3):
+                    list(Post.all_objects.filter(caption__contains="slow").order_by())
+                slow_query_log.flush()
+
+                out = StringIO()
+                call_command("slow_queries", json=True, stdout=out)
+
+            with open(path) as f:
+                lines = [json.loads(line) for line in f]
+
+        entry = next(line for line in lines if "LIKE" in line["sql"])
+        self.assertEqual(entry["count"], 3)
+        self.assertNotIn("params", entry)
+        self.assertTrue(entry["stack"][0].startswith("core/tests.py:"))
+        self.assertTrue(entry["plan"])
+
+        summary = next(row for row in json.loads(out.getvalue()) if "LIKE" in row["sql"])
+        self.assertEqual(summary["full_scans"], ["posts_post"])
+
+    def test_params_only_with_log_params(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "slow.jsonl")
+            options = {"PATH": path, "THRESHOLD_MS": 0, "LOG_PARAMS": True}
+            with override_settings(SLOW_QUERY_LOG=options):
+                list(Post.all_objects.filter(caption__contains="secret").order_by())
+                slow_query_log.flush()
+            with open(path) as f:
+                entry = next(e for e in map(json.loads, f) if "LIKE" in e["sql"])
+        self.assertEqual(entry["params"], ["%secret%"])
+
+    def test_rotation_keeps_backups(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "slow.jsonl")
+            for i in range(3):
+                append_lines(path, [json.dumps({"n": i})], max_bytes=10, backup_count=1)
+            with open(path) as f:
+                self.assertEqual(f.read(), '{"n": 2}\n')
+            with open(f"{path}.1") as f:
+                self.assertEqual(f.read(), '{"n": 1}\n')
+            self.assertFalse(os.path.exists(f"{path}.2"))
+
+    def test_fast_statements_are_ignored(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "slow.jsonl")
+            with override_settings(SLOW_QUERY_LOG={"PATH": path, "THRESHOLD_MS": 10_000}):
+                Post.objects.count()
+                slow_query_log.flush()
+            self.assertFalse(os.path.exists(path))
+
+
+class ProfilingMiddlewareTests(TestCase):
+    """Test header-triggered profiling and the admin profile endpoints"""
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            username="profiler", email="profiler@example.com", password="testpass123"
+        )
+        self.auth = {"HTTP_AUTHORIZATION": f"Token {Token.objects.create(user=self.admin).key}"}
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.settings_override = override_settings(
+            PROFILING={"ENABLED": True, "TOKEN": "s3cret", "DIR": tmp.name, "KEEP": 2}
+        )
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def test_trusted_header_profiles_the_request(self):
+        response = self.client.get("/api/v1/posts/feed/", HTTP_X_PROFILE="s3cret", **self.auth)
+        profile_id = response["X-Profile-Id"]
+
+        listing = self.client.get("/api/v1/core/profiles/", **self.auth).json()
+        self.assertEqual([row["id"] for row in listing], [profile_id])
+        self.assertEqual(listing[0]["route"], "posts:feed")
+
+        detail = self.client.get(f"/api/v1/core/profiles/{profile_id}/", **self.auth).json()
+        self.assertTrue(detail["top_functions"])
+        self.assertIn("top_allocations", detail)
+
+        download = self.client.get(f"/api/v1/core/profiles/{profile_id}/download/", **self.auth)
+        self.assertEqual(download.status_code, 200)
+        self.assertTrue(b"".join(download.streaming_content))
+
+    def test_wrong_or_missing_header_is_not_profiled(self):
+        response = self.client.get("/api/v1/posts/feed/", HTTP_X_PROFILE="guess", **self.auth)
+        self.assertNotIn("X-Profile-Id", response)
+        response = self.client.get("/api/v1/posts/feed/", **self.auth)
+        self.assertNotIn("X-Profile-Id", response)
+        self.assertEqual(self.client.get("/api/v1/core/profiles/", **self.auth).json(), [])
+
+    def test_only_the_newest_profiles_are_kept(self):
+        ids = [
+            self.client.get("/api/v1/posts/feed/", HTTP_X_PROFILE="s3cret", **self.auth)[
+                "X-Profile-Id"
+            ]
+            for _ in range(3)
+        ]
+        listing = self.client.get("/api/v1/core/profiles/", **self.auth).json()
+        self.assertEqual(len(listing), 2)
+        self.assertNotIn(min(ids), [row["id"] for row in listing])
+
+
+class KeysetPaginationTests(TestCase):
+    """Test cursor pages over querysets and shard merges"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="pager", email="pager@example.com", password="testpass123"
+        )
+        self.fan = User.objects.create_user(
+            username="fan", email="fan@example.com", password="testpass123"
+        )
+        self.posts = [
+            Post.objects.create(
+                user=self.user, caption=f"page {i}", image_url="https://picsum.photos/1.jpg"
+            )
+            for i in range(5)
+        ]
+        # ties on created_at are broken by id
+        Post.objects.filter(pk__in=[p.pk for p in self.posts[1:4]]).update(
+            created_at=self.posts[1].created_at
+        )
+        self.auth = {"HTTP_AUTHORIZATION": f"Token {Token.objects.create(user=self.fan).key}"}
+
+    def walk(self, url):
+        ids, pages = [], 0
+        while url:
+            response = self.client.get(url, **self.auth)
+            self.assertEqual(response.status_code, 200)
+            ids += [row["id"] for row in response.json()["results"]]
+            url = response.json()["next"]
+            pages += 1
+        return ids, pages
+
+    def test_pages_cover_every_row_once(self):
+        self.auth = {"HTTP_AUTHORIZATION": f"Token {Token.objects.create(user=self.user).key}"}
+        ids, pages = self.walk("/api/v1/posts/my-posts/?page_size=2")
+        expected = Post.objects.filter(user=self.user).order_by("-created_at", "-id")
+        self.assertEqual(ids, [p.pk for p in expected])
+        self.assertEqual(pages, 3)
+
+    def test_shard_pages_are_merged(self):
+        even = Post.objects.filter(caption__in=["page 0", "page 2", "page 4"])
+        odd = Post.objects.filter(caption__in=["page 1", "page 3"])
+        merged = sharding.ScatterGatherList([even, odd], key=sharding.recency_key)
+        paginator = KeysetPagination()
+        request = RequestFactory().get("/", {"page_size": 3})
+
+        first = paginator.paginate_queryset(merged, request)
+        cursor = paginator.next_cursor
+        second = paginator.paginate_queryset(
+            merged, RequestFactory().get("/", {"page_size": 3, "cursor": cursor})
+        )
+        expected = Post.objects.order_by("-created_at", "-id")
+        self.assertEqual([p.pk for p in first + second], [p.pk for p in expected])
+        self.assertIsNone(paginator.next_cursor)
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get("/api/v1/social/my-likes/?cursor=nope", **self.auth)
+        self.assertEqual(response.status_code, 404)
+
+    def test_likers_skip_the_post_join(self):
+        post = self.posts[0]
+        Like.objects.create(user=self.fan, post=post)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"/api/v1/social/posts/{post.pk}/likes/", **self.auth)
+        self.assertEqual(response.json()["results"][0]["user"]["username"], "fan")
+        likes_sql = [q["sql"] for q in queries if 'FROM "social_like"' in q["sql"]]
+        self.assertEqual(len(likes_sql), 1)
+        self.assertNotIn("posts_post", likes_sql[0])
+        self.assertNotIn("password", likes_sql[0])
+
+
+class PurgeTests(TestCase):
+    """Test soft deletion and the batched purge"""
+
+    def setUp(self):
+        def make_user(name):
+            return User.objects.create_user(
+                username=name, email=f"{name}@example.com", password="testpass123"
+            )
+
+        self.user = make_user("leaving")
+        self.fans = [make_user(f"fan{i}") for i in range(4)]
+        self.posts = [
+            Post.objects.create(
+                user=self.user, caption=f"bye {i}", image_url="https://picsum.photos/1.jpg"
+            )
+            for i in range(3)
+        ]
+        other_post = Post.objects.create(
+            user=self.fans[0], caption="stays", image_url="https://picsum.photos/2.jpg"
+        )
+        for fan in self.fans:
+            Follow.objects.create(follower=fan, following=self.user)
+            Like.objects.create(user=fan, post=self.posts[0])
+        Follow.objects.create(follower=self.user, following=self.fans[0])
+        Like.objects.create(user=self.user, post=other_post)
+        self.token = Token.objects.create(user=self.user)
+
+    def test_account_deletion_hides_everything_at_once(self):
+        response = self.client.delete(
+            "/api/v1/users/me/", HTTP_AUTHORIZATION=f"Token {self.token.key}"
+        )
+        self.assertEqual(response.status_code, 202)
+        job = PurgeJob.objects.get(pk=response.json()["purge_job"])
+        self.assertEqual((job.kind, job.object_id), (PurgeJob.USER, self.user.pk))
+
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertFalse(Token.objects.filter(user=self.user).exists())
+        self.assertFalse(Post.objects.filter(user=self.user).exists())
+        self.assertEqual(Post.all_objects.filter(user=self.user).count(), 3)
+        self.assertFalse(Follow.objects.followers_of(self.fans[0]).exists())
+        # nothing is purged until the worker runs
+        self.assertEqual(Like.objects.filter(post=self.posts[0]).count(), 4)
+
+    def test_interrupted_purge_resumes_where_it_stopped(self):
+        job = purge.soft_delete_user(self.user)
+        claimed = purge.claim_next()
+        self.assertEqual(claimed.pk, job.pk)
+
+        # the deadline has passed, so it stops after one batch
+        self.assertFalse(purge.run_job(claimed, deadline=0, batch_size=2, pause=0))
+        claimed.refresh_from_db()
+        self.assertEqual(claimed.stage, "likes_given")
+        self.assertEqual(claimed.deleted_rows, 1)
+
+        # a crashed worker's claim is taken over once the lease runs out
+        PurgeJob.objects.filter(pk=job.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(purge.run_pending(batch_size=2, pause=0), 1)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, PurgeJob.DONE)
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(job.progress["likes_received"], 4)
+        self.assertEqual(job.progress["followers"], 4)
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(Post.all_objects.filter(user_id=self.user.pk).exists())
+        self.assertEqual(Like.objects.count(), 0)
+        self.assertEqual(Follow.objects.count(), 0)
+        self.assertEqual(User.objects.count(), 4)
+
+    def test_post_deletion_is_purged_in_the_background(self):
+        post = self.posts[0]
+        response = self.client.delete(
+            f"/api/v1/posts/{post.pk}/", HTTP_AUTHORIZATION=f"Token {self.token.key}"
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(Post.objects.filter(pk=post.pk).exists())
+
+        out = StringIO()
+        call_command("purge_deleted", pause=0, stdout=out)
+        self.assertIn("1 purge job(s) finished", out.getvalue())
+        self.assertFalse(Post.all_objects.filter(pk=post.pk).exists())
+        self.assertFalse(Like.objects.filter(post_id=post.pk).exists())
+        self.assertEqual(Post.objects.filter(user=self.user).count(), 2)
+
+    def test_purged_follows_update_the_other_side_counters(self):
+        fan = self.fans[0]
+        for user in (self.user, fan):
+            UserProfile.objects.create(user=user)
+        Follow.objects.all().delete()
+        Follow.objects.follow_user(fan, self.user)
+        Follow.objects.follow_user(self.user, fan)
+        tasks.run_pending(threads=0)
+        fan.profile.refresh_from_db()
+        self.assertEqual((fan.profile.followers_count, fan.profile.following_count), (1, 1))
+
+        purge.soft_delete_user(self.user)
+        purge.run_pending(pause=0)
+        tasks.run_pending(threads=0)
+        fan.profile.refresh_from_db()
+        self.assertEqual((fan.profile.followers_count, fan.profile.following_count), (0, 0))
+
+    def test_recount_profiles_repairs_stale_counters(self):
+        fan = self.fans[0]
+        UserProfile.objects.create(user=self.user, followers_count=9, posts_count=0)
+        UserProfile.objects.create(user=fan)
+
+        out = StringIO()
+        call_command("recount_profiles", stdout=out)
+        self.assertIn("2 of 2 profile(s) corrected", out.getvalue())
+        self.user.profile.refresh_from_db()
+        fan.profile.refresh_from_db()
+        self.assertEqual(
+            (self.user.profile.followers_count, self.user.profile.following_count), (4, 1)
+        )
+        self.assertEqual(self.user.profile.posts_count, 3)
+        self.assertEqual((fan.profile.followers_count, fan.profile.posts_count), (1, 1))
+
+    def test_live_targets_are_never_purged(self):
+        job = PurgeJob.objects.enqueue(PurgeJob.USER, self.user.pk)
+        purge.run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.status, PurgeJob.FAILED)
+        self.assertTrue(User.objects.filter(pk=self.user.pk).exists())
+
+
+class TaskQueueTests(TestCase):
+    """Test the outbox task queue and the counters it maintains"""
+
+    def setUp(self):
+        self.alice = User.objects.create_user(
+            username="alice", email="alice@example.com", password="testpass123"
+        )
+        self.bob = User.objects.create_user(
+            username="bob", email="bob@example.com", password="testpass123"
+        )
+        for user in (self.alice, self.bob):
+            UserProfile.objects.create(user=user)
+        self.calls = []
+
+    def flaky(self, fail_times=0):
+        self.calls.append(fail_times)
+        if len(self.calls) <= fail_times:
+            raise RuntimeError("try again")
+
+    def test_task_is_written_with_the_triggering_change(self):
+        try:
+            with transaction.atomic():
+                Follow.objects.follow_user(self.alice, self.bob)
+                raise RuntimeError("request failed")
+        except RuntimeError:
+            pass
+        self.assertFalse(Task.objects.exists())
+
+        Follow.objects.follow_user(self.alice, self.bob)
+        self.assertEqual(
+            set(Task.objects.values_list("name", flat=True)),
+            {"users.adjust_follow_counts", "social.aggregate_follows"},
+        )
+
+    def test_follow_counters_are_updated_by_the_worker(self):
+        Follow.objects.follow_user(self.alice, self.bob)
+        self.assertEqual(self.bob.profile.followers_count, 0)
+
+        out = StringIO()
+        call_command("run_tasks", threads=0, stdout=out)
+        self.assertIn("1 task(s) done, 0 failed", out.getvalue())
+        self.alice.profile.refresh_from_db()
+        self.bob.profile.refresh_from_db()
+        self.assertEqual(self.alice.profile.following_count, 1)
+        self.assertEqual(self.bob.profile.followers_count, 1)
+
+        Follow.objects.unfollow_user(self.alice, self.bob)
+        tasks.run_pending(threads=0)
+        self.bob.profile.refresh_from_db()
+        self.assertEqual(self.bob.profile.followers_count, 0)
+
+    def test_posts_count_follows_creates_and_deletes(self):
+        token = Token.objects.create(user=self.alice)
+        for i in range(2):
+            response = self.client.post(
+                "/api/v1/posts/",
+                {"caption": f"post {i}", "image_url": "https://picsum.photos/1.jpg"},
+                HTTP_AUTHORIZATION=f"Token {token.key}",
+            )
+            self.assertEqual(response.status_code, 201)
+        purge.soft_delete_post(Post.objects.filter(user=self.alice).first())
+
+        self.assertEqual(tasks.run_pending(threads=0), (3, 0))
+        self.alice.profile.refresh_from_db()
+        self.assertEqual(self.alice.profile.posts_count, 1)
+
+    def test_idempotency_key_enqueues_once(self):
+        with mock.patch.dict(tasks._registry, {"tests.flaky": self.flaky}):
+            self.assertIsNotNone(tasks.enqueue("tests.flaky", key="once"))
+            self.assertIsNone(tasks.enqueue("tests.flaky", key="once"))
+            self.assertEqual(tasks.run_pending(threads=0), (1, 0))
+            # still kept after running, so the key still holds
+            self.assertIsNone(tasks.enqueue("tests.flaky", key="once"))
+        self.assertEqual(len(self.calls), 1)
+        with self.assertRaises(KeyError):
+            tasks.enqueue("tests.unknown")
+
+    def test_failures_back_off_then_give_up(self):
+        with mock.patch.dict(tasks._registry, {"tests.flaky": self.flaky}):
+            row = tasks.enqueue("tests.flaky", {"fail_times": 5}, max_attempts=2)
+            self.assertEqual(tasks.run_pending(threads=0), (0, 1))
+            row.refresh_from_db()
+            self.assertEqual((row.status, row.attempts), (Task.PENDING, 1))
+            self.assertIn("try again", row.last_error)
+            self.assertGreater(row.run_after, timezone.now())
+            # not due yet
+            self.assertEqual(tasks.run_pending(threads=0), (0, 0))
+
+            Task.objects.filter(pk=row.pk).update(run_after=timezone.now())
+            self.assertEqual(tasks.run_pending(threads=0), (0, 1))
+        row.refresh_from_db()
+        self.assertEqual((row.status, row.attempts), (Task.FAILED, 2))
+
+    def test_expired_claim_is_taken_over(self):
+        with mock.patch.dict(tasks._registry, {"tests.flaky": self.flaky}):
+            row = tasks.enqueue("tests.flaky")
+            self.assertEqual(len(tasks.claim("default", "crashed", 10)), 1)
+            self.assertEqual(tasks.claim("default", "other", 10), [])
+            self.assertEqual(tasks.run_pending(threads=0), (0, 0))
+
+            Task.objects.filter(pk=row.pk).update(locked_until=timezone.now() - timedelta(1))
+            self.assertEqual(tasks.run_pending(threads=0), (1, 0))
+        row.refresh_from_db()
+        self.assertEqual((row.status, row.attempts), (Task.DONE, 2))
+        self.assertNotEqual(row.claimed_by, "crashed")
+
+        Task.objects.filter(pk=row.pk).update(finished_at=timezone.now() - timedelta(days=30))
+        self.assertEqual(tasks.prune(), 1)
+
+
+class GenerateDatasetTests(TestCase):
+    """Test the bulk synthetic data generator"""
+
+    def generate(self, seed):
+        call_command(
+            "generate_dataset",
+            users=40,
+            posts=120,
+            follows=300,
+            likes=400,
+            chunk_size=32,
+            seed=seed,
+            stdout=StringIO(),
+        )
+
+    def snapshot(self):
+        return (
+            list(Post.objects.order_by("pk").values_list("user_id", "created_at")),
+            list(Follow.objects.order_by("pk").values_list("follower_id", "following_id")),
+            list(Like.objects.order_by("pk").values_list("user_id", "post_id")),
+        )
+
+    def test_generates_consistent_skewed_data(self):
+        self.generate(seed=3)
+        self.assertEqual(User.objects.count(), 40)
+        self.assertEqual(Post.objects.count(), 120)
+        self.assertTrue(0 < Follow.objects.count() <= 300)
+        self.assertTrue(0 < Like.objects.count() <= 400)
+        self.assertFalse(Like.objects.filter(user=F("post__user")).exists())
+        self.assertFalse(Like.objects.filter(created_at__lt=F("post__created_at")).exists())
+
+        # power law: the most followed user has far more than the average
+        top = Follow.objects.values("following").annotate(n=Count("pk")).order_by("-n")
+        self.assertGreater(top[0]["n"], 3 * Follow.objects.count() / 40)
+
+        profile = User.objects.get(pk=top[0]["following"]).profile
+        self.assertEqual(profile.followers_count, top[0]["n"])
+
+    def test_same_seed_same_dataset(self):
+        self.generate(seed=11)
+        first = self.snapshot()
+        Like.objects.all().delete()
+        Follow.objects.all().delete()
+        Post.objects.all().delete()
+        User.objects.all().delete()
+        self.generate(seed=11)
+        second = self.snapshot()
+        self.assertEqual([row[0] for row in first[0]], [row[0] for row in second[0]])
+        self.assertEqual(first[1], second[1])
+        self.assertEqual(first[2], second[2])
+
+
+class BenchOrmTests(TestCase):
+    """Test the ORM micro-benchmark command end to end on a tiny dataset"""
+
+    def test_current_db_results_and_baseline(self):
+        call_command(
+            "generate_dataset", users=40, posts=120, follows=300, likes=400, stdout=StringIO()
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, "orm.json")
+            call_command(
+                "bench_orm", current_db=True, repeat=2, output=output, stdout=StringIO()
+            )
+            with open(output) as f:
+                results = json.load(f)["results"]["current"]
+            self.assertEqual(results["dataset"]["users"], 40)
+            self.assertIn("posts.feed_for_user", results["benchmarks"])
+            self.assertEqual(results["benchmarks"]["likes.is_liked_by"]["queries"], 1)
+            # write benchmarks roll back
+            self.assertEqual(Like.objects.count(), results["dataset"]["likes"])
+
+            # everything ten times slower than the baseline is a regression
+            for row in results["benchmarks"].values():
+                row["p50_ms"] /= 10
+            with open(output, "w") as f:
+                json.dump({"results": {"current": results}}, f)
+            with self.assertRaises(CommandError):
+                call_command(
+                    "bench_orm", current_db=True, repeat=2, baseline=output, stdout=StringIO()
+                )
@@ -1,4 +1,5 @@
 from django.urls import path, include
+from . import views
 
 app_name = 'core'
 
@@ -6,4 +7,11 @@ urlpatterns = [
     path('users/', include('users.urls')),
     path('posts/', include('posts.urls')),
     path('social/', include('social.urls')),
+
+    # Operations
+    path('core/db-stats/', views.db_stats, name='db-stats'),
+    path('core/metrics/', views.metrics, name='metrics'),
+    path('core/profiles/', views.profiles, name='profiles'),
+    path('core/profiles/<str:profile_id>/', views.profile_detail, name='profile-detail'),
+    path('core/profiles/<str:profile_id>/download/', views.profile_download, name='profile-download'),
 ]
@@ -1,3 +1,101 @@
-from django.shortcuts import render
+from django.conf import settings
+from django.http import FileResponse, Http404
+from rest_framework import permissions
+from rest_framework.decorators import api_view, permission_classes, renderer_classes
+from rest_framework.renderers import BaseRenderer
+from rest_framework.response import Response
 
-# Create your views here.
+from . import metrics as metrics_registry
+from . import profiling
+from .db import query_counts
+
+
+class PrometheusRenderer(BaseRenderer):
+    media_type = "text/plain"
+    format = "txt"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not isinstance(data, str):
+            data = f"{data}\n"
+        return data.encode(self.charset)
+
+
+@api_view(["GET"])
+@permission_classes([permissions.IsAdminUser])
+def db_stats(request):
+    """
+    Per-alias query counters for this process
+    """
+    return Response(
+        {
+            "aliases": query_counts(),
+            "replicas": getattr(settings, "DATABASE_REPLICAS", []),
+            "replica_pin_seconds": getattr(settings, "REPLICA_PIN_SECONDS", 0),
+        }
+    )
+
+
+@api_view(["GET"])
+@permission_classes([permissions.IsAdminUser])
+@renderer_classes([PrometheusRenderer])
+def metrics(request):
+    """
+    Metrics of every worker in the Prometheus text format
+    """
+    response = Response(metrics_registry.registry.exposition())
+    response["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    return response
+
+
+PROFILE_LIST_FIELDS = (
+    "id",
+    "created_at",
+    "trigger",
+    "method",
+    "path",
+    "route",
+    "status",
+    "duration_ms",
+    "peak_memory_kb",
+)
+
+
+@api_view(["GET"])
+@permission_classes([permissions.IsAdminUser])
+def profiles(request):
+    """
+    Saved request profiles, newest first
+    """
+    summaries = (profiling.load_summary(profile_id) for profile_id in profiling.profile_ids())
+    return Response(
+        [
+            {field: summary.get(field) for field in PROFILE_LIST_FIELDS}
+            for summary in summaries
+            if summary is not None
+        ]
+    )
+
+
+@api_view(["GET"])
+@permission_classes([permissions.IsAdminUser])
+def profile_detail(request, profile_id):
+    """
+    Summary of one profile: slowest functions and top allocation sites
+    """
+    summary = profiling.load_summary(profile_id)
+    if summary is None:
+        raise Http404("No such profile")
+    return Response(summary)
+
+
+@api_view(["GET"])
+@permission_classes([permissions.IsAdminUser])
+def profile_download(request, profile_id):
+    """
+    Raw pstats file of one profile
+    """
+    path = profiling.profile_path(profile_id, "prof")
+    if path is None:
+        raise Http404("No such profile")
+    return FileResponse(open(path, "rb"), as_attachment=True, filename=f"{profile_id}.prof")
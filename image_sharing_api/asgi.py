@@ -3,14 +3,21 @@ ASGI config for image_sharing_api project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Requests are resolved against ``ASGI_URLCONF`` so the native async views
+(login, register, ...) are served without a thread per request.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'image_sharing_api.settings.dev')
+
+django.setup(set_prefix=False)
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'image_sharing_api.settings')
+from core.handlers import AsyncViewsASGIHandler  # noqa: E402
 
-application = get_asgi_application()
+application = AsyncViewsASGIHandler()
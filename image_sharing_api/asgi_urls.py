@@ -0,0 +1,16 @@
+"""
+URLconf used by the ASGI application.
+
+The native async views are mounted on the same paths as their sync
+counterparts and take precedence; everything else falls through to the
+regular URLconf.
+"""
+from django.urls import include, path
+
+from .urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = [
+    path('api/v1/users/', include('users.async_urls')),
+    path('api/v1/posts/', include('posts.async_urls')),
+    path('api/v1/social/', include('social.async_urls')),
+] + sync_urlpatterns
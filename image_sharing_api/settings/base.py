@@ -31,6 +31,9 @@ LOCAL_APPS = [
 INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APPS + LOCAL_APPS
 
 MIDDLEWARE = [
+    "core.middleware.MetricsMiddleware",
+    "core.middleware.PerformanceMiddleware",
+    "core.middleware.ProfilingMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -60,6 +63,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "image_sharing_api.wsgi.application"
+ASGI_URLCONF = "image_sharing_api.asgi_urls"
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
@@ -67,6 +71,130 @@ DATABASES = {
     }
 }
 
+# Read replica aliases used by core.routers.ReplicaRouter (see
+# settings/replicas.py); users who just wrote read from the primary for
+# REPLICA_PIN_SECONDS.
+DATABASE_REPLICAS = []
+REPLICA_PIN_SECONDS = 5
+
+# Database aliases holding posts and likes, keyed by author id (see
+# core.sharding and settings/sharded.py). Empty means no sharding.
+POST_SHARDS = []
+
+# Worker id (0-1023) core.sharding.IdGenerator puts into sharded row ids.
+# Required when POST_SHARDS is set, and every process writing posts or
+# likes (web workers, task runners, commands) needs its own.
+SHARD_WORKER_ID = os.environ.get("DJANGO_SHARD_WORKER_ID")
+
+# PRAGMAs applied to every new SQLite connection (see core.db); the
+# production profile enables WAL and friends.
+SQLITE_PRAGMAS = {}
+
+# Backoff for write paths wrapped in core.db.retry_on_lock
+SQLITE_WRITE_RETRY = {
+    "ATTEMPTS": 5,
+    "BASE_DELAY": 0.01,
+    "MAX_DELAY": 0.5,
+}
+
+# Share of requests timed by core.middleware.PerformanceMiddleware (0 turns
+# it off) and whether the timings are returned in a Server-Timing header.
+PERFORMANCE_SAMPLE_RATE = 1.0
+PERFORMANCE_SERVER_TIMING = True
+
+# Directory for the per-worker files of core.metrics, so /core/metrics/
+# reports every worker. None keeps metrics in memory, per process.
+METRICS_DIR = None
+
+# core.slow_queries: statements slower than THRESHOLD_MS (a SAMPLE_RATE share
+# of them) are written with their query plan to the rotating JSONL file at
+# PATH, one line per distinct statement and call site every FLUSH_SECONDS.
+# PATH None turns the log off. Parameters can carry token keys and other
+# secrets, so they are left out unless LOG_PARAMS is on.
+SLOW_QUERY_LOG = {
+    "PATH": None,
+    "THRESHOLD_MS": 100,
+    "SAMPLE_RATE": 1.0,
+    "MAX_BYTES": 10 * 1024 * 1024,
+    "BACKUP_COUNT": 5,
+    "FLUSH_SECONDS": 30,
+    "LOG_PARAMS": False,
+}
+
+# core.middleware.ProfilingMiddleware: with ENABLED on, requests sending
+# HEADER set to TOKEN (and a SAMPLE_RATE share of all requests) run under
+# cProfile and tracemalloc. The newest KEEP profiles are kept in DIR
+# (default BASE_DIR/var/profiles) and admins browse them at /core/profiles/.
+PROFILING = {
+    "ENABLED": False,
+    "HEADER": "X-Profile",
+    "TOKEN": "",
+    "SAMPLE_RATE": 0.0,
+    "DIR": None,
+    "KEEP": 200,
+}
+
+# core.purge: soft-deleted accounts and posts are removed by
+# `manage.py purge_deleted`, BATCH_SIZE rows per transaction with
+# PAUSE_SECONDS between batches. A job not updated for LEASE_SECONDS is
+# considered abandoned and resumed by the next worker.
+PURGE = {
+    "BATCH_SIZE": 500,
+    "PAUSE_SECONDS": 0.05,
+    "LEASE_SECONDS": 300,
+    "MAX_ATTEMPTS": 5,
+}
+
+# core.tasks: deferred side effects (profile counters) are queued in the
+# same transaction as the write and run by `manage.py run_tasks`, BATCH_SIZE
+# tasks per claim on THREADS threads. A failed task is retried with
+# exponential backoff (BACKOFF_BASE doubling up to BACKOFF_MAX seconds)
+# until MAX_ATTEMPTS; a claim older than LEASE_SECONDS is taken over.
+# Finished tasks are kept KEEP_DONE_SECONDS so idempotency keys hold.
+TASKS = {
+    "THREADS": 4,
+    "BATCH_SIZE": 50,
+    "LEASE_SECONDS": 60,
+    "MAX_ATTEMPTS": 5,
+    "BACKOFF_BASE": 1.0,
+    "BACKOFF_MAX": 300.0,
+    "KEEP_DONE_SECONDS": 7 * 24 * 3600,
+}
+
+# social.notifications: likes of a post (and new followers) within one
+# WINDOW_SECONDS window share a notification row, recounted at most once
+# per DEBOUNCE_SECONDS by a task. WINDOW_SECONDS should be a multiple of
+# DEBOUNCE_SECONDS.
+NOTIFICATIONS = {
+    "WINDOW_SECONDS": 3600,
+    "DEBOUNCE_SECONDS": 10,
+}
+
+# core.changes: post, like and follow writes are logged for delta sync
+# (GET /users/me/changes/), PAGE_SIZE entries per response per database.
+# `manage.py compact_changelog` drops entries older than RETENTION_SECONDS;
+# sync tokens older than that get a 410.
+CHANGELOG = {
+    "RETENTION_SECONDS": 30 * 24 * 3600,
+    "PAGE_SIZE": 500,
+}
+
+# core.events: server-sent event streams at /api/v1/social/events/ (ASGI
+# only). Streams get a comment every HEARTBEAT_SECONDS and are closed after
+# MAX_SECONDS (clients reconnect after RETRY_MS). At most MAX_CONNECTIONS
+# per process and MAX_PER_USER per account; each buffers QUEUE_SIZE events.
+# A slot is given back when the client disconnects, or after START_SECONDS
+# if the response is never sent.
+EVENTS = {
+    "HEARTBEAT_SECONDS": 15,
+    "MAX_SECONDS": 300,
+    "RETRY_MS": 3000,
+    "MAX_CONNECTIONS": 1000,
+    "MAX_PER_USER": 3,
+    "QUEUE_SIZE": 32,
+    "START_SECONDS": 10,
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         "NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator",
@@ -96,7 +224,7 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework.authentication.TokenAuthentication",
+        "users.authentication.CachedTokenAuthentication",
     ],
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
@@ -108,6 +236,45 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Token -> user/profile cache used by CachedTokenAuthentication. Set BACKEND
+# to a CACHES alias to share entries (and invalidations) between workers.
+AUTH_TOKEN_CACHE = {
+    "MAX_ENTRIES": 10000,
+    "TTL": 300,
+    "BACKEND": None,
+}
+
+# core.conditional: version tokens behind the feed and post list ETags.
+# Without a BACKEND every process keeps its own, so after a write another
+# process can keep answering 304 for up to TTL seconds; point BACKEND at a
+# shared CACHES alias when running several workers (settings/prod.py does).
+CONDITIONAL_GET = {
+    "MAX_ENTRIES": 100000,
+    "TTL": 60,
+    "BACKEND": None,
+}
+
+# core.objects: serialized posts and users by id for GET /posts/batch/ and
+# /users/batch/ (at most MAX_IDS ids each). Same BACKEND/TTL trade-off as
+# above: writes drop entries in their own process right away, in others
+# after TTL seconds unless BACKEND is shared.
+OBJECT_CACHE = {
+    "MAX_IDS": 100,
+    "MAX_ENTRIES": 10000,
+    "TTL": 30,
+    "BACKEND": None,
+}
+
+# Dedicated pool for PBKDF2 work in the async login/register views.
+# Requests beyond MAX_PENDING (running + queued) get a 429.
+PASSWORD_HASHING_WORKERS = 4
+PASSWORD_HASHING_MAX_PENDING = 32
+
+# Let the native async views run independent reads on separate connections
+# instead of queueing them on the thread-sensitive executor. Needs a
+# database that allows concurrent readers; keep it off inside tests.
+ASYNC_CONCURRENT_READS = False
+
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
     "http://127.0.0.1:3000",
@@ -0,0 +1,84 @@
+from .base import *
+
+DEBUG = False
+
+SECRET_KEY = os.environ.get("DJANGO_SECRET_KEY", SECRET_KEY)
+ALLOWED_HOSTS = [
+    host for host in os.environ.get("DJANGO_ALLOWED_HOSTS", "").split(",") if host
+]
+
+# Production SQLite profile: persistent connections and WAL so readers
+# never block the writer. busy_timeout makes writers wait for the lock
+# instead of failing straight away with "database is locked".
+DATABASES["default"].update(
+    {
+        "NAME": os.environ.get("DJANGO_SQLITE_PATH", DATABASES["default"]["NAME"]),
+        "CONN_MAX_AGE": 600,
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {"timeout": 5},
+    }
+)
+
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",  # safe with WAL, fsync only at checkpoints
+    "busy_timeout": 5000,  # ms
+    "cache_size": -64000,  # KiB, so ~64MB of page cache per connection
+    "mmap_size": 268435456,  # 256MB
+    "temp_store": "MEMORY",
+}
+
+# Files the running app writes (logs, dumps); var/ is ignored by git
+VAR_DIR = Path(os.environ.get("DJANGO_VAR_DIR", BASE_DIR / "var"))
+
+# Caches shared by every worker process (uvicorn --workers N): conditional
+# GET versions, cached objects and tokens. Without them each worker keeps
+# its own and can answer 304 or serve an object for up to TTL seconds after
+# a write in another one. They live in Django's database cache on a SQLite
+# file of their own; create its table once with
+# `python manage.py createcachetable --database cache`.
+CACHE_DATABASE = "cache"
+DATABASES[CACHE_DATABASE] = {
+    "ENGINE": "django.db.backends.sqlite3",
+    "NAME": os.environ.get("DJANGO_CACHE_SQLITE_PATH", BASE_DIR / "cache.sqlite3"),
+    "CONN_MAX_AGE": 600,
+    "CONN_HEALTH_CHECKS": True,
+    "OPTIONS": {"timeout": 5},
+}
+DATABASE_ROUTERS = ["core.routers.CacheRouter"]
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "shared": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "shared_cache",
+        "OPTIONS": {"MAX_ENTRIES": 500000, "CULL_FREQUENCY": 10},
+    },
+}
+# LOCAL_TTL 0: every lookup reads the shared table (one query per request),
+# so a write is seen by the next request whichever worker serves it
+CONDITIONAL_GET = {**CONDITIONAL_GET, "BACKEND": "shared", "LOCAL_TTL": 0}
+OBJECT_CACHE = {**OBJECT_CACHE, "BACKEND": "shared", "LOCAL_TTL": 0}
+AUTH_TOKEN_CACHE = {**AUTH_TOKEN_CACHE, "BACKEND": "shared", "LOCAL_TTL": 5}
+
+# WAL allows concurrent readers, so the async views can use them
+ASYNC_CONCURRENT_READS = True
+
+# Time one request in ten in detail; core.metrics still counts every request
+PERFORMANCE_SAMPLE_RATE = 0.1
+
+# Per-worker metric files; dead workers' files are folded into an archive
+# and removed by core.metrics, so nothing needs clearing on restart
+METRICS_DIR = os.environ.get("DJANGO_METRICS_DIR", VAR_DIR / "metrics")
+
+SLOW_QUERY_LOG = {
+    **SLOW_QUERY_LOG,
+    "PATH": os.environ.get("DJANGO_SLOW_QUERY_LOG", VAR_DIR / "slow_queries.jsonl"),
+}
+
+# Profiling is switched on by giving it a token
+PROFILING = {
+    **PROFILING,
+    "ENABLED": bool(os.environ.get("DJANGO_PROFILING_TOKEN")),
+    "TOKEN": os.environ.get("DJANGO_PROFILING_TOKEN", ""),
+    "DIR": os.environ.get("DJANGO_PROFILING_DIR", VAR_DIR / "profiles"),
+}
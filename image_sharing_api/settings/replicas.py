@@ -0,0 +1,16 @@
+from .dev import *
+
+# Local read-replica setup: extra SQLite files refreshed from the primary
+# with `python manage.py sync_replicas`. Pinning state lives in the default
+# cache, so use a shared cache when running more than one process.
+DATABASE_REPLICAS = ["replica1", "replica2"]
+
+for alias in DATABASE_REPLICAS:
+    DATABASES[alias] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / f"db.{alias}.sqlite3",
+        "TEST": {"MIRROR": "default"},
+    }
+
+DATABASE_ROUTERS = ["core.routers.ReplicaRouter"]
+MIDDLEWARE = MIDDLEWARE + ["core.middleware.ReplicaPinningMiddleware"]
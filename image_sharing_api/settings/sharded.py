@@ -0,0 +1,15 @@
+from .dev import *
+
+# Local sharding setup: posts and likes spread over several SQLite files,
+# users and profiles mirrored onto each. Create the schema on every shard
+# with `python manage.py migrate --database <alias>`, then place existing
+# rows with `python manage.py rebalance_shards`.
+POST_SHARDS = ["shard0", "shard1", "shard2"]
+
+for alias in POST_SHARDS:
+    DATABASES[alias] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / f"db.{alias}.sqlite3",
+    }
+
+DATABASE_ROUTERS = ["core.sharding.ShardRouter"]
@@ -0,0 +1,12 @@
+from .dev import *
+
+# Settings `manage.py test` runs with. The sharded tests in core/tests.py
+# switch POST_SHARDS on per test and need these aliases to exist when the
+# test databases are created.
+for alias in ("shard0", "shard1"):
+    DATABASES[alias] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / f"db.{alias}.sqlite3",
+    }
+
+SHARD_WORKER_ID = 0
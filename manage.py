@@ -6,7 +6,8 @@ import sys
 
 def main():
     """Run administrative tasks."""
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'image_sharing_api.settings.dev')
+    default = 'test' if sys.argv[1:2] == ['test'] else 'dev'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', f'image_sharing_api.settings.{default}')
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc:
@@ -0,0 +1,8 @@
+from django.urls import path
+from . import async_views
+
+urlpatterns = [
+    path('feed/', async_views.feed),
+    path('timeline/', async_views.timeline),
+    path('discover/', async_views.discover),
+]
@@ -0,0 +1,105 @@
+"""
+Native async variants of the feed endpoints, served under ASGI.
+
+Each view issues its independent queries concurrently (page, count and
+the meta counters) and returns the same payload as its sync counterpart
+in ``posts.views``.
+"""
+from core import conditional, sharding
+from core.asyncapi import async_api_view, db_read, json_response, paginate
+from social.models import Follow
+from .models import Post
+from .serializers import PostListSerializer
+from .views import followed_authors, list_validators
+
+
+def _serializer(request):
+    def serialize(posts):
+        return PostListSerializer(posts, many=True, context={"request": request}).data
+
+    return serialize
+
+
+def _excluded_user_ids(user):
+    following_ids = list(
+        Follow.objects.filter(follower=user).values_list("following_id", flat=True)
+    )
+    following_ids.append(user.id)
+    return following_ids
+
+
+def _feed_validators(request, include_own=False):
+    return list_validators(request, followed_authors(request.user, include_own))
+
+
+@async_api_view(["GET"])
+async def feed(request):
+    etag, _ = await db_read(_feed_validators, request)
+    return await conditional.aevaluate(request, etag, respond=lambda: _feed(request))
+
+
+async def _feed(request):
+    # resolves the followed ids up front when the feed is sharded
+    queryset = await db_read(Post.objects.feed_for_user, request.user)
+
+    page, (following_count,) = await paginate(
+        request,
+        queryset,
+        Follow.objects.filter(follower=request.user).count,
+    )
+    results = await db_read(_serializer(request), page.items)
+
+    response_data = page.response_data(results)
+    response_data["feed_meta"] = {
+        "following_count": following_count,
+        "has_posts": len(results) > 0,
+        "feed_type": "following_only",
+    }
+    return json_response(response_data)
+
+
+@async_api_view(["GET"])
+async def timeline(request):
+    etag, _ = await db_read(_feed_validators, request, True)
+    return await conditional.aevaluate(request, etag, respond=lambda: _timeline(request))
+
+
+async def _timeline(request):
+    queryset = await db_read(Post.objects.timeline_for_user, request.user)
+
+    page, (following_count, own_posts_count) = await paginate(
+        request,
+        queryset,
+        Follow.objects.filter(follower=request.user).count,
+        Post.objects.for_author(request.user.pk).filter(user=request.user).count,
+    )
+    results = await db_read(_serializer(request), page.items)
+
+    response_data = page.response_data(results)
+    response_data["timeline_meta"] = {
+        "following_count": following_count,
+        "own_posts_count": own_posts_count,
+        "has_posts": len(results) > 0,
+        "feed_type": "timeline",
+    }
+    return json_response(response_data)
+
+
+@async_api_view(["GET"])
+async def discover(request):
+    following_ids = await db_read(_excluded_user_ids, request.user)
+    queryset = sharding.gather(
+        Post.objects.for_viewer(request.user)
+        .exclude(user_id__in=following_ids)
+        .ordered_by_recent()
+    )
+
+    page, _ = await paginate(request, queryset)
+    results = await db_read(_serializer(request), page.items)
+
+    response_data = page.response_data(results)
+    response_data["discover_meta"] = {
+        "feed_type": "discover",
+        "description": "Posts from users you don't follow",
+    }
+    return json_response(response_data)
@@ -2,8 +2,12 @@ from django.db import models
 from django.contrib.auth import get_user_model
 from django.core.validators import URLValidator
 from django.core.exceptions import ValidationError
+from django.db.models.functions import Coalesce
 import re
 
+from core import sharding
+from users.models import list_columns
+
 User = get_user_model()
 
 
@@ -50,8 +54,43 @@ class PostQuerySet(models.QuerySet):
         return self.select_related("user", "user__profile")
 
     def with_like_counts(self):
-        """Annotate with like counts"""
-        return self.annotate(total_likes=models.Count("likes", distinct=True))
+        """
+        Annotate with like counts. A correlated count on the likes index
+        rather than a join + GROUP BY, so a LIMITed page only counts the
+        likes of the posts on it.
+        """
+        from social.models import Like
+
+        likes = (
+            Like.objects.filter(post=models.OuterRef("pk"))
+            .order_by()
+            .values("post")
+            .annotate(total=models.Count("pk"))
+            .values("total")
+        )
+        return self.annotate(
+            total_likes=Coalesce(models.Subquery(likes), 0)
+        )
+
+    def with_is_liked(self, user):
+        """Annotate whether ``user`` liked each post (one EXISTS per row)"""
+        from social.models import Like
+
+        if not user.is_authenticated:
+            return self.annotate(is_liked=models.Value(False))
+        return self.annotate(
+            is_liked=models.Exists(
+                Like.objects.filter(post=models.OuterRef("pk"), user=user)
+            )
+        )
+
+    def for_viewer(self, user):
+        """Everything a post list serializer reads, for ``user``"""
+        return self.with_user().with_like_counts().with_is_liked(user)
+
+    def with_list_columns(self):
+        """Only the post, author and profile columns PostListSerializer reads"""
+        return self.only("caption", "image_url", "created_at", *list_columns("user"))
 
     def ordered_by_recent(self):
         """Order by most recent first"""
@@ -61,12 +100,25 @@ class PostQuerySet(models.QuerySet):
         """Order by most liked first, then by recent"""
         return self.with_like_counts().order_by("-total_likes", "-created_at")
 
+    def create(self, **kwargs):
+        """Without an explicit alias, let the router pick the author's shard"""
+        if self._db is None and sharding.enabled():
+            post = self.model(**kwargs)
+            post.save(force_insert=True)
+            return post
+        return super().create(**kwargs)
+
 
 class PostManager(models.Manager):
-    """Custom manager for Post model"""
+    """Custom manager for Post model; hides soft-deleted posts"""
+
+    include_deleted = False
 
     def get_queryset(self):
-        return PostQuerySet(self.model, using=self._db)
+        queryset = PostQuerySet(self.model, using=self._db)
+        if self.include_deleted:
+            return queryset
+        return queryset.filter(deleted_at__isnull=True)
 
     def with_user(self):
         return self.get_queryset().with_user()
@@ -74,6 +126,12 @@ class PostManager(models.Manager):
     def with_like_counts(self):
         return self.get_queryset().with_like_counts()
 
+    def with_is_liked(self, user):
+        return self.get_queryset().with_is_liked(user)
+
+    def for_viewer(self, user):
+        return self.get_queryset().for_viewer(user)
+
     def recent(self):
         return self.get_queryset().with_user().ordered_by_recent()
 
@@ -89,13 +147,12 @@ class PostManager(models.Manager):
             "following_id", flat=True
         )
 
+        queryset = self.get_queryset().for_viewer(user)
+        if sharding.enabled():
+            return self.by_authors(list(following_ids), queryset)
+
         # Return posts from followed users, optimized but without annotation conflict
-        return (
-            self.get_queryset()
-            .with_user()
-            .filter(user_id__in=following_ids)
-            .ordered_by_recent()
-        )
+        return queryset.filter(user_id__in=following_ids).ordered_by_recent()
 
     def timeline_for_user(self, user):
         """Get the timeline for a user (their posts & posts from people they follow)"""
@@ -107,21 +164,69 @@ class PostManager(models.Manager):
         )
         following_ids.append(user.id)  # Remember the user's own posts!
 
+        queryset = self.get_queryset().for_viewer(user)
+        if sharding.enabled():
+            return self.by_authors(following_ids, queryset)
+
         # Get posts from followed users and the user, sorted by most recent.
-        return (
-            self.get_queryset()
-            .with_user()
-            .filter(user_id__in=following_ids)
-            .ordered_by_recent()
+        return queryset.filter(user_id__in=following_ids).ordered_by_recent()
+
+    def by_authors(self, user_ids, queryset=None):
+        """
+        Newest posts by ``user_ids``, queried only on the shards holding them
+        and merged by recency when they span several
+        """
+        if queryset is None:
+            queryset = self.get_queryset().with_user()
+        querysets = {
+            alias: queryset.using(alias)
+            .filter(user_id__in=ids)
+            .order_by("-created_at", "-id")
+            for alias, ids in sharding.group_by_shard(user_ids).items()
+        }
+        if not querysets:
+            return self.none()
+        return sharding.scatter_gather(querysets)
+
+    def ids_since(self, user_ids, since_id, limit):
+        """
+        Ids of up to ``limit`` live posts by ``user_ids`` newer than
+        ``since_id``, newest first. Ids grow with time (sharded ids are
+        time-ordered too), and the (user, deleted_at, id) index answers
+        this without reading the table.
+        """
+        ids = []
+        for alias, authors in sharding.group_by_shard(user_ids).items():
+            ids += (
+                sharding.using_shard(self.get_queryset(), alias)
+                .filter(user_id__in=authors, id__gt=since_id)
+                .order_by("-id")
+                .values_list("id", flat=True)[:limit]
+            )
+        return sorted(ids, reverse=True)[:limit]
+
+    def for_author(self, user_id):
+        """Posts by one author, read from that author's shard"""
+        return sharding.using_shard(
+            self.get_queryset(), sharding.shard_for_user(user_id)
         )
 
 
+class AllPostsManager(PostManager):
+    """Every post, soft-deleted ones included, for purges and rebalancing"""
+
+    include_deleted = True
+
+
 class Post(models.Model):
     """
     Post model representing an image post in the social media app
     """
 
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="posts")
+    # indexed by the (user, -created_at) composite below
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="posts", db_index=False
+    )
     caption = models.CharField(
         max_length=100, help_text="Caption for the image (max 100 characters)"
     )
@@ -130,17 +235,28 @@ class Post(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # set on deletion; the row and its likes go later, see core.purge
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
 
     # Use custom manager
     objects = PostManager()
+    all_objects = AllPostsManager()
 
     class Meta:
         ordering = ["-created_at"]
         indexes = [
-            models.Index(fields=["user"]),
-            models.Index(fields=["created_at"]),
-            models.Index(fields=["-created_at"]),  # For reverse ordering
-            models.Index(fields=["user", "-created_at"]),  # Composite index
+            # global recent lists and counts; SQLite walks it backwards for
+            # -created_at. Partial, so the deleted_at filter is implied
+            models.Index(
+                fields=["created_at"],
+                condition=models.Q(deleted_at__isnull=True),
+                name="post_live_created_idx",
+            ),
+            # feed/timeline (user_id IN ... ORDER BY created_at) and per-user lists
+            models.Index(fields=["user", "-created_at"]),
+            # "new posts since" probes, index-only. SQLite doesn't treat a
+            # partial index's condition column as covered, hence deleted_at
+            models.Index(fields=["user", "deleted_at", "id"], name="post_user_live_id_idx"),
         ]
 
     def __str__(self):
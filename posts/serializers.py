@@ -1,5 +1,7 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from core import changes, events, sharding, tasks
 from .models import Post
 from .validators import validate_caption_length, validate_image_url_format
 from users.serializers import UserListSerializer
@@ -30,6 +32,9 @@ class PostSerializer(serializers.ModelSerializer):
     
     def get_is_liked(self, obj):
         """Check if current user liked this post"""
+        if hasattr(obj, 'is_liked'):
+            # If annotated in queryset
+            return obj.is_liked
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             return obj.is_liked_by(request.user)
@@ -76,12 +81,28 @@ class PostListSerializer(serializers.ModelSerializer):
     
     def get_is_liked(self, obj):
         """Check if current user liked this post"""
+        if hasattr(obj, 'is_liked'):
+            # If annotated in queryset
+            return obj.is_liked
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             return obj.is_liked_by(request.user)
         return False
 
 
+class PostCacheSerializer(serializers.ModelSerializer):
+    """
+    The part of PostListSerializer that is the same for every viewer,
+    cached by id for the batch endpoint (see core.objects)
+    """
+    user_id = serializers.IntegerField(read_only=True)
+    total_likes = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Post
+        fields = ['id', 'user_id', 'caption', 'image_url', 'total_likes', 'created_at']
+
+
 class PostDetailSerializer(PostSerializer):
     """Detailed serializer for individual post views"""
     pass  # Same as PostSerializer for now, can be extended later
@@ -108,4 +129,10 @@ class PostCreateSerializer(serializers.ModelSerializer):
         """Create post with current user"""
         request = self.context.get('request')
         validated_data['user'] = request.user
-        return Post.objects.create(**validated_data)
+        alias = sharding.shard_for_user(request.user.pk)
+        with transaction.atomic(using=alias):
+            post = Post.objects.create(**validated_data)
+            tasks.enqueue('users.recount_posts', {'user_id': post.user_id}, using=alias)
+            changes.record_post(post)
+            transaction.on_commit(lambda: events.publish_new_post(post), using=alias)
+        return post
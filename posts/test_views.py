@@ -1,10 +1,13 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.urls import resolve
 from django.contrib.auth import get_user_model
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
 from rest_framework.authtoken.models import Token
+from core import objects
 from posts.models import Post
 import uuid
+from unittest import mock
 
 User = get_user_model()
 
@@ -86,7 +89,7 @@ class PostCRUDTests(APITestCase):
 from rest_framework.test import APITestCase
 from django.contrib.auth import get_user_model
 from .models import Post
-from social.models import Like
+from social.models import Follow, Like
 
 User = get_user_model()
 
@@ -113,3 +116,224 @@ class PopularPostsTests(APITestCase):
         ids = [post['id'] for post in data]
         like_map = {p['id']: p['total_likes'] for p in data}
         self.assertGreaterEqual(like_map[ids[0]], like_map[ids[-1]])
+
+
+class AsyncFeedTests(APITestCase):
+    """The async feed views return the same payloads as the sync ones"""
+
+    def setUp(self):
+        self.viewer = User.objects.create_user(username='viewer', email='viewer@example.com', password='pw')
+        author = User.objects.create_user(username='author', email='author@example.com', password='pw')
+        stranger = User.objects.create_user(username='stranger', email='stranger@example.com', password='pw')
+        Follow.objects.create(follower=self.viewer, following=author)
+        for user, caption in [(author, 'A1'), (author, 'A2'), (stranger, 'S1'), (self.viewer, 'V1')]:
+            post = Post.objects.create(user=user, caption=caption, image_url='https://example.com/image.jpg')
+        Like.objects.create(user=self.viewer, post=Post.objects.get(caption='A1'))
+        token = Token.objects.create(user=self.viewer)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def test_async_views_match_sync_views(self):
+        for url in ['/api/v1/posts/feed/', '/api/v1/posts/timeline/', '/api/v1/posts/discover/']:
+            expected = self.client.get(url).json()
+            with override_settings(ROOT_URLCONF='image_sharing_api.asgi_urls'):
+                self.assertEqual(resolve(url).func.__module__, 'posts.async_views')
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json(), expected)
+
+    def test_async_feeds_answer_conditional_gets(self):
+        with override_settings(ROOT_URLCONF='image_sharing_api.asgi_urls'):
+            for url in ['/api/v1/posts/feed/', '/api/v1/posts/timeline/']:
+                self.assertEqual(resolve(url).func.__module__, 'posts.async_views')
+                etag = self.client.get(url)['ETag']
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['ETag'], etag)
+
+            # the same validators as the sync views
+            sync_etag = self.client.get('/api/v1/posts/feed/')['ETag']
+        self.assertEqual(self.client.get('/api/v1/posts/feed/')['ETag'], sync_etag)
+
+    def test_async_view_requires_token(self):
+        self.client.credentials()
+        with override_settings(ROOT_URLCONF='image_sharing_api.asgi_urls'):
+            response = self.client.get('/api/v1/posts/feed/')
+        self.assertEqual(response.status_code, 401)
+
+
+class NewPostsProbeTests(APITestCase):
+    """Test the cheap "new posts since" probe"""
+
+    def setUp(self):
+        self.viewer = User.objects.create_user(username='viewer', email='viewer@example.com', password='pw')
+        self.author = User.objects.create_user(username='author', email='author@example.com', password='pw')
+        stranger = User.objects.create_user(username='stranger', email='stranger@example.com', password='pw')
+        Follow.objects.create(follower=self.viewer, following=self.author)
+        self.seen = Post.objects.create(user=self.author, caption='Seen', image_url='https://example.com/image.jpg')
+        self.new = [
+            Post.objects.create(user=user, caption='New', image_url='https://example.com/image.jpg')
+            for user in (self.author, self.author, stranger, self.viewer)
+        ]
+        token = Token.objects.create(user=self.viewer)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def test_counts_unseen_posts(self):
+        response = self.client.get(f'/api/v1/posts/feed/new/?since={self.seen.pk}')
+        self.assertEqual(response.json(), {'count': 2, 'more': False, 'newest_id': self.new[1].pk})
+
+        response = self.client.get(f'/api/v1/posts/timeline/new/?since={self.seen.pk}')
+        self.assertEqual(response.json()['count'], 3)
+        self.assertEqual(response.json()['newest_id'], self.new[3].pk)
+
+        # deleted posts don't count
+        self.new[1].deleted_at = self.new[1].created_at
+        self.new[1].save()
+        response = self.client.get(f'/api/v1/posts/feed/new/?since={self.new[1].pk}')
+        self.assertEqual(response.json(), {'count': 0, 'more': False, 'newest_id': None})
+
+    def test_count_is_capped(self):
+        with mock.patch('posts.views.NEW_POSTS_LIMIT', 2):
+            response = self.client.get('/api/v1/posts/timeline/new/')
+        self.assertEqual(response.json()['count'], 2)
+        self.assertTrue(response.json()['more'])
+
+    def test_since_must_be_an_id(self):
+        response = self.client.get('/api/v1/posts/feed/new/?since=yesterday')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ConditionalGetTests(APITestCase):
+    """Test 304 responses for post detail and the feeds"""
+
+    def setUp(self):
+        self.viewer = User.objects.create_user(username='viewer', email='viewer@example.com', password='pw')
+        self.author = User.objects.create_user(username='author', email='author@example.com', password='pw')
+        Follow.objects.create(follower=self.viewer, following=self.author)
+        self.post = Post.objects.create(user=self.author, caption='Hello', image_url='https://example.com/image.jpg')
+        token = Token.objects.create(user=self.viewer)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.author_client = APIClient()
+        token = Token.objects.create(user=self.author)
+        self.author_client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def test_post_detail_is_revalidated_until_liked(self):
+        url = f'/api/v1/posts/{self.post.pk}/'
+        etag = self.client.get(url)['ETag']
+
+        # the validator query only; the post and its likes aren't read
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertIn('private', response['Cache-Control'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/v1/social/like/{self.post.pk}/')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.json()['is_liked'])
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_post_detail_changes_with_the_post(self):
+        url = f'/api/v1/posts/{self.post.pk}/'
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author_client.patch(url, {'caption': 'Edited'})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['caption'], 'Edited')
+
+    def test_feed_is_revalidated_until_a_followed_author_posts(self):
+        etag = self.client.get('/api/v1/posts/feed/')['ETag']
+        response = self.client.get('/api/v1/posts/feed/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # another page is another ETag
+        response = self.client.get('/api/v1/posts/feed/?page=2', HTTP_IF_NONE_MATCH=etag)
+        self.assertNotEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author_client.post(
+                '/api/v1/posts/', {'caption': 'New', 'image_url': 'https://example.com/image.jpg'}
+            )
+        response = self.client.get('/api/v1/posts/feed/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['count'], 2)
+
+    def test_following_someone_changes_the_timeline(self):
+        other = User.objects.create_user(username='other', email='other@example.com', password='pw')
+        etag = self.client.get('/api/v1/posts/timeline/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/v1/social/follow/{other.pk}/')
+        response = self.client.get('/api/v1/posts/timeline/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_my_posts_not_modified(self):
+        etag = self.author_client.get('/api/v1/posts/my-posts/')['ETag']
+        response = self.author_client.get('/api/v1/posts/my-posts/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+class PostBatchTests(APITestCase):
+    """Test hydrating posts by id"""
+
+    def setUp(self):
+        objects.object_cache.clear()
+        self.viewer = User.objects.create_user(username='viewer', email='viewer@example.com', password='pw')
+        self.author = User.objects.create_user(username='author', email='author@example.com', password='pw')
+        self.posts = [
+            Post.objects.create(user=self.author, caption=f'Post {i}', image_url='https://example.com/image.jpg')
+            for i in range(3)
+        ]
+        Like.objects.create(user=self.viewer, post=self.posts[1])
+        token = Token.objects.create(user=self.viewer)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def batch(self, ids):
+        return self.client.get('/api/v1/posts/batch/', {'ids': ','.join(map(str, ids))})
+
+    def test_keeps_order_and_marks_missing(self):
+        first, second, third = self.posts
+        response = self.batch([third.pk, 999999, first.pk, second.pk])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()['results']
+        self.assertEqual([r and r['id'] for r in results], [third.pk, None, first.pk, second.pk])
+        self.assertEqual(response.json()['missing'], [999999])
+        self.assertEqual(results[3]['total_likes'], 1)
+        self.assertTrue(results[3]['is_liked'])
+        self.assertFalse(results[0]['is_liked'])
+        self.assertEqual(results[0]['user']['username'], 'author')
+
+    def test_same_shape_as_post_detail(self):
+        post = self.posts[1]
+        detail = self.client.get(f'/api/v1/posts/{post.pk}/').json()
+        item = self.batch([post.pk]).json()['results'][0]
+        for field in ('id', 'caption', 'image_url', 'total_likes', 'is_liked', 'created_at'):
+            self.assertEqual(item[field], detail[field])
+        self.assertEqual(item['user'], {k: detail['user'][k] for k in item['user']})
+
+    def test_cached_posts_only_need_is_liked(self):
+        ids = [post.pk for post in self.posts]
+        self.batch(ids)
+        with self.assertNumQueries(1):
+            response = self.batch(ids)
+        self.assertEqual(len(response.json()['results']), 3)
+
+    def test_likes_and_deletes_drop_cached_posts(self):
+        post = self.posts[0]
+        self.batch([post.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/v1/social/like/{post.pk}/')
+        self.assertEqual(self.batch([post.pk]).json()['results'][0]['total_likes'], 1)
+
+        author_client = APIClient()
+        author_client.force_authenticate(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            author_client.delete(f'/api/v1/posts/{post.pk}/')
+        self.assertEqual(self.batch([post.pk]).json()['missing'], [post.pk])
+
+    def test_rejects_bad_ids(self):
+        self.assertEqual(self.batch(['x']).status_code, status.HTTP_400_BAD_REQUEST)
+        with override_settings(OBJECT_CACHE={'MAX_IDS': 2}):
+            response = self.batch([post.pk for post in self.posts])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
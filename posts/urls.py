@@ -7,10 +7,13 @@ urlpatterns = [
     # Post CRUD endpoints
     path('', views.PostListCreateView.as_view(), name='post-list-create'),
     path('<int:pk>/', views.PostDetailView.as_view(), name='post-detail'),
+    path('batch/', views.post_batch, name='post-batch'),
     
     # Feed endpoints
     path('feed/', views.FeedView.as_view(), name='feed'),
     path('timeline/', views.TimelineView.as_view(), name='timeline'),
+    path('feed/new/', views.new_posts, name='feed-new'),
+    path('timeline/new/', views.new_posts, {'include_own': True}, name='timeline-new'),
     path('discover/', views.DiscoverView.as_view(), name='discover'),
     
     # Special post views
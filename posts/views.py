@@ -1,9 +1,12 @@
 from rest_framework import generics, permissions, status
 from .models import Post
 from rest_framework.response import Response
+from django.db import transaction
 
 from social.models import Follow
-from django.shortcuts import get_object_or_404
+from core import changes, conditional, objects, sharding
+from core.pagination import KeysetPagination
+from core.purge import soft_delete_post
 
 from rest_framework.decorators import api_view, permission_classes
 from users.permissions import IsOwnerOrReadOnly
@@ -15,7 +18,9 @@ class PostListCreateView(generics.ListCreateAPIView):
 
     def get_queryset(self):
         """Optimized queryset with user data and like counts"""
-        return Post.objects.with_user().with_like_counts().ordered_by_recent()
+        return sharding.gather(
+            Post.objects.for_viewer(self.request.user).ordered_by_recent()
+        )
 
     def get_serializer_class(self):
         """Use different serializers for different actions"""
@@ -28,7 +33,9 @@ class PostListCreateView(generics.ListCreateAPIView):
         serializer.save(user=self.request.user)
 
 
-class PostDetailView(generics.RetrieveUpdateDestroyAPIView):
+class PostDetailView(
+    conditional.ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView
+):
     """
     Retrieve, update or delete a post
     """
@@ -36,12 +43,39 @@ class PostDetailView(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrReadOnly]
     serializer_class = PostDetailSerializer
 
+    def get_validators(self, request):
+        """
+        The post's updated_at plus its author's and the viewer's versions.
+        Likes change the body without touching updated_at, so there is no
+        Last-Modified.
+        """
+        post_id = self.kwargs.get("pk")
+        row = sharding.find(Post.objects.values("user_id", "updated_at"), pk=post_id)
+        if row is None:
+            return None, None
+        keys = [
+            conditional.author_key(row["user_id"]),
+            conditional.viewer_key(request.user.pk),
+        ]
+        etag = conditional.make_etag(
+            "post", post_id, row["updated_at"], *conditional.versions(keys)
+        )
+        return etag, None
+
     def get_queryset(self):
-        return Post.objects.with_user().with_like_counts()
+        return Post.objects.for_viewer(self.request.user)
 
     def get_object(self):
         post_id = self.kwargs.get("pk")
-        return get_object_or_404(self.get_queryset(), pk=post_id)
+        return sharding.get_or_404(self.get_queryset(), pk=post_id)
+
+    def perform_update(self, serializer):
+        with transaction.atomic(using=serializer.instance._state.db):
+            changes.record_post(serializer.save())
+
+    def perform_destroy(self, instance):
+        """Hide the post now; its likes are purged in the background"""
+        soft_delete_post(instance)
 
 
 class PopularPostsView(generics.ListAPIView):
@@ -53,14 +87,35 @@ class PopularPostsView(generics.ListAPIView):
         """Get posts ordered by like count"""
         from django.db.models import Count
 
-        return (
+        return sharding.gather(
             Post.objects.with_user()
             .annotate(total_likes=Count("likes"))
-            .order_by("-total_likes", "-created_at")
+            .with_is_liked(self.request.user)
+            .order_by("-total_likes", "-created_at"),
+            key=lambda post: (post.total_likes, post.created_at),
         )
 
 
-class UserPostsView(generics.ListAPIView):
+def followed_authors(user, include_own=False):
+    authors = list(
+        Follow.objects.filter(follower=user)
+        .order_by()
+        .values_list("following_id", flat=True)
+    )
+    if include_own:
+        authors.append(user.pk)
+    return authors
+
+
+def list_validators(request, authors):
+    """ETag of a post list by ``authors`` as ``request.user`` sees it"""
+    keys = [conditional.viewer_key(request.user.pk)]
+    keys += [conditional.author_key(author) for author in sorted(set(authors))]
+    etag = conditional.make_etag(request.get_full_path(), *conditional.versions(keys))
+    return etag, None
+
+
+class UserPostsView(conditional.ConditionalGetMixin, generics.ListAPIView):
     """
     List posts by a specific user
     """
@@ -68,12 +123,15 @@ class UserPostsView(generics.ListAPIView):
     serializer_class = PostListSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    def get_validators(self, request):
+        return list_validators(request, [self.kwargs.get("user_id")])
+
     def get_queryset(self):
         """Get posts by specific user"""
         user_id = self.kwargs.get("user_id")
         return (
-            Post.objects.with_user()
-            .with_like_counts()
+            Post.objects.for_author(user_id)
+            .for_viewer(self.request.user)
             .filter(user_id=user_id)
             .ordered_by_recent()
         )
@@ -81,20 +139,68 @@ class UserPostsView(generics.ListAPIView):
 
 @api_view(["GET"])
 @permission_classes([permissions.IsAuthenticated])
+@conditional.conditional(lambda request: list_validators(request, [request.user.pk]))
 def my_posts(request):
     """
-    Get current user's posts
+    Get current user's posts, newest first, a keyset page at a time
     """
     posts = (
-        Post.objects.with_user()
-        .with_like_counts()
+        Post.objects.for_author(request.user.pk)
+        .for_viewer(request.user)
+        .with_list_columns()
         .filter(user=request.user)
-        .ordered_by_recent()
     )
+    paginator = KeysetPagination()
+    page = paginator.paginate_queryset(posts, request)
+
+    serializer = PostListSerializer(page, many=True, context={"request": request})
+
+    return paginator.get_paginated_response(serializer.data)
+
+
+@api_view(["GET"])
+@permission_classes([permissions.IsAuthenticated])
+def post_batch(request):
+    """
+    Posts for ``?ids=1,2,3`` in the order asked, ``null`` for ids that
+    don't exist (or are deleted), which are also listed under ``missing``
+    """
+    try:
+        ids = objects.parse_ids(request.GET.get("ids", ""))
+    except ValueError as exc:
+        return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(objects.in_order(ids, objects.posts(ids, request.user)))
+
+
+# most unseen posts a probe counts; clients show "99+"
+NEW_POSTS_LIMIT = 99
+
+
+@api_view(["GET"])
+@permission_classes([permissions.IsAuthenticated])
+def new_posts(request, include_own=False):
+    """
+    How many feed (or timeline) posts are newer than ``?since=<post id>``,
+    capped at NEW_POSTS_LIMIT, and the newest one's id. Cheap enough to
+    poll for a pull-to-refresh badge.
+    """
+    try:
+        since = int(request.GET.get("since", 0))
+    except ValueError:
+        return Response(
+            {"error": "since must be a post id"}, status=status.HTTP_400_BAD_REQUEST
+        )
 
-    serializer = PostListSerializer(posts, many=True, context={"request": request})
+    authors = followed_authors(request.user, include_own)
+    ids = Post.objects.ids_since(authors, since, NEW_POSTS_LIMIT + 1)
 
-    return Response(serializer.data)
+    return Response(
+        {
+            "count": min(len(ids), NEW_POSTS_LIMIT),
+            "more": len(ids) > NEW_POSTS_LIMIT,
+            "newest_id": ids[0] if ids else None,
+        }
+    )
 
 
 @api_view(["GET"])
@@ -103,11 +209,16 @@ def post_stats(request):
     """
     Get statistics about posts
     """
-    total_posts = Post.objects.count()
-    user_posts = Post.objects.filter(user=request.user).count()
+    total_posts = sharding.count(Post.objects.all())
+    user_posts = Post.objects.for_author(request.user.pk).filter(user=request.user).count()
 
     # Most liked post
-    most_liked = Post.objects.with_like_counts().order_by("-total_likes").first()
+    most_liked = sharding.top(
+        Post.objects.with_like_counts().order_by("-total_likes"),
+        1,
+        key=lambda post: post.total_likes,
+    )
+    most_liked = most_liked[0] if most_liked else None
 
     stats = {
         "total_posts": total_posts,
@@ -126,11 +237,14 @@ def post_stats(request):
     return Response(stats)
 
 
-class FeedView(generics.ListAPIView):
+class FeedView(conditional.ConditionalGetMixin, generics.ListAPIView):
 
     serializer_class = PostListSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    def get_validators(self, request):
+        return list_validators(request, followed_authors(request.user))
+
     def get_queryset(self):
         return Post.objects.feed_for_user(self.request.user)
 
@@ -155,10 +269,14 @@ class FeedView(generics.ListAPIView):
         return Response(serializer.data)
 
 
-class TimelineView(generics.ListAPIView):
+class TimelineView(conditional.ConditionalGetMixin, generics.ListAPIView):
     serializer_class = PostListSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    def get_validators(self, request):
+        authors = followed_authors(request.user, include_own=True)
+        return list_validators(request, authors)
+
     def get_queryset(self):
         return Post.objects.timeline_for_user(self.request.user)
 
@@ -172,7 +290,9 @@ class TimelineView(generics.ListAPIView):
             from social.models import Follow
 
             following_count = Follow.objects.filter(follower=request.user).count()
-            own_posts_count = Post.objects.filter(user=request.user).count()
+            own_posts_count = (
+                Post.objects.for_author(request.user.pk).filter(user=request.user).count()
+            )
 
             response_data = self.get_paginated_response(serializer.data).data
             response_data["timeline_meta"] = {
@@ -203,8 +323,8 @@ class DiscoverView(generics.ListAPIView):
         )
         following_ids.append(self.request.user.id)
 
-        return (
-            Post.objects.with_user()
+        return sharding.gather(
+            Post.objects.for_viewer(self.request.user)
             .exclude(user_id__in=following_ids)
             .ordered_by_recent()
         )
@@ -237,9 +357,11 @@ def feed_stats(request):
 
     feed_posts_count = Post.objects.feed_for_user(request.user).count()
     timeline_posts_count = Post.objects.timeline_for_user(request.user).count()
-    own_posts_count = Post.objects.filter(user=request.user).count()
+    own_posts_count = (
+        Post.objects.for_author(request.user.pk).filter(user=request.user).count()
+    )
 
-    discover_posts_count = Post.objects.count() - timeline_posts_count
+    discover_posts_count = sharding.count(Post.objects.all()) - timeline_posts_count
 
     stats = {
         "social_stats": {
@@ -0,0 +1,12 @@
+from django.urls import path
+from . import async_views
+
+urlpatterns = [
+    path('posts/<int:post_id>/likes/', async_views.post_likes),
+    path('stats/', async_views.follow_stats),
+    path('stats/<int:user_id>/', async_views.follow_stats),
+    path('like-stats/', async_views.like_stats),
+    path('like-stats/<int:user_id>/', async_views.like_stats),
+    # only served under ASGI; a stream would hold a WSGI worker
+    path('events/', async_views.event_stream),
+]
@@ -0,0 +1,175 @@
+"""
+Native async variants of the social read endpoints, served under ASGI.
+
+Independent counts and lookups are issued concurrently; payloads match
+the sync views in ``social.views``. ``event_stream`` has no sync
+counterpart.
+"""
+import asyncio
+
+from django.db.models import Count
+from django.http import StreamingHttpResponse
+from rest_framework import status
+
+from core import events, sharding
+from core.asyncapi import async_api_view, db_read, get_or_404, json_response
+from core.pagination import KeysetPagination
+from posts.models import Post
+from users.models import live_users
+from .models import Follow, Like
+from .serializers import FollowStatsSerializer, LikeStatsSerializer, PostLikeSerializer
+
+
+async def _target_user(request, user_id):
+    if user_id:
+        return await get_or_404(live_users(), pk=user_id)
+    return request.user
+
+
+def _following_ids(user):
+    return set(
+        Follow.objects.filter(follower=user).values_list("following", flat=True)
+    )
+
+
+@async_api_view(["GET"])
+async def follow_stats(request, user_id=None):
+    """
+    Get follow statistics for a user
+    """
+    target_user = await _target_user(request, user_id)
+
+    reads = [
+        Follow.objects.filter(following=target_user).count,
+        Follow.objects.filter(follower=target_user).count,
+    ]
+    is_self = target_user == request.user
+    if not is_self:
+        reads += [
+            lambda: Follow.objects.is_following(request.user, target_user),
+            lambda: Follow.objects.is_following(target_user, request.user),
+            lambda: _following_ids(request.user),
+            lambda: _following_ids(target_user),
+        ]
+
+    results = await asyncio.gather(*(db_read(read) for read in reads))
+
+    stats = {
+        "followers_count": results[0],
+        "following_count": results[1],
+        "is_following": False,
+        "is_followed_by": False,
+        "mutual_follows": 0,
+    }
+    if not is_self:
+        is_following, is_followed_by, mine, theirs = results[2:]
+        stats["is_following"] = is_following
+        stats["is_followed_by"] = is_followed_by
+        stats["mutual_follows"] = len(mine & theirs)
+
+    return json_response(FollowStatsSerializer(stats).data)
+
+
+def _most_liked_post(user):
+    return (
+        Post.objects.for_author(user.pk)
+        .filter(user=user)
+        .annotate(total_likes=Count("likes"))
+        .order_by("-total_likes")
+        .first()
+    )
+
+
+def _recent_likes(user):
+    return sharding.top(
+        Like.objects.filter(user=user).select_related("post").order_by("-created_at"),
+        5,
+        key=sharding.recency_key,
+    )
+
+
+def _likes_received(user):
+    return sharding.using_shard(
+        Like.objects.filter(post__user=user), sharding.shard_for_user(user.pk)
+    ).count()
+
+
+@async_api_view(["GET"])
+async def like_stats(request, user_id=None):
+    """
+    Get like statistics for a user
+    """
+    target_user = await _target_user(request, user_id)
+
+    given, received, top_post, recent_likes = await asyncio.gather(
+        db_read(sharding.count, Like.objects.filter(user=target_user)),
+        db_read(_likes_received, target_user),
+        db_read(_most_liked_post, target_user),
+        db_read(_recent_likes, target_user),
+    )
+
+    most_liked_post = None
+    if top_post and top_post.total_likes > 0:
+        most_liked_post = {
+            "id": top_post.id,
+            "caption": top_post.caption,
+            "like_count": top_post.total_likes,
+            "created_at": top_post.created_at,
+        }
+
+    stats = {
+        "total_likes_given": given,
+        "total_likes_received": received,
+        "most_liked_post": most_liked_post,
+        "recent_likes": [
+            {
+                "post_id": like.post.id,
+                "post_caption": like.post.caption,
+                "liked_at": like.created_at,
+            }
+            for like in recent_likes
+        ],
+    }
+    return json_response(LikeStatsSerializer(stats).data)
+
+
+@async_api_view(["GET"])
+async def post_likes(request, post_id):
+    """
+    List users who liked a specific post
+    """
+    post = await get_or_404(Post.objects.all(), pk=post_id)
+
+    paginator = KeysetPagination()
+    likes = Like.objects.for_post(post).with_likers()
+
+    def read_page():
+        page = paginator.paginate_queryset(likes, request)
+        return PostLikeSerializer(page, many=True, context={"request": request}).data
+
+    results = await db_read(read_page)
+    return json_response(paginator.get_paginated_data(results))
+
+
+@async_api_view(["GET"])
+async def event_stream(request):
+    """
+    Server-sent events for the current user: ``feed`` when someone they
+    follow posts, ``like`` and ``follow`` when their notifications change
+    """
+    try:
+        subscription = events.hub.subscribe(request.user.pk)
+    except events.TooManyConnections as e:
+        return json_response(
+            {"error": str(e)},
+            status=status.HTTP_429_TOO_MANY_REQUESTS,
+            headers={"Retry-After": str(events.config()["RETRY_MS"] // 1000 or 1)},
+        )
+    response = StreamingHttpResponse(
+        events.stream(subscription, getattr(request, "asgi_receive", None)),
+        content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    # stop nginx from buffering the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
@@ -21,9 +21,9 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         count = options["count"]
 
-        # Get all users and posts
-        users = list(User.objects.all())
-        posts = list(Post.objects.all())
+        # Get all users and posts, only the columns used below
+        users = list(User.objects.only("id", "username"))
+        posts = list(Post.objects.only("id", "user_id", "caption"))
 
         if len(users) < 1:
             self.stdout.write(
@@ -44,7 +44,7 @@ class Command(BaseCommand):
             user = random.choice(users)
             post = random.choice(posts)
 
-            if user == post.user:
+            if user.pk == post.user_id:
                 continue
 
             try:
@@ -80,11 +80,10 @@ class Command(BaseCommand):
             self.style.SUCCESS(f"Total No of likes in the DB: {total_likes}")
         )
 
-        # Show most liked posts using the existing like_count property
+        # Show most liked posts, counts and authors in one query
         self.stdout.write(self.style.SUCCESS("\n=== MOST LIKED POSTS ==="))
-        for post in Post.objects.all()[:5]:
-            like_count = post.like_count  # Use the property instead of annotation
-            if like_count > 0:
+        for post in Post.objects.popular()[:5]:
+            if post.total_likes > 0:
                 self.stdout.write(
-                    f'Post {post.id}: "{post.caption}" by {post.user.username} - {like_count} likes'
+                    f'Post {post.id}: "{post.caption}" by {post.user.username} - {post.total_likes} likes'
                 )
@@ -0,0 +1,89 @@
+# Generated by Django 4.2.7 on 2026-10-19 00:59
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0002_rationalize_indexes'),
+        ('social', '0002_like_like_unique_like'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='follow',
+            name='social_foll_followe_9bcca8_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='follow',
+            name='social_foll_followi_3e6f69_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='follow',
+            name='social_foll_followe_6a4bef_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='follow',
+            name='social_foll_created_5df765_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='like',
+            name='social_like_user_id_bd182d_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='like',
+            name='social_like_post_id_45719e_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='like',
+            name='social_like_user_id_d8cf9b_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='like',
+            name='social_like_created_8e7e28_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='like',
+            name='social_like_post_id_f7b407_idx',
+        ),
+        migrations.AlterField(
+            model_name='follow',
+            name='follower',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='following_set', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='follow',
+            name='following',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='followers_set', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='like',
+            name='post',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='likes', to='posts.post'),
+        ),
+        migrations.AlterField(
+            model_name='like',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='likes', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='follow',
+            index=models.Index(fields=['following', '-created_at', 'follower'], name='social_foll_followi_ae8ee5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='like',
+            index=models.Index(fields=['post', '-created_at', 'user'], name='social_like_post_id_1d5519_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='like',
+            index=models.Index(fields=['user', '-created_at'], name='social_like_user_id_323385_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='like',
+            index=models.Index(fields=['created_at', 'post'], name='social_like_created_9e635f_idx'),
+        ),
+    ]
@@ -1,7 +1,12 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 
+from core import changes, sharding, tasks
+from core.db import retry_on_lock
+from core.models import ChangeLogEntry
+from users.models import list_columns
+
 User = get_user_model()
 
 
@@ -14,12 +19,16 @@ class FollowQuerySet(models.QuerySet):
 
     def followers_of(self, user):
         """Get all followers of a user"""
-        return self.filter(following=user).select_related("follower")
+        return self.filter(following=user, follower__deleted_at__isnull=True).select_related(
+            "follower", "follower__profile"
+        )
 
     def following_of(self, user):
         """Get all user that a user Is following"""
 
-        return self.filter(follower=user).select_related("following")
+        return self.filter(follower=user, following__deleted_at__isnull=True).select_related(
+            "following", "following__profile"
+        )
 
 
 class FollowManager(models.Manager):
@@ -41,33 +50,57 @@ class FollowManager(models.Manager):
         """Check if follower is following the other user"""
         return self.filter(follower=follower, following=following).exists()
 
+    @retry_on_lock
     def follow_user(self, follower, following):
         """Follow a user with proper validation"""
+        from .notifications import notify_follow
+
         if follower == following:
             raise ValidationError("Users can only follow other users")
 
-        follow, created = self.get_or_create(follower=follower, following=following)
+        with transaction.atomic():
+            follow, created = self.get_or_create(
+                follower=follower, following=following
+            )
+            if created:
+                tasks.enqueue(
+                    "users.adjust_follow_counts",
+                    {"follower_id": follower.pk, "following_id": following.pk, "delta": 1},
+                    key=f"follow:{follow.pk}:created",
+                )
+                changes.record_follow(follow)
+                notify_follow(follow)
         return follow, created
 
+    @retry_on_lock
     def unfollow_user(self, follower, following):
         """Unfollow a user"""
-        try:
-            follow = self.get(follower=follower, following=following)
-            follow.delete()
-            return True
-        except self.model.DoesNotExist:
-            return False
+        with transaction.atomic():
+            try:
+                follow = self.get(follower=follower, following=following)
+                tasks.enqueue(
+                    "users.adjust_follow_counts",
+                    {"follower_id": follower.pk, "following_id": following.pk, "delta": -1},
+                    key=f"follow:{follow.pk}:deleted",
+                )
+                changes.record_follow(follow, op=ChangeLogEntry.DELETE)
+                follow.delete()
+                return True
+            except self.model.DoesNotExist:
+                return False
 
 
 class Follow(models.Model):
 
+    # both foreign keys are covered by the unique constraint and index below
     following = models.ForeignKey(
-        User, on_delete=models.CASCADE, related_name="followers_set"
+        User, on_delete=models.CASCADE, related_name="followers_set", db_index=False
     )
     follower = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         related_name="following_set",
+        db_index=False,
     )
 
     created_at = models.DateTimeField(auto_now_add=True)
@@ -86,11 +119,10 @@ class Follow(models.Model):
                 name="prevent_self_follow",
             ),
         ]
+        # unique_follow (follower, following) serves lookups by follower;
+        # this one serves follower lists and counts without touching the table
         indexes = [
-            models.Index(fields=["follower"]),
-            models.Index(fields=["following"]),
-            models.Index(fields=["follower", "following"]),
-            models.Index(fields=["created_at"]),
+            models.Index(fields=["following", "-created_at", "follower"]),
         ]
         ordering = ["-created_at"]
 
@@ -112,7 +144,29 @@ class LikeQuerySet(models.QuerySet):
 
     def with_post_and_user(self):
         """Select related post and user to avoid N+1 queries"""
-        return self.select_related("user", "post", "post__user")
+        return self.select_related(
+            "user", "user__profile", "post", "post__user", "post__user__profile"
+        )
+
+    def with_likers(self):
+        """The liking user and profile, without joining the post"""
+        return (
+            self.filter(user__deleted_at__isnull=True)
+            .select_related("user", "user__profile")
+            .only("created_at", *list_columns("user"))
+        )
+
+    def with_liked_posts(self, viewer):
+        """
+        Prefetch each like's post annotated for ``viewer``, so listing liked
+        posts costs one extra query rather than several per like
+        """
+        from posts.models import Post
+
+        posts = Post.objects.for_viewer(viewer).with_list_columns()
+        return self.only("post", "created_at").prefetch_related(
+            models.Prefetch("post", queryset=posts)
+        )
 
     def for_post(self, post):
         """Get all likes for a specific post"""
@@ -122,6 +176,14 @@ class LikeQuerySet(models.QuerySet):
         """Get all likes by a specific user"""
         return self.filter(user=user)
 
+    def create(self, **kwargs):
+        """Without an explicit alias, let the router pick the post's shard"""
+        if self._db is None and sharding.enabled():
+            like = self.model(**kwargs)
+            like.save(force_insert=True)
+            return like
+        return super().create(**kwargs)
+
 
 class LikeManager(models.Manager):
     """Custom manager for Like model"""
@@ -132,29 +194,53 @@ class LikeManager(models.Manager):
     def with_post_and_user(self):
         return self.get_queryset().with_post_and_user()
 
+    def with_likers(self):
+        return self.get_queryset().with_likers()
+
+    def with_liked_posts(self, viewer):
+        return self.get_queryset().with_liked_posts(viewer)
+
+    def on_post_shard(self, post):
+        """Likes live on the same shard as their post"""
+        return sharding.using_shard(
+            self.get_queryset(), sharding.shard_for_post(post)
+        )
+
     def for_post(self, post):
-        return self.get_queryset().for_post(post)
+        return self.on_post_shard(post).for_post(post)
 
     def by_user(self, user):
         return self.get_queryset().by_user(user)
 
     def is_liked_by(self, user, post):
         """Check if user has liked a post"""
-        return self.filter(user=user, post=post).exists()
+        return self.on_post_shard(post).filter(user=user, post=post).exists()
 
+    @retry_on_lock
     def like_post(self, user, post):
         """Like a post with proper validation"""
-        like, created = self.get_or_create(user=user, post=post)
+        from .notifications import notify_like
+
+        likes = self.on_post_shard(post)
+        with transaction.atomic(using=likes.db):
+            like, created = likes.get_or_create(user=user, post=post)
+            if created:
+                changes.record_like(like, post)
+                notify_like(like, post)
         return like, created
 
+    @retry_on_lock
     def unlike_post(self, user, post):
         """Unlike a post"""
-        try:
-            like = self.get(user=user, post=post)
-            like.delete()
-            return True
-        except self.model.DoesNotExist:
-            return False
+        likes = self.on_post_shard(post)
+        with transaction.atomic(using=likes.db):
+            try:
+                like = likes.get(user=user, post=post)
+                changes.record_like(like, post, op=ChangeLogEntry.DELETE)
+                like.delete()
+                return True
+            except self.model.DoesNotExist:
+                return False
 
 
 class Like(models.Model):
@@ -162,9 +248,12 @@ class Like(models.Model):
     Model representing a user liking a post
     """
 
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="likes")
+    # both foreign keys are covered by the unique constraint and indexes below
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="likes", db_index=False
+    )
     post = models.ForeignKey(
-        "posts.Post", on_delete=models.CASCADE, related_name="likes"
+        "posts.Post", on_delete=models.CASCADE, related_name="likes", db_index=False
     )
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -175,12 +264,14 @@ class Like(models.Model):
         constraints = [
             models.UniqueConstraint(fields=["user", "post"], name="unique_like")
         ]
+        # unique_like (user, post) serves is-liked checks
         indexes = [
-            models.Index(fields=["user"]),
-            models.Index(fields=["post"]),
-            models.Index(fields=["user", "post"]),
-            models.Index(fields=["created_at"]),
-            models.Index(fields=["post", "-created_at"]),
+            # likes of a post: counts and the likers list, covering
+            models.Index(fields=["post", "-created_at", "user"]),
+            # a user's likes, newest first
+            models.Index(fields=["user", "-created_at"]),
+            # trending: recent likes grouped by post, covering
+            models.Index(fields=["created_at", "post"]),
         ]
         ordering = ["-created_at"]
 
@@ -192,3 +283,54 @@ class Like(models.Model):
         super().clean()
         if self.user == self.post.user:
             raise ValidationError("Users cannot like their own posts.")
+
+
+class Notification(models.Model):
+    """
+    One inbox entry per (recipient, verb, post, time window): every like of
+    a post within the window updates the same row, so "42 people liked
+    your post" is one row. Written by the tasks in social/tasks.py.
+    """
+
+    LIKE = "like"
+    FOLLOW = "follow"
+    VERB_CHOICES = [(LIKE, "Like"), (FOLLOW, "Follow")]
+
+    recipient = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="notifications", db_index=False
+    )
+    verb = models.CharField(max_length=10, choices=VERB_CHOICES)
+    # posts live on shards, so a plain id rather than a foreign key
+    post_id = models.BigIntegerField(null=True, blank=True)
+    window_start = models.DateTimeField()
+    actor_count = models.PositiveIntegerField(default=0)
+    last_actor = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+    read_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["recipient", "verb", "post_id", "window_start"],
+                condition=models.Q(post_id__isnull=False),
+                name="unique_post_notification",
+            ),
+            models.UniqueConstraint(
+                fields=["recipient", "verb", "window_start"],
+                condition=models.Q(post_id__isnull=True),
+                name="unique_user_notification",
+            ),
+        ]
+        indexes = [
+            # the inbox, newest activity first
+            models.Index(fields=["recipient", "-updated_at", "-id"]),
+            # purging a deleted post's notifications
+            models.Index(fields=["post_id"]),
+        ]
+        ordering = ["-updated_at", "-id"]
+
+    def __str__(self):
+        return f"{self.verb} x{self.actor_count} for {self.recipient_id}"
@@ -0,0 +1,155 @@
+"""
+Aggregated like and follow notifications.
+
+A like or follow doesn't write a notification itself: it queues a task
+(core.tasks) in the same transaction, keyed on the recipient's group and
+a ``DEBOUNCE_SECONDS`` slot, so a viral post gets at most one task per
+slot however many likes arrive. The task recounts the group's likes or
+follows in the current ``WINDOW_SECONDS`` window and upserts one row, so
+a rerun or a late task leaves the same result. ``unread_notifications``
+on the profile counts unread rows and is only changed when a row turns
+unread, is read or is purged, which keeps the inbox badge a single-column
+read. Open event streams (core.events) are told right away.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count, F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from core import events, tasks
+
+DEFAULTS = {
+    "WINDOW_SECONDS": 3600,
+    "DEBOUNCE_SECONDS": 10,
+}
+
+
+def config():
+    return {**DEFAULTS, **getattr(settings, "NOTIFICATIONS", {})}
+
+
+def _schedule(name, group, payload, at, using):
+    debounce = config()["DEBOUNCE_SECONDS"]
+    moment = at.timestamp()
+    slot = int(moment // debounce)
+    # WINDOW_SECONDS should be a multiple of DEBOUNCE_SECONDS so that a
+    # slot never straddles two windows
+    window = moment - moment % config()["WINDOW_SECONDS"]
+    tasks.enqueue(
+        name,
+        {**payload, "window": window},
+        key=f"notify:{group}:{slot}",
+        delay=(slot + 1) * debounce - moment,
+        using=using,
+    )
+
+
+def notify_like(like, post):
+    if like.user_id == post.user_id:
+        return
+    _schedule(
+        "social.aggregate_likes",
+        f"like:{post.pk}",
+        {"recipient_id": post.user_id, "post_id": post.pk},
+        like.created_at,
+        like._state.db,
+    )
+    events.publish_on_commit([post.user_id], "like", {"post_id": post.pk}, using=like._state.db)
+
+
+def notify_follow(follow):
+    _schedule(
+        "social.aggregate_follows",
+        f"follow:{follow.following_id}",
+        {"recipient_id": follow.following_id},
+        follow.created_at,
+        follow._state.db,
+    )
+    events.publish_on_commit(
+        [follow.following_id], "follow", {"user_id": follow.follower_id}, using=follow._state.db
+    )
+
+
+def window_bounds(window):
+    start = datetime.fromtimestamp(window, tz=dt_timezone.utc)
+    return start, start + timedelta(seconds=config()["WINDOW_SECONDS"])
+
+
+def record(recipient_id, verb, post_id, window_start, actors):
+    """
+    Make the group's row match ``actors``, the queryset of its likes or
+    follows, and bump the unread counter if the row turned unread
+    """
+    from users.tasks import _update_profile
+
+    from .models import Notification
+
+    count = actors.count()
+    if not count:
+        return None
+    last_actor_id = actors.order_by("-created_at", "-id").values_list(
+        "user_id" if verb == Notification.LIKE else "follower_id", flat=True
+    ).first()
+
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        notification, created = Notification.objects.get_or_create(
+            recipient_id=recipient_id,
+            verb=verb,
+            post_id=post_id,
+            window_start=window_start,
+            defaults={"actor_count": count, "last_actor_id": last_actor_id},
+        )
+        turned_unread = False
+        if not created:
+            if (notification.actor_count, notification.last_actor_id) == (count, last_actor_id):
+                return notification
+            turned_unread = notification.read_at is not None
+            notification.actor_count = count
+            notification.last_actor_id = last_actor_id
+            notification.read_at = None
+            notification.save(
+                update_fields=["actor_count", "last_actor", "read_at", "updated_at"]
+            )
+        if created or turned_unread:
+            _update_profile(recipient_id, unread_notifications=F("unread_notifications") + 1)
+    return notification
+
+
+def mark_read(user):
+    """Mark every unread notification of ``user`` read; returns how many"""
+    from .models import Notification
+
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        count = Notification.objects.filter(recipient=user, read_at__isnull=True).update(
+            read_at=timezone.now()
+        )
+        if count:
+            _forget_unread(user.pk, count)
+    return count
+
+
+def _forget_unread(recipient_id, count):
+    from users.tasks import _update_profile
+
+    _update_profile(
+        recipient_id,
+        unread_notifications=Greatest(F("unread_notifications") - count, Value(0)),
+    )
+
+
+def discard(notifications):
+    """
+    Lower the unread counters for the unread rows among ``notifications``,
+    which are about to be deleted; call it in the deleting transaction
+    """
+    unread = (
+        notifications.filter(read_at__isnull=True)
+        .order_by()
+        .values("recipient_id")
+        .annotate(rows=Count("pk"))
+    )
+    for row in unread:
+        _forget_unread(row["recipient_id"], row["rows"])
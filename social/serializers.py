@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from .models import Follow
+from core import sharding
 from users.serializers import UserListSerializer
 
 User = get_user_model()
@@ -100,9 +101,7 @@ class LikeCreateSerializer(serializers.Serializer):
     def validate_post_id(self, value):
         """Validate that the post exists"""
         from posts.models import Post
-        try:
-            post = Post.objects.get(pk=value)
-        except Post.DoesNotExist:
+        if sharding.find(Post.objects.all(), pk=value) is None:
             raise serializers.ValidationError("Post not found.")
         
         return value
@@ -111,7 +110,7 @@ class LikeCreateSerializer(serializers.Serializer):
         """Create a like relationship"""
         from posts.models import Post
         request = self.context.get('request')
-        post = Post.objects.get(pk=validated_data['post_id'])
+        post = sharding.find(Post.objects.all(), pk=validated_data['post_id'])
         
         like, created = Like.objects.like_post(
             user=request.user,
@@ -148,3 +147,22 @@ class LikeStatsSerializer(serializers.Serializer):
     total_likes_received = serializers.IntegerField()
     most_liked_post = serializers.DictField(allow_null=True)
     recent_likes = serializers.ListField()
+
+
+from .models import Notification
+
+
+class NotificationSerializer(serializers.ModelSerializer):
+    """One aggregated inbox entry: who did it last and how many did"""
+    last_actor = UserListSerializer(read_only=True)
+    unread = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Notification
+        fields = [
+            'id', 'verb', 'post_id', 'actor_count', 'last_actor', 'unread',
+            'window_start', 'updated_at',
+        ]
+
+    def get_unread(self, obj):
+        return obj.read_at is None
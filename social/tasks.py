@@ -0,0 +1,23 @@
+from core import sharding
+from core.tasks import task
+from .models import Follow, Like, Notification
+from .notifications import record, window_bounds
+
+
+@task("social.aggregate_likes")
+def aggregate_likes(recipient_id, post_id, window):
+    start, end = window_bounds(window)
+    # likes live on the shard of the post, which is its author's
+    likes = Like.objects.using(sharding.shard_for_user(recipient_id)).filter(
+        post_id=post_id, created_at__gte=start, created_at__lt=end
+    ).exclude(user_id=recipient_id)
+    record(recipient_id, Notification.LIKE, post_id, start, likes)
+
+
+@task("social.aggregate_follows")
+def aggregate_follows(recipient_id, window):
+    start, end = window_bounds(window)
+    follows = Follow.objects.filter(
+        following_id=recipient_id, created_at__gte=start, created_at__lt=end
+    )
+    record(recipient_id, Notification.FOLLOW, None, start, follows)
@@ -1,10 +1,22 @@
-from django.test import TestCase
+from django.test import AsyncClient, TestCase, override_settings
+from django.urls import resolve
 from django.contrib.auth import get_user_model
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
 from rest_framework.authtoken.models import Token
-from social.models import Follow, Like
+from django.utils import timezone
+from social import tasks
+from social.models import Follow, Like, Notification
+from core.models import Task
+from core import conditional, events, purge, tasks as task_queue
+from core.handlers import RECEIVE_KEY, AsyncViewsASGIHandler
 from posts.models import Post
+from users.models import UserProfile
+from datetime import timedelta
+from unittest import mock
+import asyncio
+import io
+import time
 import uuid
 
 User = get_user_model()
@@ -41,6 +53,27 @@ class FollowTests(APITestCase):
         follow = Follow.objects.get(follower=self.user1, following=self.user2)
         self.assertIsNotNone(follow)
     
+    def test_deleted_users_cannot_be_followed_or_looked_up(self):
+        purge.soft_delete_user(self.user2)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token1.key}')
+        response = self.client.post(f'/api/v1/social/follow/{self.user2.pk}/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(Follow.objects.exists())
+        self.assertFalse(Task.objects.filter(name='users.adjust_follow_counts').exists())
+
+        for url in [
+            f'/api/v1/social/users/{self.user2.pk}/followers/',
+            f'/api/v1/social/users/{self.user2.pk}/likes/',
+            f'/api/v1/social/stats/{self.user2.pk}/',
+            f'/api/v1/social/like-stats/{self.user2.pk}/',
+            f'/api/v1/social/mutual/{self.user2.pk}/',
+        ]:
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND, url)
+            with override_settings(ROOT_URLCONF='image_sharing_api.asgi_urls'):
+                self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND, url)
+        suggested = self.client.get('/api/v1/social/suggested/').json()
+        self.assertNotIn(self.user2.pk, [user['id'] for user in suggested])
+
     def test_get_my_following(self):
         """Test getting users current user follows"""
         # Create follow relationship
@@ -110,3 +143,289 @@ class LikeTests(APITestCase):
             self.assertGreaterEqual(len(response.data['results']), 1)
         else:
             self.assertGreaterEqual(len(response.data), 1)
+
+
+class AsyncStatsTests(APITestCase):
+    """The async social views return the same payloads as the sync ones"""
+
+    def setUp(self):
+        unique_id = str(uuid.uuid4())[:8]
+        self.user1 = User.objects.create_user(
+            username=f'user1_{unique_id}',
+            email=f'user1_{unique_id}@example.com',
+            password='test123'
+        )
+        self.user2 = User.objects.create_user(
+            username=f'user2_{unique_id}',
+            email=f'user2_{unique_id}@example.com',
+            password='test123'
+        )
+        Follow.objects.create(follower=self.user1, following=self.user2)
+        self.post = Post.objects.create(
+            user=self.user2,
+            caption='Test post',
+            image_url='https://picsum.photos/400/400?random=1'
+        )
+        Like.objects.create(user=self.user1, post=self.post)
+
+        token = Token.objects.create(user=self.user1)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def test_async_views_match_sync_views(self):
+        urls = [
+            '/api/v1/social/stats/',
+            f'/api/v1/social/stats/{self.user2.pk}/',
+            '/api/v1/social/like-stats/',
+            f'/api/v1/social/like-stats/{self.user2.pk}/',
+            f'/api/v1/social/posts/{self.post.pk}/likes/',
+        ]
+        for url in urls:
+            expected = self.client.get(url).json()
+            with override_settings(ROOT_URLCONF='image_sharing_api.asgi_urls'):
+                self.assertEqual(resolve(url).func.__module__, 'social.async_views')
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json(), expected)
+
+    def test_async_view_missing_user(self):
+        with override_settings(ROOT_URLCONF='image_sharing_api.asgi_urls'):
+            response = self.client.get('/api/v1/social/stats/999999/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class NotificationTests(APITestCase):
+    """Test aggregated like and follow notifications"""
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com', password='test123'
+        )
+        UserProfile.objects.create(user=self.author)
+        self.fans = [
+            User.objects.create_user(
+                username=f'fan{i}', email=f'fan{i}@example.com', password='test123'
+            )
+            for i in range(3)
+        ]
+        self.post = Post.objects.create(
+            user=self.author, caption='Popular', image_url='https://picsum.photos/1.jpg'
+        )
+        token = Token.objects.create(user=self.author)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.start = timezone.now().replace(minute=5, second=0, microsecond=0)
+
+    def at(self, seconds):
+        return mock.patch(
+            'django.utils.timezone.now',
+            return_value=self.start + timedelta(seconds=seconds),
+        )
+
+    def unread(self):
+        return self.client.get('/api/v1/social/notifications/unread/').json()['unread']
+
+    def test_likes_in_a_window_share_one_notification(self):
+        with self.at(0):
+            Like.objects.like_post(self.fans[0], self.post)
+            Like.objects.like_post(self.fans[1], self.post)
+        # one task per debounce slot, however many likes
+        self.assertEqual(Task.objects.count(), 1)
+        with self.at(1):
+            self.assertEqual(task_queue.run_pending(threads=0), (0, 0))
+        with self.at(15):
+            self.assertEqual(task_queue.run_pending(threads=0), (1, 0))
+
+        self.assertEqual(self.unread(), 1)
+        results = self.client.get('/api/v1/social/notifications/').json()['results']
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['verb'], 'like')
+        self.assertEqual(results[0]['post_id'], self.post.pk)
+        self.assertEqual(results[0]['actor_count'], 2)
+        self.assertEqual(results[0]['last_actor']['id'], self.fans[1].pk)
+        self.assertTrue(results[0]['unread'])
+
+        response = self.client.post('/api/v1/social/notifications/read/')
+        self.assertEqual(response.json()['marked_read'], 1)
+        self.assertEqual(self.unread(), 0)
+
+        # a later like in the same window reopens the same row
+        with self.at(20):
+            Like.objects.like_post(self.fans[2], self.post)
+        with self.at(40):
+            task_queue.run_pending(threads=0)
+        self.assertEqual(Notification.objects.get().actor_count, 3)
+        self.assertEqual(self.unread(), 1)
+
+        # a rerun changes nothing
+        with self.at(40):
+            tasks.aggregate_likes(self.author.pk, self.post.pk, self.start.timestamp() - 300)
+        self.assertEqual(self.unread(), 1)
+
+        # the next window starts a new row
+        with self.at(3600):
+            Like.objects.unlike_post(self.fans[0], self.post)
+            Like.objects.like_post(self.fans[0], self.post)
+        with self.at(3700):
+            task_queue.run_pending(threads=0)
+        self.assertEqual(Notification.objects.count(), 2)
+        self.assertEqual(self.unread(), 2)
+
+    def test_follows_are_grouped_too(self):
+        with self.at(0):
+            for fan in self.fans:
+                Follow.objects.follow_user(fan, self.author)
+        with self.at(15):
+            task_queue.run_pending(threads=0)
+
+        notification = Notification.objects.get()
+        self.assertEqual(notification.verb, Notification.FOLLOW)
+        self.assertIsNone(notification.post_id)
+        self.assertEqual(notification.actor_count, 3)
+        self.assertEqual(self.unread(), 1)
+
+    def test_purging_a_post_lowers_the_badge(self):
+        with self.at(0):
+            Like.objects.like_post(self.fans[0], self.post)
+        with self.at(15):
+            task_queue.run_pending(threads=0)
+        self.assertEqual(self.unread(), 1)
+
+        purge.soft_delete_post(self.post)
+        purge.run_pending(pause=0)
+        self.assertFalse(Notification.objects.exists())
+        self.assertEqual(self.unread(), 0)
+
+    def test_badge_updates_refresh_the_author_version(self):
+        key = conditional.author_key(self.author.pk)
+        before = conditional.versions([key])
+        with self.at(0):
+            Follow.objects.follow_user(self.fans[0], self.author)
+        with self.at(15), self.captureOnCommitCallbacks(execute=True):
+            tasks.aggregate_follows(self.author.pk, self.start.timestamp() - 300)
+        self.assertEqual(self.unread(), 1)
+        self.assertNotEqual(conditional.versions([key]), before)
+
+    def test_inbox_pages_with_a_cursor(self):
+        for hour in range(3):
+            Notification.objects.create(
+                recipient=self.author,
+                verb=Notification.LIKE,
+                post_id=self.post.pk,
+                window_start=self.start - timedelta(hours=hour),
+                actor_count=1,
+            )
+        first = self.client.get('/api/v1/social/notifications/?page_size=2').json()
+        self.assertEqual(len(first['results']), 2)
+        second = self.client.get(first['next']).json()
+        self.assertEqual(len(second['results']), 1)
+        self.assertIsNone(second['next'])
+
+
+@override_settings(
+    ROOT_URLCONF='image_sharing_api.asgi_urls',
+    EVENTS={'HEARTBEAT_SECONDS': 0.05, 'MAX_SECONDS': 0.2, 'MAX_PER_USER': 1},
+)
+class EventStreamTests(TestCase):
+    """Test the server-sent event stream and what publishes to it"""
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com', password='test123'
+        )
+        self.fan = User.objects.create_user(
+            username='fan', email='fan@example.com', password='test123'
+        )
+        self.token = Token.objects.create(user=self.author)
+
+    async def open_stream(self):
+        return await AsyncClient().get(
+            '/api/v1/social/events/', headers={'Authorization': f'Token {self.token.key}'}
+        )
+
+    async def test_stream_delivers_published_events(self):
+        response = await self.open_stream()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events.hub.publish([self.author.pk], 'like', {'post_id': 7})
+        events.hub.publish([self.fan.pk], 'like', {'post_id': 8})
+
+        # the stream ends after MAX_SECONDS and lets go of its slot
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertTrue(body.startswith('retry: 3000\n\n'))
+        self.assertIn('event: like\ndata: {"post_id":7}\n\n', body)
+        self.assertNotIn('"post_id":8', body)
+        self.assertIn(': ping\n\n', body)
+        self.assertEqual(events.hub.connections, 0)
+
+    async def test_connections_per_user_are_limited(self):
+        first = await self.open_stream()
+        second = await self.open_stream()
+        self.assertEqual(second.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', second)
+        [chunk async for chunk in first.streaming_content]
+        third = await self.open_stream()
+        self.assertEqual(third.status_code, status.HTTP_200_OK)
+        [chunk async for chunk in third.streaming_content]
+
+    @override_settings(EVENTS={'HEARTBEAT_SECONDS': 30, 'MAX_SECONDS': 300, 'MAX_PER_USER': 1})
+    async def test_disconnect_gives_the_slot_back(self):
+        messages = asyncio.Queue()
+        subscription = events.hub.subscribe(self.author.pk)
+        body = events.stream(subscription, messages.get)
+        self.assertTrue((await body.__anext__()).startswith('retry:'))
+
+        # the handler may be stuck in send(); the slot goes right away
+        await messages.put({'type': 'http.disconnect'})
+        await asyncio.sleep(0.01)
+        self.assertEqual(events.hub.connections, 0)
+        with self.assertRaises(StopAsyncIteration):
+            await asyncio.wait_for(body.__anext__(), 1)
+
+    async def test_unsent_streams_lose_their_slot(self):
+        await self.open_stream()
+        second = await self.open_stream()
+        self.assertEqual(second.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+        # the first response was never iterated
+        later = time.monotonic() + events.config()['START_SECONDS'] + 1
+        with mock.patch('core.events.time.monotonic', return_value=later):
+            third = await self.open_stream()
+        self.assertEqual(third.status_code, status.HTTP_200_OK)
+        [chunk async for chunk in third.streaming_content]
+
+    def test_handler_hands_the_receive_channel_to_the_request(self):
+        receive = mock.Mock()
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': '/api/v1/social/events/',
+            'query_string': b'', 'headers': [], RECEIVE_KEY: receive,
+        }
+        request, _ = AsyncViewsASGIHandler().create_request(scope, io.BytesIO())
+        self.assertIs(request.asgi_receive, receive)
+
+    def test_writes_publish_after_commit(self):
+        post = Post.objects.create(
+            user=self.author, caption='Hi', image_url='https://picsum.photos/1.jpg'
+        )
+        with mock.patch.object(events.hub, 'publish') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                Like.objects.like_post(self.fan, post)
+            publish.assert_called_once_with([self.author.pk], 'like', {'post_id': post.pk})
+
+            publish.reset_mock()
+            with self.captureOnCommitCallbacks(execute=True):
+                Follow.objects.follow_user(self.fan, self.author)
+            publish.assert_called_once_with([self.author.pk], 'follow', {'user_id': self.fan.pk})
+
+    def test_new_posts_reach_online_followers(self):
+        Follow.objects.create(follower=self.fan, following=self.author)
+        with mock.patch.object(events.hub, 'publish') as publish, mock.patch.object(
+            events.hub, 'online', return_value={self.fan.pk}
+        ):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    '/api/v1/posts/',
+                    {'caption': 'New', 'image_url': 'https://picsum.photos/2.jpg'},
+                    HTTP_AUTHORIZATION=f'Token {self.token.key}',
+                )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        followers, event, data = publish.call_args.args
+        self.assertEqual((list(followers), event), ([self.fan.pk], 'feed'))
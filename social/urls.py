@@ -33,4 +33,9 @@ urlpatterns = [
     path('suggested/', views.suggested_users, name='suggested-users'),
     path('mutual/<int:user_id>/', views.mutual_follows, name='mutual-follows'),
     path('trending/', views.trending_posts, name='trending-posts'),
+
+    # Notifications
+    path('notifications/', views.NotificationListView.as_view(), name='notifications'),
+    path('notifications/unread/', views.unread_notifications, name='unread-notifications'),
+    path('notifications/read/', views.mark_notifications_read, name='mark-notifications-read'),
 ]
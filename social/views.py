@@ -2,11 +2,12 @@ from rest_framework import generics, permissions, status
 from rest_framework.decorators import api_view, permission_classes
 
 from django.shortcuts import get_object_or_404
-from django.contrib.auth import get_user_model
 from django.db.models import Count, Exists, OuterRef
 from rest_framework.response import Response
+from core import sharding
+from core.pagination import KeysetPagination
 from posts.models import Post
-from django.db import transaction
+from users.models import live_users
 from .models import Follow
 from .serializers import (
     FollowSerializer,
@@ -16,8 +17,6 @@ from .serializers import (
     FollowStatsSerializer,
 )
 
-User = get_user_model()
-
 
 @api_view(["POST"])
 @permission_classes([permissions.IsAuthenticated])
@@ -25,7 +24,7 @@ def follow_user(request, user_id):
     """
     Follow a user
     """
-    user_to_follow = get_object_or_404(User, pk=user_id)
+    user_to_follow = get_object_or_404(live_users(), pk=user_id)
 
     # Check if trying to follow self
     if request.user == user_to_follow:
@@ -43,7 +42,7 @@ def follow_user(request, user_id):
         follower=request.user, following=user_to_follow
     )
 
-    # Update follower counts (we'll optimize this later with signals)
+    # profile follower counts are updated by the users.adjust_follow_counts task
 
     serializer = FollowSerializer(follow, context={"request": request})
     return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -56,7 +55,7 @@ def unfollow_user(request, user_id):
     Unfollow a user
     """
     try:
-        user_to_unfollow = get_object_or_404(User, pk=user_id)
+        user_to_unfollow = get_object_or_404(live_users(), pk=user_id)
 
         # Check if actually following
         if not Follow.objects.is_following(request.user, user_to_unfollow):
@@ -65,21 +64,20 @@ def unfollow_user(request, user_id):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        # Remove follow relationship
-        with transaction.atomic():
-            success = Follow.objects.unfollow_user(
-                follower=request.user, following=user_to_unfollow
-            )
+        # Remove follow relationship (the manager retries lock contention)
+        success = Follow.objects.unfollow_user(
+            follower=request.user, following=user_to_unfollow
+        )
 
-            if success:
-                return Response(
-                    {"message": f"You have unfollowed {user_to_unfollow.username}."}
-                )
-            else:
-                return Response(
-                    {"error": "Unable to unfollow user."},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
+        if success:
+            return Response(
+                {"message": f"You have unfollowed {user_to_unfollow.username}."}
+            )
+        else:
+            return Response(
+                {"error": "Unable to unfollow user."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
@@ -91,7 +89,7 @@ class UserFollowersView(generics.ListAPIView):
 
     def get_queryset(self):
         user_id = self.kwargs.get("user_id")
-        user = get_object_or_404(User, pk=user_id)
+        user = get_object_or_404(live_users(), pk=user_id)
         return Follow.objects.followers_of(user)
 
 
@@ -102,7 +100,7 @@ class UserFollowingView(generics.ListAPIView):
     def get_queryset(self):
         """Get users that the specified user is following"""
         user_id = self.kwargs.get("user_id")
-        user = get_object_or_404(User, pk=user_id)
+        user = get_object_or_404(live_users(), pk=user_id)
         return Follow.objects.following_of(user)
 
 
@@ -135,7 +133,7 @@ def follow_stats(request, user_id=None):
     Get follow statistics for a user
     """
     if user_id:
-        target_user = get_object_or_404(User, pk=user_id)
+        target_user = get_object_or_404(live_users(), pk=user_id)
     else:
         target_user = request.user
 
@@ -180,7 +178,9 @@ def suggested_users(request):
     )
 
     suggested = (
-        User.objects.exclude(id__in=list(following_ids) + [request.user.id])
+        live_users()
+        .exclude(id__in=list(following_ids) + [request.user.id])
+        .select_related("profile")
         .annotate(followers_count=Count("followers_set"))
         .order_by("-followers_count")[:10]
     )
@@ -194,7 +194,7 @@ def suggested_users(request):
 @api_view(["GET"])
 @permission_classes([permissions.IsAuthenticated])
 def mutual_follows(request, user_id):
-    target_user = get_object_or_404(User, pk=user_id)
+    target_user = get_object_or_404(live_users(), pk=user_id)
 
     if target_user == request.user:
         return Response(
@@ -211,7 +211,7 @@ def mutual_follows(request, user_id):
     )
 
     mutual_user_ids = set(current_user_following) & set(target_user_following)
-    mutual_users = User.objects.filter(id__in=mutual_user_ids)
+    mutual_users = live_users().filter(id__in=mutual_user_ids).select_related("profile")
 
     from users.serializers import UserListSerializer
 
@@ -241,7 +241,7 @@ def like_post(request, post_id):
     from posts.models import Post
 
     try:
-        post = get_object_or_404(Post, pk=post_id)
+        post = sharding.get_or_404(Post.objects.all(), pk=post_id)
 
         # Check if already liked
         if Like.objects.is_liked_by(request.user, post):
@@ -250,9 +250,8 @@ def like_post(request, post_id):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        # Create like relationship
-        with transaction.atomic():
-            like, created = Like.objects.like_post(user=request.user, post=post)
+        # Create like relationship (the manager retries lock contention)
+        like, created = Like.objects.like_post(user=request.user, post=post)
 
         serializer = LikeSerializer(like, context={"request": request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -266,7 +265,7 @@ def like_post(request, post_id):
 def unlike_post(request, post_id):
     from posts.models import Post
 
-    post = get_object_or_404(Post, pk=post_id)
+    post = sharding.get_or_404(Post.objects.all(), pk=post_id)
 
     # Check if actually liked
     if not Like.objects.is_liked_by(request.user, post):
@@ -275,17 +274,16 @@ def unlike_post(request, post_id):
             status=status.HTTP_400_BAD_REQUEST,
         )
 
-    # Remove like relationship
-    with transaction.atomic():
-        success = Like.objects.unlike_post(user=request.user, post=post)
+    # Remove like relationship (the manager retries lock contention)
+    success = Like.objects.unlike_post(user=request.user, post=post)
 
-        if success:
-            return Response({"message": "Post unliked successfully."})
-        else:
-            return Response(
-                {"error": "Unable to unlike post."},
-                status=status.HTTP_400_BAD_REQUEST,
-            )
+    if success:
+        return Response({"message": "Post unliked successfully."})
+    else:
+        return Response(
+            {"error": "Unable to unlike post."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
 
 
 class PostLikesView(generics.ListAPIView):
@@ -295,14 +293,15 @@ class PostLikesView(generics.ListAPIView):
 
     serializer_class = PostLikeSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         """Get likes for the specified post"""
         post_id = self.kwargs.get("post_id")
         from posts.models import Post
 
-        post = get_object_or_404(Post, pk=post_id)
-        return Like.objects.for_post(post).with_post_and_user()
+        post = sharding.get_or_404(Post.objects.all(), pk=post_id)
+        return Like.objects.for_post(post).with_likers()
 
 
 class UserLikesView(generics.ListAPIView):
@@ -312,11 +311,14 @@ class UserLikesView(generics.ListAPIView):
 
     serializer_class = UserLikeSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         user_id = self.kwargs.get("user_id")
-        user = get_object_or_404(User, pk=user_id)
-        return Like.objects.by_user(user).with_post_and_user()
+        user = get_object_or_404(live_users(), pk=user_id)
+        return sharding.gather(
+            Like.objects.by_user(user).with_liked_posts(self.request.user)
+        )
 
 
 class MyLikesView(generics.ListAPIView):
@@ -326,10 +328,13 @@ class MyLikesView(generics.ListAPIView):
 
     serializer_class = UserLikeSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         """Get posts liked by current user"""
-        return Like.objects.by_user(self.request.user).with_post_and_user()
+        return sharding.gather(
+            Like.objects.by_user(self.request.user).with_liked_posts(self.request.user)
+        )
 
 
 @api_view(["GET"])
@@ -339,17 +344,23 @@ def like_stats(request, user_id=None):
     Get like statistics for a user
     """
     if user_id:
-        target_user = get_object_or_404(User, pk=user_id)
+        target_user = get_object_or_404(live_users(), pk=user_id)
     else:
         target_user = request.user
 
-    total_likes_given = Like.objects.filter(user=target_user).count()
+    # likes given sit next to the liked posts, on any shard; likes received
+    # and the user's own posts on the user's shard
+    total_likes_given = sharding.count(Like.objects.filter(user=target_user))
 
-    total_likes_received = Like.objects.filter(post__user=target_user).count()
+    total_likes_received = sharding.using_shard(
+        Like.objects.filter(post__user=target_user),
+        sharding.shard_for_user(target_user.pk),
+    ).count()
 
     most_liked_post = None
     user_posts = (
-        Post.objects.filter(user=target_user)
+        Post.objects.for_author(target_user.pk)
+        .filter(user=target_user)
         .annotate(total_likes=Count("likes"))
         .order_by("-total_likes")
         .first()
@@ -364,10 +375,10 @@ def like_stats(request, user_id=None):
         }
 
     # Recent likes given by user
-    recent_likes = (
-        Like.objects.filter(user=target_user)
-        .select_related("post")
-        .order_by("-created_at")[:5]
+    recent_likes = sharding.top(
+        Like.objects.filter(user=target_user).select_related("post").order_by("-created_at"),
+        5,
+        key=sharding.recency_key,
     )
 
     recent_likes_data = []
@@ -403,15 +414,18 @@ def trending_posts(request):
 
     week_ago = timezone.now() - timedelta(days=7)
 
-    trending = (
-        Post.objects.annotate(
-            recent_likes=Count(
-                "likes", filter=models.Q(likes__created_at__gte=week_ago)
-            ),
-            total_likes=Count("likes"),
-        )
-        .filter(recent_likes__gt=0)
-        .order_by("-recent_likes", "-total_likes")[:20]
+    # joining through recent likes walks the (created_at, post) index range
+    # instead of counting every like of every post
+    # each shard ranks its own posts; the top 20 overall are among those
+    trending = sharding.top(
+        Post.objects.with_user()
+        .filter(likes__created_at__gte=week_ago)
+        .annotate(recent_likes=Count("likes"))
+        .with_like_counts()
+        .with_is_liked(request.user)
+        .order_by("-recent_likes", "-total_likes"),
+        20,
+        key=lambda post: (post.recent_likes, post.total_likes),
     )
 
     from posts.serializers import PostListSerializer
@@ -419,3 +433,57 @@ def trending_posts(request):
     serializer = PostListSerializer(trending, many=True, context={"request": request})
 
     return Response(serializer.data)
+
+
+from users.models import UserProfile, list_columns
+from . import notifications
+from .models import Notification
+from .serializers import NotificationSerializer
+
+
+class NotificationPagination(KeysetPagination):
+    ordering = ("-updated_at", "-id")
+    datetime_fields = ("updated_at",)
+
+
+class NotificationListView(generics.ListAPIView):
+    """
+    The current user's notifications, most recently active first
+    """
+
+    serializer_class = NotificationSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = NotificationPagination
+
+    def get_queryset(self):
+        return (
+            Notification.objects.filter(recipient=self.request.user)
+            .select_related("last_actor", "last_actor__profile")
+            .only(
+                "verb", "post_id", "actor_count", "read_at", "window_start",
+                "updated_at", *list_columns("last_actor"),
+            )
+        )
+
+
+@api_view(["GET"])
+@permission_classes([permissions.IsAuthenticated])
+def unread_notifications(request):
+    """
+    Number of unread notifications, from the profile's counter
+    """
+    unread = (
+        UserProfile.objects.filter(user=request.user)
+        .values_list("unread_notifications", flat=True)
+        .first()
+    )
+    return Response({"unread": unread or 0})
+
+
+@api_view(["POST"])
+@permission_classes([permissions.IsAuthenticated])
+def mark_notifications_read(request):
+    """
+    Mark all of the current user's notifications read
+    """
+    return Response({"marked_read": notifications.mark_read(request.user), "unread": 0})
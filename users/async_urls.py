@@ -0,0 +1,7 @@
+from django.urls import path
+from . import async_views
+
+urlpatterns = [
+    path('register/', async_views.register),
+    path('login/', async_views.login),
+]
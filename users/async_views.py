@@ -0,0 +1,119 @@
+"""
+Async variants of the login and register views, served under ASGI.
+
+Password hashing runs on the dedicated hashing pool so a login burst can't
+tie up the threads serving the rest of the API. Responses match the sync
+views in ``users.views``.
+"""
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import check_password, make_password
+from django.db import transaction
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+
+from core.asyncapi import async_api_view, json_response, request_data
+from core.routers import mark_recent_write
+from .hashing import HashingPoolSaturated, hashing_pool
+from .serializers import UserSerializer, UserDetailSerializer
+
+User = get_user_model()
+
+
+def _saturated_response():
+    return json_response(
+        {"error": "Too many authentication requests, please retry shortly"},
+        status=status.HTTP_429_TOO_MANY_REQUESTS,
+        headers={"Retry-After": "1"},
+    )
+
+
+def _verify_password(password, encoded):
+    """Return (matches, needs_rehash) without touching the database"""
+    needs_rehash = []
+    matches = check_password(password, encoded, setter=needs_rehash.append)
+    return matches, bool(needs_rehash)
+
+
+@sync_to_async
+def _create_account(serializer, password_hash):
+    with transaction.atomic():
+        user = serializer.save(password_hash=password_hash)
+        token, created = Token.objects.get_or_create(user=user)
+        mark_recent_write(user.pk)
+        return {
+            "user": UserDetailSerializer(user).data,
+            "token": token.key,
+        }
+
+
+@sync_to_async
+def _user_payload(user):
+    return UserDetailSerializer(user).data
+
+
+@async_api_view(["POST"], authenticated=False)
+async def register(request):
+    """
+    Register a new user and return authentication token
+    """
+    serializer = UserSerializer(data=request_data(request))
+    if not await sync_to_async(serializer.is_valid)():
+        return json_response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        password_hash = await hashing_pool.run(
+            make_password, serializer.validated_data["password"]
+        )
+    except HashingPoolSaturated:
+        return _saturated_response()
+
+    data = await _create_account(serializer, password_hash)
+    return json_response(data, status=status.HTTP_201_CREATED)
+
+
+@async_api_view(["POST"], authenticated=False)
+async def login(request):
+    """
+    Authenticate user and return token
+    """
+    data = request_data(request)
+    username = data.get("username")
+    password = data.get("password")
+
+    if not username or not password:
+        return json_response(
+            {"error": "Username and password are required"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    user = await (
+        User.objects.select_related("profile")
+        .filter(**{User.USERNAME_FIELD: username})
+        .afirst()
+    )
+
+    try:
+        if user is None:
+            # hash anyway so unknown usernames take as long as bad passwords
+            await hashing_pool.run(make_password, password)
+            matches = False
+        else:
+            matches, needs_rehash = await hashing_pool.run(
+                _verify_password, password, user.password
+            )
+            if matches and needs_rehash:
+                user.password = await hashing_pool.run(make_password, password)
+                await user.asave(update_fields=["password"])
+    except HashingPoolSaturated:
+        return _saturated_response()
+
+    if matches and user.is_active:
+        token, created = await Token.objects.aget_or_create(user=user)
+        return json_response(
+            {"user": await _user_payload(user), "token": token.key}
+        )
+
+    return json_response(
+        {"error": "Invalid credentials"}, status=status.HTTP_401_UNAUTHORIZED
+    )
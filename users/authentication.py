@@ -0,0 +1,111 @@
+import copy
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+
+from core.cache import TTLLRUCache
+
+_cache_settings = getattr(settings, "AUTH_TOKEN_CACHE", {})
+
+token_cache = TTLLRUCache(
+    "auth-token",
+    maxsize=_cache_settings.get("MAX_ENTRIES", 10000),
+    ttl=_cache_settings.get("TTL", 300),
+    backend=_cache_settings.get("BACKEND"),
+    local_ttl=_cache_settings.get("LOCAL_TTL"),
+)
+
+
+def _detach(token):
+    """
+    Copy a cached token together with its user and profile so a request
+    can't mutate the instances other requests are reading.
+    """
+    user = copy.copy(token.user)
+    token = copy.copy(token)
+    token.user = user
+    user.auth_token = token
+
+    profile = user._state.fields_cache.get("profile")
+    if profile is not None:
+        profile = copy.copy(profile)
+        profile.user = user
+        user._state.fields_cache["profile"] = profile
+
+    return token
+
+
+def invalidate_token(key):
+    token_cache.delete(key)
+
+
+def invalidate_user(user_id):
+    """Drop cached credentials for every token belonging to a user"""
+    from rest_framework.authtoken.models import Token
+
+    keys = list(Token.objects.filter(user_id=user_id).values_list("key", flat=True))
+    if keys:
+        token_cache.delete_many(keys)
+
+
+def _check_active(token):
+    if not token.user.is_active:
+        raise exceptions.AuthenticationFailed(_("User inactive or deleted."))
+    return _detach(token)
+
+
+def _token_queryset():
+    from rest_framework.authtoken.models import Token
+
+    return Token.objects.select_related("user", "user__profile")
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication that loads token, user and profile in one joined
+    query and keeps the result in a bounded TTL cache.
+    """
+
+    def authenticate_credentials(self, key):
+        token = token_cache.get(key)
+
+        if token is None:
+            token = _token_queryset().filter(key=key).first()
+            if token is None:
+                raise exceptions.AuthenticationFailed(_("Invalid token."))
+            token_cache.set(key, token)
+
+        token = _check_active(token)
+        return (token.user, token)
+
+
+async def aauthenticate(request):
+    """
+    Authenticate a plain Django request for the native async views.
+
+    Same rules and cache as ``CachedTokenAuthentication``; raises
+    ``NotAuthenticated`` when no token was sent.
+    """
+    auth = get_authorization_header(request).split()
+    if not auth or auth[0].lower() != CachedTokenAuthentication.keyword.lower().encode():
+        raise exceptions.NotAuthenticated()
+    if len(auth) != 2:
+        raise exceptions.AuthenticationFailed(_("Invalid token header."))
+    try:
+        key = auth[1].decode()
+    except UnicodeError:
+        raise exceptions.AuthenticationFailed(_("Invalid token header."))
+
+    token = token_cache.get(key)
+    if token is None:
+        token = await _token_queryset().filter(key=key).afirst()
+        if token is None:
+            raise exceptions.AuthenticationFailed(_("Invalid token."))
+        token_cache.set(key, token)
+
+    token = _check_active(token)
+    request.user = token.user
+    request.auth = token
+    return token.user
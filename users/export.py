@@ -0,0 +1,159 @@
+"""
+Streaming export of everything one user has: posts, likes, followers and
+the accounts they follow, as NDJSON or CSV.
+
+Rows are read in keyset-ordered chunks of ``CHUNK_SIZE``: each chunk is
+one short query that resumes after the last row of the previous one, so
+memory stays flat however many rows a user has and no read transaction is
+held open while the client drains the response. Lines are grouped into
+pieces of about ``PIECE_BYTES`` so the server doesn't write row by row.
+"""
+import csv
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+from django.http import StreamingHttpResponse
+
+from core import sharding
+from core.pagination import keyset_after
+from posts.models import Post
+from social.models import Follow, Like
+
+CHUNK_SIZE = 1000
+PIECE_BYTES = 64 * 1024
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+CSV_COLUMNS = [
+    "type", "id", "post_id", "user_id", "username", "caption", "image_url", "created_at",
+]
+
+
+def keyset_iterator(queryset, keys, chunk_size=CHUNK_SIZE):
+    """
+    Yield the ``values()`` rows of ``queryset`` ordered by ``keys``, one
+    query per chunk. ``keys`` must be unique together and part of the rows.
+    """
+    queryset = queryset.order_by(*keys)
+    last = None
+    while True:
+        chunk = queryset if last is None else queryset.filter(keyset_after(keys, last))
+        count = 0
+        for row in chunk[:chunk_size].iterator(chunk_size=chunk_size):
+            count += 1
+            last = row
+            yield row
+        if count < chunk_size:
+            return
+
+
+def export_rows(user_id, chunk_size=CHUNK_SIZE):
+    """Every exported row of the user, one dict per row"""
+    posts = (
+        Post.objects.for_author(user_id)
+        .filter(user_id=user_id)
+        .values("id", "caption", "image_url", "created_at")
+    )
+    for row in keyset_iterator(posts, ("created_at", "id"), chunk_size):
+        yield {"type": "post", **row}
+
+    # likes sit on the shard of the liked post, so every shard has some
+    for likes in sharding.on_shards(Like.objects.filter(user_id=user_id)):
+        likes = likes.values("id", "post_id", "created_at")
+        for row in keyset_iterator(likes, ("created_at", "id"), chunk_size):
+            yield {"type": "like", **row}
+
+    followers = Follow.objects.filter(following_id=user_id).values(
+        "id", "created_at", "follower_id", username=F("follower__username")
+    )
+    for row in keyset_iterator(followers, ("created_at", "id"), chunk_size):
+        yield {
+            "type": "follower",
+            "id": row["id"],
+            "user_id": row["follower_id"],
+            "username": row["username"],
+            "created_at": row["created_at"],
+        }
+
+    # the (follower, following) unique index orders these without a sort
+    following = Follow.objects.filter(follower_id=user_id).values(
+        "id", "created_at", "following_id", username=F("following__username")
+    )
+    for row in keyset_iterator(following, ("following_id",), chunk_size):
+        yield {
+            "type": "following",
+            "id": row["id"],
+            "user_id": row["following_id"],
+            "username": row["username"],
+            "created_at": row["created_at"],
+        }
+
+
+def ndjson_lines(rows):
+    encoder = DjangoJSONEncoder(separators=(",", ":"))
+    for row in rows:
+        yield encoder.encode(row) + "\n"
+
+
+class _Echo:
+    """File-like object handing back what csv writes to it"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.DictWriter(_Echo(), fieldnames=CSV_COLUMNS)
+    yield writer.writeheader()
+    for row in rows:
+        if row.get("created_at") is not None:
+            row["created_at"] = row["created_at"].isoformat()
+        yield writer.writerow(row)
+
+
+def pieces(lines, size=PIECE_BYTES):
+    """Join lines into roughly ``size``-byte pieces"""
+    buffer, buffered = [], 0
+    for line in lines:
+        buffer.append(line)
+        buffered += len(line)
+        if buffered >= size:
+            yield "".join(buffer)
+            buffer, buffered = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def export_lines(user_id, output="ndjson", chunk_size=CHUNK_SIZE):
+    rows = export_rows(user_id, chunk_size)
+    return ndjson_lines(rows) if output == "ndjson" else csv_lines(rows)
+
+
+async def _aiterate(iterator):
+    """
+    Drive a sync iterator from an async response, one piece at a time.
+    Django would otherwise read a sync iterator into a list under ASGI.
+    """
+    step = sync_to_async(next, thread_sensitive=True)
+    try:
+        while True:
+            piece = await step(iterator, None)
+            if piece is None:
+                return
+            yield piece
+    finally:
+        await sync_to_async(iterator.close, thread_sensitive=True)()
+
+
+def export_response(request, user, output="ndjson"):
+    content = pieces(export_lines(user.pk, output))
+    if hasattr(request, "scope"):  # served by the ASGI handler
+        content = _aiterate(content)
+    response = StreamingHttpResponse(content, content_type=FORMATS[output])
+    response["Content-Disposition"] = f'attachment; filename="{user.username}-export.{output}"'
+    response["Cache-Control"] = "no-store"
+    return response
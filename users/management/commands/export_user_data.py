@@ -0,0 +1,35 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from users.export import CHUNK_SIZE, FORMATS, export_lines, pieces
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Export a user's posts, likes, followers and following as NDJSON or CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument("user", help="Username or user id")
+        parser.add_argument("--output", choices=list(FORMATS), default="ndjson")
+        parser.add_argument("--file", help="Write to this file instead of stdout")
+        parser.add_argument(
+            "--chunk-size", type=int, default=CHUNK_SIZE, help="Rows fetched per query"
+        )
+
+    def handle(self, *args, **options):
+        lookup = options["user"]
+        field = "pk" if lookup.isdigit() else "username"
+        try:
+            user = User.objects.get(**{field: lookup})
+        except User.DoesNotExist:
+            raise CommandError(f"No user {lookup!r}")
+
+        lines = export_lines(user.pk, options["output"], options["chunk_size"])
+        if options["file"]:
+            with open(options["file"], "w", newline="", encoding="utf-8") as f:
+                f.writelines(pieces(lines))
+            self.stderr.write(f"Exported {user.username} to {options['file']}")
+        else:
+            for piece in pieces(lines):
+                self.stdout.write(piece, ending="")
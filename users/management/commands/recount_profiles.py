@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from core import sharding
+from posts.models import Post
+from social.models import Follow, Notification
+from users.models import UserProfile
+from users.tasks import _update_profile
+
+COUNTERS = ("followers_count", "following_count", "posts_count", "unread_notifications")
+
+
+def _counts(querysets, field, ids):
+    """``{user id: rows}`` of the ``querysets`` grouped on ``field``, summed"""
+    totals = {}
+    for queryset in querysets:
+        grouped = queryset.filter(**{f"{field}__in": ids}).order_by().values(field)
+        for row in grouped.annotate(rows=Count("pk")):
+            totals[row[field]] = totals.get(row[field], 0) + row["rows"]
+    return totals
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount the follower, following, post and unread notification counters "
+        "of every profile from the rows themselves; writes only apply deltas"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Profiles per batch")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        fixed = checked = 0
+        last_id = 0
+        while True:
+            profiles = list(
+                UserProfile.objects.filter(user_id__gt=last_id)
+                .order_by("user_id")
+                .values("user_id", *COUNTERS)[:batch_size]
+            )
+            if not profiles:
+                break
+            last_id = profiles[-1]["user_id"]
+            ids = [profile["user_id"] for profile in profiles]
+            actual = {
+                "followers_count": _counts([Follow.objects.all()], "following_id", ids),
+                "following_count": _counts([Follow.objects.all()], "follower_id", ids),
+                # posts live on their author's shard
+                "posts_count": _counts(sharding.on_shards(Post.objects.all()), "user_id", ids),
+                "unread_notifications": _counts(
+                    [Notification.objects.filter(read_at__isnull=True)], "recipient_id", ids
+                ),
+            }
+            with transaction.atomic():
+                for profile in profiles:
+                    user_id = profile["user_id"]
+                    changes = {
+                        counter: actual[counter].get(user_id, 0)
+                        for counter in COUNTERS
+                        if profile[counter] != actual[counter].get(user_id, 0)
+                    }
+                    if changes:
+                        _update_profile(user_id, **changes)
+                        fixed += 1
+            checked += len(profiles)
+        self.stdout.write(self.style.SUCCESS(f"{fixed} of {checked} profile(s) corrected"))
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-19 00:59
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='user',
+            name='auth_user_usernam_f2740e_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='user',
+            name='auth_user_email_ece7f7_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='userprofile',
+            name='users_userp_user_id_d181df_idx',
+        ),
+    ]
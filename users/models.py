@@ -9,6 +9,8 @@ class User(AbstractUser):
     email = models.EmailField(unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # set when the account is deleted; core.purge removes it later
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
 
     # Add related_name to avoid conflicts
     groups = models.ManyToManyField(
@@ -33,9 +35,8 @@ class User(AbstractUser):
 
     class Meta:
         db_table = 'auth_user'
+        # username and email are already indexed by their unique constraints
         indexes = [
-            models.Index(fields=['username']),
-            models.Index(fields=['email']),
             models.Index(fields=['created_at']),
         ]
 
@@ -50,6 +51,8 @@ class UserProfile(models.Model):
     followers_count = models.PositiveIntegerField(default=0)
     following_count = models.PositiveIntegerField(default=0)
     posts_count = models.PositiveIntegerField(default=0)
+    # maintained by social.notifications
+    unread_notifications = models.PositiveIntegerField(default=0)
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -58,8 +61,8 @@ class UserProfile(models.Model):
         return f"{self.user.username}'s profile"
 
     class Meta:
+        # user is already indexed by the one-to-one unique constraint
         indexes = [
-            models.Index(fields=['user']),
             models.Index(fields=['followers_count']),
             models.Index(fields=['following_count']),
         ]
@@ -81,3 +84,21 @@ class UserProfile(models.Model):
         """Check if this user is followed by another user"""
         from social.models import Follow
         return Follow.objects.is_following(user, self)
+
+
+def live_users():
+    """Accounts that haven't been soft-deleted"""
+    return User.objects.filter(deleted_at__isnull=True)
+
+
+# The user and profile columns UserListSerializer reads
+LIST_COLUMNS = (
+    'username', 'first_name', 'last_name', 'profile', 'profile__bio',
+    'profile__avatar_url', 'profile__followers_count', 'profile__following_count',
+    'profile__posts_count',
+)
+
+
+def list_columns(relation):
+    """``only()`` arguments loading LIST_COLUMNS through ``relation``, e.g. ``user``"""
+    return (relation, *(f'{relation}__{column}' for column in LIST_COLUMNS))
@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
 from .models import UserProfile
@@ -52,9 +53,15 @@ class UserSerializer(serializers.ModelSerializer):
         """Create user with hashed password and profile"""
         validated_data.pop('password_confirm', None)
         password = validated_data.pop('password')
-        
-        user = User.objects.create_user(**validated_data)
-        user.set_password(password)
+        # async register hashes off-thread and hands the result in
+        password_hash = validated_data.pop('password_hash', None)
+
+        validated_data['username'] = User.normalize_username(validated_data['username'])
+        validated_data['email'] = User.objects.normalize_email(validated_data.get('email'))
+
+        # hash once and insert once, create_user + set_password did both twice
+        user = User(**validated_data)
+        user.password = password_hash or make_password(password)
         user.save()
         
         # Create user profile
@@ -0,0 +1,37 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from core import conditional, objects
+
+from .authentication import invalidate_token, invalidate_user
+from .models import UserProfile
+
+User = get_user_model()
+
+
+@receiver(post_delete, sender=Token)
+def drop_cached_token(sender, instance, **kwargs):
+    """Logout deletes the token, so it must stop authenticating right away"""
+    invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def drop_cached_user(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+    conditional.bump_on_commit(
+        [conditional.author_key(instance.pk)], using=kwargs['using']
+    )
+    objects.invalidate_on_commit(objects.USER, [instance.pk], using=kwargs['using'])
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def drop_cached_profile(sender, instance, **kwargs):
+    invalidate_user(instance.user_id)
+    conditional.bump_on_commit(
+        [conditional.author_key(instance.user_id)], using=kwargs['using']
+    )
+    objects.invalidate_on_commit(objects.USER, [instance.user_id], using=kwargs['using'])
@@ -0,0 +1,49 @@
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from core import conditional, objects, sharding
+from core.tasks import task
+from .authentication import invalidate_user
+from .models import UserProfile
+
+
+def _update_profile(user_id, **changes):
+    """Update a profile on the primary and copy the result to every shard"""
+    # update() skips auto_now, and updated_at is the profile's Last-Modified
+    changes['updated_at'] = timezone.now()
+    profiles = UserProfile.objects.using(DEFAULT_DB_ALIAS).filter(user_id=user_id)
+    profiles.update(**changes)
+    conditional.bump_on_commit([conditional.author_key(user_id)])
+    objects.invalidate_on_commit(objects.USER, [user_id])
+    # cached tokens carry the profile
+    transaction.on_commit(lambda: invalidate_user(user_id))
+    if sharding.enabled():
+        values = profiles.values(*changes).first()
+        if values is not None:
+            for alias in sharding.shard_aliases():
+                UserProfile.objects.using(alias).filter(user_id=user_id).update(**values)
+
+
+@task('users.adjust_follow_counts')
+def adjust_follow_counts(follower_id, following_id, delta):
+    """
+    Runs in the same transaction that marks the task done (both live on the
+    primary), so each follow or unfollow is counted exactly once
+    """
+    _update_profile(
+        follower_id, following_count=Greatest(F('following_count') + delta, Value(0))
+    )
+    _update_profile(
+        following_id, followers_count=Greatest(F('followers_count') + delta, Value(0))
+    )
+
+
+@task('users.recount_posts')
+def recount_posts(user_id):
+    """Posts live on the author's shard, so recount instead of incrementing"""
+    from posts.models import Post
+
+    count = Post.objects.for_author(user_id).filter(user_id=user_id).count()
+    _update_profile(user_id, posts_count=count)
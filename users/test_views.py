@@ -1,8 +1,28 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncClient, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
 from rest_framework.authtoken.models import Token
+from core import changes, objects, purge, tasks
+from core.models import ChangeLogEntry
+from core.purge import soft_delete_user
+from posts.models import Post
+from social.models import Follow, Like
+from users.authentication import token_cache
+from users.export import export_rows
+from users.hashing import hashing_pool
+from users.models import UserProfile
 import uuid
 
 User = get_user_model()
@@ -115,3 +135,413 @@ class UserListTests(APITestCase):
         """Test unauthenticated user cannot access user list"""
         response = self.client.get('/api/v1/users/')
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class CachedTokenAuthenticationTests(APITestCase):
+    """Test the cached token authentication"""
+
+    def setUp(self):
+        self.client = APIClient()
+        unique_id = str(uuid.uuid4())[:8]
+        self.user = User.objects.create_user(
+            username=f'cached_{unique_id}',
+            email=f'cached_{unique_id}@example.com',
+            password='testpass123'
+        )
+        UserProfile.objects.create(user=self.user)
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_cache_hit_skips_auth_queries(self):
+        """Only the view's own queries (validators, then the user) run once the token is cached"""
+        self.client.get('/api/v1/users/me/')
+        self.assertIsNotNone(token_cache.get(self.token.key))
+
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/v1/users/me/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_logout_invalidates_cached_token(self):
+        """A deleted token must not keep authenticating from the cache"""
+        self.client.get('/api/v1/users/me/')
+
+        response = self.client.post('/api/v1/users/logout/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.get('/api/v1/users/me/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_profile_update_invalidates_cached_token(self):
+        """Profile and user writes evict the cached credentials"""
+        self.client.get('/api/v1/users/me/')
+
+        self.user.profile.bio = 'Updated bio'
+        self.user.profile.save()
+        self.assertIsNone(token_cache.get(self.token.key))
+
+        self.client.get('/api/v1/users/me/')
+        self.user.save()
+        self.assertIsNone(token_cache.get(self.token.key))
+
+
+class ExportTests(APITestCase):
+    """Streaming export of a user's data"""
+
+    def setUp(self):
+        unique_id = str(uuid.uuid4())[:8]
+        self.user = User.objects.create_user(
+            username=f'exporter_{unique_id}',
+            email=f'exporter_{unique_id}@example.com',
+            password='testpass123',
+        )
+        self.others = [
+            User.objects.create_user(
+                username=f'other_{i}_{unique_id}',
+                email=f'other_{i}_{unique_id}@example.com',
+                password='testpass123',
+            )
+            for i in range(3)
+        ]
+        self.posts = [
+            Post.objects.create(
+                user=self.user, caption=f'post {i}', image_url='https://picsum.photos/1.jpg'
+            )
+            for i in range(5)
+        ]
+        other_post = Post.objects.create(
+            user=self.others[0], caption='theirs', image_url='https://picsum.photos/2.jpg'
+        )
+        Like.objects.create(user=self.user, post=other_post)
+        for other in self.others:
+            Follow.objects.create(follower=other, following=self.user)
+        Follow.objects.create(follower=self.user, following=self.others[1])
+        self.client.force_authenticate(self.user)
+
+    def test_ndjson_export(self):
+        """Every post, like, follower and followed account is one line"""
+        response = self.client.get('/api/v1/users/me/export/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+
+        body = b''.join(response.streaming_content).decode()
+        rows = [json.loads(line) for line in body.splitlines()]
+        types = [row['type'] for row in rows]
+        self.assertEqual(types, ['post'] * 5 + ['like'] + ['follower'] * 3 + ['following'])
+        self.assertEqual([row['id'] for row in rows[:5]], [p.pk for p in self.posts])
+        self.assertEqual(rows[-1]['user_id'], self.others[1].pk)
+
+    def test_csv_export(self):
+        response = self.client.get('/api/v1/users/me/export/', {'output': 'csv'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('attachment', response['Content-Disposition'])
+
+        body = b''.join(response.streaming_content).decode()
+        rows = list(csv.DictReader(io.StringIO(body)))
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(rows[0]['caption'], 'post 0')
+        self.assertEqual(rows[-1]['username'], self.others[1].username)
+
+    async def test_asgi_export_is_streamed_asynchronously(self):
+        """Under ASGI the rows are pulled piece by piece, not read into a list"""
+        token = await Token.objects.acreate(user=self.user)
+        response = await AsyncClient().get(
+            '/api/v1/users/me/export/', headers={'Authorization': f'Token {token.key}'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.is_async)
+        body = b''.join([piece async for piece in response.streaming_content])
+        self.assertEqual(len(body.decode().splitlines()), 10)
+
+    def test_unknown_output_is_rejected(self):
+        response = self.client.get('/api/v1/users/me/export/', {'output': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_rows_are_read_in_keyset_chunks(self):
+        """Each chunk is its own query and no row is repeated or skipped"""
+        with CaptureQueriesContext(connection) as queries:
+            rows = list(export_rows(self.user.pk, chunk_size=2))
+        self.assertEqual([row['id'] for row in rows[:5]], [p.pk for p in self.posts])
+        self.assertEqual(len(rows), 10)
+        # posts 3 chunks, likes 1, followers 2, following 1
+        self.assertEqual(len(queries), 7)
+
+    def test_management_command(self):
+        out = io.StringIO()
+        call_command('export_user_data', self.user.username, '--output', 'csv', stdout=out)
+        rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+        self.assertEqual(len(rows), 10)
+
+
+class SyncChangesTests(APITestCase):
+    """Delta sync through the change log"""
+
+    def setUp(self):
+        def make_user(name):
+            return User.objects.create_user(
+                username=name, email=f'{name}@example.com', password='testpass123'
+            )
+
+        self.user = make_user('syncer')
+        self.author = make_user('followed')
+        self.stranger = make_user('stranger')
+        Follow.objects.follow_user(self.user, self.author)
+        self.my_post = Post.objects.create(
+            user=self.user, caption='Mine', image_url='https://picsum.photos/1.jpg'
+        )
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.author_client = APIClient()
+        self.author_client.credentials(
+            HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.author).key}'
+        )
+
+    def sync(self, token):
+        response = self.client.get('/api/v1/users/me/changes/', {'token': token})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+    def test_changes_since_token(self):
+        start = self.client.get('/api/v1/users/me/changes/').json()
+        self.assertEqual(start['changes'], [])
+
+        self.author_client.post(
+            '/api/v1/posts/', {'caption': 'Hello', 'image_url': 'https://picsum.photos/2.jpg'}
+        )
+        post_id = Post.objects.get(caption='Hello').pk
+        self.author_client.patch(f'/api/v1/posts/{post_id}/', {'caption': 'Edited'})
+        Post.objects.create(
+            user=self.stranger, caption='Unrelated', image_url='https://picsum.photos/3.jpg'
+        )
+        like, _ = Like.objects.like_post(self.author, self.my_post)
+        follow, _ = Follow.objects.follow_user(self.stranger, self.user)
+
+        page = self.sync(start['token'])
+        self.assertFalse(page['has_more'])
+        by_type = {change['type']: change for change in page['changes']}
+        self.assertEqual(len(page['changes']), 3)
+        # two writes to the post collapse into its current state
+        self.assertEqual(by_type['post']['id'], post_id)
+        self.assertEqual(by_type['post']['data']['caption'], 'Edited')
+        self.assertEqual(by_type['like']['data']['post_id'], self.my_post.pk)
+        self.assertEqual(by_type['follow']['data']['follower_id'], self.stranger.pk)
+
+        self.author_client.delete(f'/api/v1/posts/{post_id}/')
+        Like.objects.unlike_post(self.author, self.my_post)
+        page = self.sync(page['token'])
+        self.assertEqual(
+            sorted((c['type'], c['op'], c['id']) for c in page['changes']),
+            [('like', 'delete', like.pk), ('post', 'delete', post_id)],
+        )
+        self.assertNotIn('data', page['changes'][0])
+        self.assertEqual(self.sync(page['token'])['changes'], [])
+
+    def test_purged_account_leaves_tombstones(self):
+        like, _ = Like.objects.like_post(self.author, self.my_post)
+        follow = Follow.objects.get(follower=self.user, following=self.author)
+        start = self.client.get('/api/v1/users/me/changes/').json()['token']
+
+        soft_delete_user(self.author)
+        purge.run_pending(pause=0)
+        page = self.sync(start)
+        self.assertEqual(
+            {(c['type'], c['op'], c['id']) for c in page['changes']},
+            {('like', 'delete', like.pk), ('follow', 'delete', follow.pk)},
+        )
+
+    def test_pages_resume_from_the_token(self):
+        start = self.client.get('/api/v1/users/me/changes/').json()['token']
+        for i in range(3):
+            Post.objects.create(
+                user=self.author, caption=f'P{i}', image_url='https://picsum.photos/2.jpg'
+            )
+            changes.record_post(Post.objects.latest('id'))
+        with override_settings(CHANGELOG={'PAGE_SIZE': 2}):
+            first = self.sync(start)
+            second = self.sync(first['token'])
+        self.assertTrue(first['has_more'])
+        self.assertEqual(len(first['changes']) + len(second['changes']), 3)
+
+    def test_unfinished_pages_keep_the_token_age(self):
+        start = self.client.get('/api/v1/users/me/changes/').json()['token']
+        _, issued = changes.decode_token(start)
+        for i in range(3):
+            Post.objects.create(
+                user=self.author, caption=f'P{i}', image_url='https://picsum.photos/2.jpg'
+            )
+            changes.record_post(Post.objects.latest('id'))
+        later = issued + 29 * 24 * 3600
+        with override_settings(CHANGELOG={'PAGE_SIZE': 2}), \
+                mock.patch('core.changes.time.time', return_value=later):
+            first = self.sync(start)
+            second = self.sync(first['token'])
+            self.assertEqual(changes.decode_token(first['token'])[1], issued)
+            # the end of the log was reached, so nothing older is unread
+            self.assertFalse(second['has_more'])
+            self.assertEqual(changes.decode_token(second['token'])[1], later)
+
+    def test_bad_and_expired_tokens(self):
+        response = self.client.get('/api/v1/users/me/changes/', {'token': 'nope'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        token = self.client.get('/api/v1/users/me/changes/').json()['token']
+        later = time.time() + changes.config()['RETENTION_SECONDS'] + 60
+        with mock.patch('core.changes.time.time', return_value=later):
+            response = self.client.get('/api/v1/users/me/changes/', {'token': token})
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+
+    def test_compaction_drops_old_entries(self):
+        ChangeLogEntry.objects.update(created_at=timezone.now() - timedelta(days=365))
+        Like.objects.like_post(self.author, self.my_post)
+        out = io.StringIO()
+        call_command('compact_changelog', stdout=out)
+        # the follow from setUp
+        self.assertIn('1 change log row(s) removed', out.getvalue())
+        self.assertEqual(ChangeLogEntry.objects.get().kind, ChangeLogEntry.LIKE)
+
+
+@override_settings(ROOT_URLCONF='image_sharing_api.asgi_urls')
+class AsyncAuthenticationTests(TestCase):
+    """Test the async login and register views"""
+
+    def setUp(self):
+        unique_id = str(uuid.uuid4())[:8]
+        self.user_data = {
+            'username': f'async_{unique_id}',
+            'email': f'async_{unique_id}@example.com',
+            'password': 'testpass123',
+            'password_confirm': 'testpass123',
+        }
+
+    async def test_register_and_login(self):
+        """Register then login through the async views"""
+        client = AsyncClient()
+        response = await client.post(
+            '/api/v1/users/register/', self.user_data, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn('token', response.json())
+
+        user = await User.objects.aget(username=self.user_data['username'])
+        self.assertTrue(user.check_password('testpass123'))
+
+        response = await client.post(
+            '/api/v1/users/login/',
+            {'username': user.username, 'password': 'testpass123'},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['user']['username'], user.username)
+
+        response = await client.post(
+            '/api/v1/users/login/',
+            {'username': user.username, 'password': 'wrong-password'},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    async def test_saturated_hashing_pool_rejects_login(self):
+        """Logins past the pending limit are turned away with a 429"""
+        with mock.patch.object(hashing_pool, '_pending', hashing_pool.max_pending):
+            response = await AsyncClient().post(
+                '/api/v1/users/login/',
+                {'username': 'anyone', 'password': 'testpass123'},
+                content_type='application/json',
+            )
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+
+class ConditionalUserTests(APITestCase):
+    """Test 304 responses for the user endpoints"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', email='alice@example.com', password='pw')
+        self.other = User.objects.create_user(username='bob', email='bob@example.com', password='pw')
+        UserProfile.objects.create(user=self.user)
+        UserProfile.objects.create(user=self.other)
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def test_not_modified_since_last_modified(self):
+        response = self.client.get('/api/v1/users/me/')
+        self.assertIn('Last-Modified', response)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                '/api/v1/users/me/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+            )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_profile_update_changes_etag(self):
+        etag = self.client.get('/api/v1/users/bob/')['ETag']
+        response = self.client.get(f'/api/v1/users/{self.other.pk}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.other.profile.bio = 'Hello'
+        self.other.profile.save()
+        response = self.client.get('/api/v1/users/bob/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['profile']['bio'], 'Hello')
+
+    def test_deleted_user_is_not_found(self):
+        etag = self.client.get(f'/api/v1/users/{self.other.pk}/')['ETag']
+        # leaves updated_at alone, so the ETag would still match
+        soft_delete_user(self.other)
+        for lookup in (self.other.pk, 'bob'):
+            response = self.client.get(f'/api/v1/users/{lookup}/', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_counter_update_changes_etag(self):
+        """Counters are written with update(), which must still move updated_at"""
+        etag = self.client.get('/api/v1/users/bob/')['ETag']
+        self.client.post(f'/api/v1/social/follow/{self.other.pk}/')
+        tasks.run_pending(threads=0)
+
+        response = self.client.get('/api/v1/users/bob/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['profile']['followers_count'], 1)
+
+
+class UserBatchTests(APITestCase):
+    """Test hydrating users by id"""
+
+    def setUp(self):
+        objects.object_cache.clear()
+        self.users = [
+            User.objects.create_user(username=f'batch_{i}', email=f'batch_{i}@example.com', password='pw')
+            for i in range(3)
+        ]
+        for user in self.users:
+            UserProfile.objects.create(user=user)
+        self.client.force_authenticate(self.users[0])
+
+    def batch(self, ids):
+        return self.client.get('/api/v1/users/batch/', {'ids': ','.join(map(str, ids))})
+
+    def test_keeps_order_and_marks_missing(self):
+        ids = [self.users[2].pk, 999999, self.users[1].pk]
+        with self.assertNumQueries(1):
+            response = self.batch(ids)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()['results']
+        self.assertEqual(results[0]['username'], 'batch_2')
+        self.assertIsNone(results[1])
+        self.assertEqual(results[2]['profile']['posts_count'], 0)
+        self.assertEqual(response.json()['missing'], [999999])
+
+        with self.assertNumQueries(0):
+            self.batch(ids)
+
+    def test_profile_changes_drop_cached_users(self):
+        user = self.users[1]
+        self.batch([user.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            user.profile.bio = 'Hello'
+            user.profile.save()
+        self.assertEqual(self.batch([user.pk]).json()['results'][0]['profile']['bio'], 'Hello')
+
+    def test_deleted_users_are_missing(self):
+        user = self.users[2]
+        user.deleted_at = timezone.now()
+        user.save()
+        self.assertEqual(self.batch([user.pk]).json()['missing'], [user.pk])
@@ -12,5 +12,8 @@ urlpatterns = [
     # User management endpoints
     path('', views.UserListView.as_view(), name='user-list'),
     path('me/', views.CurrentUserView.as_view(), name='current-user'),
+    path('me/export/', views.export_data, name='export-data'),
+    path('me/changes/', views.sync_changes, name='sync-changes'),
+    path('batch/', views.user_batch, name='user-batch'),
     path('<str:pk>/', views.UserDetailView.as_view(), name='user-detail'),
 ]
@@ -5,7 +5,11 @@ from rest_framework.authtoken.models import Token
 from django.contrib.auth import authenticate, get_user_model
 from django.db import transaction
 from django.shortcuts import get_object_or_404
-from .models import UserProfile
+from core import changes, conditional, objects
+from core.purge import soft_delete_user
+from core.routers import mark_recent_write
+from .export import FORMATS, export_response
+from .models import UserProfile, live_users
 from .serializers import (
     UserSerializer, UserListSerializer, UserDetailSerializer
 )
@@ -25,6 +29,8 @@ def register(request):
         with transaction.atomic():
             user = serializer.save()
             token, created = Token.objects.get_or_create(user=user)
+            # the request is anonymous, so pin the new account explicitly
+            mark_recent_write(user.pk)
             
             return Response({
                 'user': UserDetailSerializer(user).data,
@@ -85,10 +91,37 @@ class UserListView(generics.ListAPIView):
     
     def get_queryset(self):
         """Optimized queryset with select_related for profile"""
-        return User.objects.select_related('profile').order_by('username')
+        return live_users().select_related('profile').order_by('username')
 
 
-class UserDetailView(generics.RetrieveUpdateAPIView):
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def user_batch(request):
+    """
+    Users for ``?ids=1,2,3`` in the order asked, ``null`` for ids that
+    don't exist (or are deleted), which are also listed under ``missing``
+    """
+    try:
+        ids = objects.parse_ids(request.GET.get('ids', ''))
+    except ValueError as exc:
+        return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(objects.in_order(ids, objects.users(ids)))
+
+
+def user_validators(queryset):
+    """
+    ETag and Last-Modified of the one user in ``queryset``, from the
+    timestamps of the account and its profile. Logins only touch
+    last_login, which is part of the body too.
+    """
+    row = queryset.values('id', 'updated_at', 'last_login', 'profile__updated_at').first()
+    if row is None:
+        return None, None
+    stamps = [value for key, value in row.items() if key != 'id' and value is not None]
+    return conditional.make_etag('user', *row.values()), max(stamps)
+
+
+class UserDetailView(conditional.ConditionalGetMixin, generics.RetrieveUpdateAPIView):
     """
     Retrieve or update user details
     """
@@ -96,27 +129,89 @@ class UserDetailView(generics.RetrieveUpdateAPIView):
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrReadOnly]
     
     def get_queryset(self):
-        """Optimized queryset with select_related for profile"""
-        return User.objects.select_related('profile')
-    
-    def get_object(self):
-        """Get user by ID or username"""
+        """Optimized queryset with select_related for profile; deleted accounts are gone"""
+        return live_users().select_related('profile')
+
+    def get_lookup(self):
+        """Look the user up by ID or username"""
         lookup_value = self.kwargs.get('pk')
-        
         if lookup_value.isdigit():
-            return get_object_or_404(self.get_queryset(), pk=lookup_value)
-        else:
-            return get_object_or_404(self.get_queryset(), username=lookup_value)
+            return {'pk': lookup_value}
+        return {'username': lookup_value}
+
+    def get_validators(self, request):
+        # a deleted account has no validators, so even a stale ETag gets the 404
+        return user_validators(self.get_queryset().filter(**self.get_lookup()))
 
+    def get_object(self):
+        """Get user by ID or username"""
+        return get_object_or_404(self.get_queryset(), **self.get_lookup())
 
-class CurrentUserView(generics.RetrieveUpdateAPIView):
+
+class CurrentUserView(conditional.ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     """
-    Retrieve or update current user's profile
+    Retrieve, update or delete current user's profile
     """
     serializer_class = UserDetailSerializer
     permission_classes = [permissions.IsAuthenticated]
+
+    def get_validators(self, request):
+        return user_validators(User.objects.filter(pk=request.user.pk))
     
     def get_object(self):
         """Return current user with profile"""
         user = User.objects.select_related('profile').get(pk=self.request.user.pk)
         return user
+
+    def destroy(self, request, *args, **kwargs):
+        """
+        Deactivate the account and hide its posts now; the rows are
+        removed in batches by the purge_deleted worker
+        """
+        job = soft_delete_user(request.user)
+        return Response(
+            {'message': 'Account scheduled for deletion', 'purge_job': job.pk},
+            status=status.HTTP_202_ACCEPTED
+        )
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def export_data(request):
+    """
+    Stream the current user's posts, likes, followers and following
+    as NDJSON (default) or CSV: ?output=ndjson|csv
+    """
+    output = request.query_params.get('output', 'ndjson')
+    if output not in FORMATS:
+        return Response(
+            {'error': f"output must be one of: {', '.join(FORMATS)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    return export_response(request, request.user, output)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def sync_changes(request):
+    """
+    What changed for the current user since ?token=: timeline posts,
+    likes and follows, as current state or tombstones. Without a token,
+    only the token to sync from after a full download.
+    """
+    token = request.query_params.get('token')
+    if not token:
+        return Response(
+            {'changes': [], 'token': changes.encode_token(changes.head()), 'has_more': False}
+        )
+    try:
+        positions, issued = changes.decode_token(token)
+    except changes.InvalidToken:
+        return Response({'error': 'Invalid sync token'}, status=status.HTTP_400_BAD_REQUEST)
+    except changes.TokenExpired:
+        return Response(
+            {'error': 'Sync token expired, download everything again'},
+            status=status.HTTP_410_GONE
+        )
+    entries, token, has_more = changes.changes_for(request.user, positions, issued)
+    return Response({'changes': entries, 'token': token, 'has_more': has_more})